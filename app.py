@@ -1,17 +1,29 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_redis import FlaskRedis
 from rq import Queue
 import json
 import os
+from contextlib import ExitStack
 import openai
 import logging
 import redis
-import textwrap
 from twilio.twiml.messaging_response import MessagingResponse
-from utils import log_event
+from utils import log_event, split_sms, SmsChunker
 from dotenv import load_dotenv
 from sarah_db_client import SarahDBClient
+from context_cache import RedisContextCache
+from idempotency import RedisIdempotencyStore
+from coalescer import RedisMessageCoalescer, join_messages
+from conversation_locks import conversation_locks, ConversationBusy
+from tasks import reply_to_inbound_sms, apply_conversation_state_job, enqueue_in_order
 from vapi_caller import trigger_vapi_call, is_business_hours, next_business_window
+from due_index import FollowupDueIndex, STRATEGY_FILE, load_strategy
+from rate_limiter import RATE_LIMIT_WEBHOOK_WAIT, rate_limiter
+from circuit_breaker import breakers, get_circuit_stats
+from metrics import COALESCED_METRIC, count, span, turn, render_metrics
+from upstream_clients import upstream_clients
+from prompts import REPLY_PROMPT, REPLY_AND_STATE_PROMPT, STATE_UPDATE_PROMPT, get_prompt_stats, window_history
+from summaries import compact_summary, merge_summary, narrative_of, with_event
 
 # Initialize basic logger
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +44,15 @@ CORE_API_KEY = os.getenv('CORE_API_KEY')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-5.2')
 MAKE_WEBHOOK_URL = os.getenv('MAKE_WEBHOOK_URL')
+CONTEXT_CACHE_ENABLED = os.getenv('CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+# "sync" replies inline via TwiML; "async" acks Twilio immediately and replies from an rq job
+SMS_REPLY_MODE = os.getenv('SMS_REPLY_MODE', 'sync').lower()
+# "deferred" runs CRM state analysis on an rq worker after the reply; "inline" keeps it in the turn
+STATE_UPDATE_MODE = os.getenv('STATE_UPDATE_MODE', 'deferred').lower()
+# One structured completion for reply + CRM fields instead of two (falls back on parse failure)
+LLM_SINGLE_CALL = os.getenv('LLM_SINGLE_CALL', 'false').lower() == 'true'
+# Async reply mode only: text each bubble as soon as the streamed completion finishes it
+SMS_STREAMING = os.getenv('SMS_STREAMING', 'false').lower() == 'true'
 
 if not CORE_API_KEY:
     logger.error("CORE_API_KEY is missing!")
@@ -42,244 +63,126 @@ if not MAKE_WEBHOOK_URL:
 
 # Initialize Clients
 openai.api_key = OPENAI_API_KEY
-db_client = SarahDBClient(api_key=CORE_API_KEY)
+# Completions reuse one pooled keep-alive session instead of the SDK's per-thread ones
+openai.requestssession = upstream_clients.sdk_session("openai")
+context_cache = RedisContextCache(redis_client) if CONTEXT_CACHE_ENABLED else None
+db_client = SarahDBClient(api_key=CORE_API_KEY, cache=context_cache, rate_limiter=rate_limiter,
+                          rate_limit_wait=RATE_LIMIT_WEBHOOK_WAIT, circuit_breaker=breakers["core_api"])
+# Next follow-up time per context, read by the cron worker; follows edits to the strategy file (see due_index.py)
+due_index = FollowupDueIndex(redis_client, load_strategy(), strategy_file=STRATEGY_FILE)
+# TwiML response per Twilio MessageSid, so webhook retries never run a turn twice
+inbound_dedupe = RedisIdempotencyStore(redis_client)
+# Bursts of texts from one lead become one turn (see coalescer.py)
+coalescer = RedisMessageCoalescer(redis_client)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "service": "follow-up-agent"}), 200
 
-def generate_smart_reply(context_data, user_input):
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage and turn latency histograms (Prometheus text format), across all processes."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "context_cache": db_client.get_cache_stats(),
+        "core_api_connections": db_client.get_connection_stats(),
+        "upstream_connections": upstream_clients.get_stats(),
+        "prompts": get_prompt_stats(),
+        "rate_limits": rate_limiter.get_stats(),
+        "circuits": get_circuit_stats(),
+        "inbound_dedupe": inbound_dedupe.get_stats(),
+        "conversation_locks": conversation_locks.get_stats()
+    }), 200
+
+CALENDAR_FUNCTIONS = [
+    {
+        "name": "get_availability",
+        "description": "Call this ONLY when the user wants to schedule a FUTURE appointment (not an immediate call). Use this when they mention a specific day or time like 'tomorrow at 2pm' or 'next Tuesday'. DO NOT use for immediate calls.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "datetime_string": {
+                    "type": "string",
+                    "description": "The date and time the user wants for a future appointment (e.g., 'Tomorrow at 2pm', 'Next Tuesday morning')."
+                }
+            },
+            "required": ["datetime_string"]
+        }
+    },
+    {
+        "name": "book_appointment",
+        "description": "Call this ONLY after checking availability for a FUTURE appointment and the user has provided their email. This is for scheduled meetings, not immediate calls.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "datetime_string": {
+                    "type": "string",
+                    "description": "The exact confirmed date and time to book."
+                },
+                "phone_number": {
+                    "type": "string",
+                    "description": "The user's confirmed phone number."
+                },
+                "email": {
+                    "type": "string",
+                    "description": "The user's confirmed email address."
+                }
+            },
+            "required": ["datetime_string", "phone_number", "email"]
+        }
+    }
+]
+
+def build_reply_messages(context_data, user_input, template=REPLY_PROMPT):
     """
-    Generate a 'Wonderbot-style' context-aware reply using all available DB columns.
+    Build the 'Wonderbot-style' chat messages (static system prompt + lead
+    dashboard + history + new message) using all available DB columns.
     """
-    # 1. Extract Rich Context Variables
     customer = context_data.get('customer', {})
-    name = customer.get('name', 'there')
-    summary = context_data.get('summary', 'New conversation')
-    intent = context_data.get('intent', 'unknown')
-    sentiment = context_data.get('sentiment', 'neutral')
-    history = context_data.get('history', [])
-
-    # 2. Format Recent History (Last 5 messages for flow)
-    recent_dialogue = ""
-    if history:
-        for msg in reversed(history[:5]):
-            role = "User" if msg['direction'] == 'inbound' else "Sarah"
-            content = msg.get('message_body', '')
-            recent_dialogue += f"{role}: {content}\n"
-
-    # 3. Construct the 'Omniscient' Prompt
-    system_prompt = f"""
-You are Sarah, an AI consultant for **Kalkia Évolution IA** — we help businesses automate and scale using AI.
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📊 YOUR DASHBOARD
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-- **Lead Name:** {name}
-- **Current Stage:** {intent}
-- **Sentiment:** {sentiment}
-- **Conversation Summary:** "{summary}"
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🎯 YOUR MISSION
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-**Goal:** Qualify leads and get them on a call. You succeed when you book a consultation OR get permission to call them.
-
-**Strategy:** DISCOVER → QUALIFY → ESCALATE
-
-1. **DISCOVER** (if you don't know yet):
-   - What's their business or role?
-   - What problem are they trying to solve?
-
-2. **QUALIFY** (gauge fit & urgency):
-   - Are they exploring or actively looking for a solution?
-   - Do they have a timeline? ("soon", "this quarter", "just researching")
-   - Are they the decision-maker or gathering info for someone?
-
-3. **ESCALATE** (based on interest signals):
-   - **Warm signals:** Asks questions, engages positively, mentions a problem
-     → Proactively suggest: "Would a quick call be easier? I can call you in 2 minutes to explain."
-   - **Hot signals:** Asks about pricing, timeline, implementation, or says they're "ready"
-     → Offer immediate call: "Can I call you right now? I can answer everything in a quick 5-min call."
-   - **When they say YES to a call:**
-     → Simply confirm: "Perfect! Calling you now." (The system will trigger a VAPI call automatically)
-     → DO NOT ask for times or check calendar — just get permission and confirm the call is happening
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🛠️ WHAT WE OFFER (match to their need)
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-1. **AI Receptionist** – Bilingual, books appointments, takes orders, sends confirmations
-2. **AI Sales Agents** – Makes calls to close deals or capture leads
-3. **AI Chatbots** – Website or business ecosystem integration
-4. **Custom Automation Agents** – Tailored workflows for business processes
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📞 CALL PERMISSION (Primary Goal)
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-- Your PRIMARY goal is to get permission to call them immediately
-- Ask: "Can I call you right now?" or "Want a quick call to discuss this?"
-- If YES (during business hours 9AM-8PM ET) → Confirm: "Great! I'll call you in 1 minute."
-- If YES (after business hours) → Suggest next business window: "It's a bit late right now — how about I call you [tomorrow at 9 AM]? That way I can give you my full attention."
-  - If they INSIST ("no, call me now", "I don't mind", "just call") → Confirm: "You got it! Calling you now."
-- If NO/LATER → Ask when: "No problem! When's a good time for me to call?"
-- DO NOT check calendar for immediate calls — just get permission and confirm
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📅 APPOINTMENT BOOKING (Only for Future Scheduled Meetings)
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-Use calendar functions ONLY when they want to schedule a future appointment (not immediate calls):
-1. If they mention a specific day/time for a FUTURE meeting → call `get_availability`
-2. If slot is open → ask for their email (you have their phone)
-3. Once you have email → call `book_appointment` to finalize
-⚠️ NEVER say "booked" unless `book_appointment` succeeded.
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-💬 COMMUNICATION STYLE
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-- **Language:** Match the user (English or Quebec French)
-- **Tone:** Warm, consultative, confident — NOT robotic or salesy
-- **Length:** Keep messages short (2-3 sentences max for SMS)
-- **Be proactive:** Suggest immediate calls when they show interest
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🚫 AVOID
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-- Don't over-explain products in text — save details for the call
-- Don't ask multiple questions at once — one question per message
-- Don't check calendar for IMMEDIATE calls — just ask "Can I call you now?"
-- Don't use functions when confirming immediate calls — just text confirmation
-- After confirming call, don't keep chatting — let the phone call happen
-    """
 
-    messages = [{"role": "system", "content": system_prompt}]
-    
+    # Static instructions go first (cacheable prefix); the lead's dashboard follows them
+    dashboard = template.render(
+        name=customer.get('name', 'there'),
+        intent=context_data.get('intent', 'unknown'),
+        sentiment=context_data.get('sentiment', 'neutral'),
+        summary=context_data.get('summary', 'New conversation')
+    )
     # 2.5 Inject true message history so OpenAI natively understands its function call role
-    if history:
-        for msg in reversed(history[:8]):
-            role = "user" if msg['direction'] == 'inbound' else "assistant"
-            content = msg.get('message_body', '')
-            messages.append({"role": role, "content": content})
-            
-    messages.append({"role": "user", "content": user_input})
-
-    functions = [
-        {
-            "name": "get_availability",
-            "description": "Call this ONLY when the user wants to schedule a FUTURE appointment (not an immediate call). Use this when they mention a specific day or time like 'tomorrow at 2pm' or 'next Tuesday'. DO NOT use for immediate calls.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "datetime_string": {
-                        "type": "string",
-                        "description": "The date and time the user wants for a future appointment (e.g., 'Tomorrow at 2pm', 'Next Tuesday morning')."
-                    }
-                },
-                "required": ["datetime_string"]
-            }
-        },
-        {
-            "name": "book_appointment",
-            "description": "Call this ONLY after checking availability for a FUTURE appointment and the user has provided their email. This is for scheduled meetings, not immediate calls.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "datetime_string": {
-                        "type": "string",
-                        "description": "The exact confirmed date and time to book."
-                    },
-                    "phone_number": {
-                        "type": "string",
-                        "description": "The user's confirmed phone number."
-                    },
-                    "email": {
-                        "type": "string",
-                        "description": "The user's confirmed email address."
-                    }
-                },
-                "required": ["datetime_string", "phone_number", "email"]
-            }
-        }
-    ]
+    # (the most recent turns that fit HISTORY_TOKEN_BUDGET, bodies only)
+    dialogue = window_history(context_data.get('history', []))
+
+    dialogue.append({"role": "user", "content": user_input})
+    return template.messages({"role": "system", "content": dashboard}, *dialogue)
+
+def generate_smart_reply(context_data, user_input):
+    """
+    Generate a 'Wonderbot-style' context-aware reply using all available DB columns.
+    """
+    messages = build_reply_messages(context_data, user_input)
 
     try:
         print("DEBUG: Generating Smart Reply...")
-        completion = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
-            messages=messages,
-            tools=[{"type": "function", "function": functions[0]}],
-            tool_choice="auto",
-            max_completion_tokens=300,
-            temperature=0.7 
-        )
+        rate_limiter.require("openai", OPENAI_MODEL, max_wait=RATE_LIMIT_WEBHOOK_WAIT)
+        with span("openai.reply"):
+            completion = breakers["openai"].call(
+                openai.ChatCompletion.create,
+                model=OPENAI_MODEL,
+                messages=messages,
+                tools=[{"type": "function", "function": CALENDAR_FUNCTIONS[0]}],
+                tool_choice="auto",
+                max_completion_tokens=300,
+                temperature=0.7 
+            )
         
         response_message = completion.choices[0].message
         
         # Check if the model wants to call the webhook function
-        if hasattr(response_message, "tool_calls") and response_message.tool_calls:
-            tool_call = response_message.tool_calls[0]
-            func_name = tool_call.function.name
-            try:
-                func_args = json.loads(tool_call.function.arguments)
-            except:
-                func_args = {}
-                
-            if func_name in ["get_availability", "book_appointment"]:
-                print(f"DEBUG: AI calling {func_name}: {func_args}")
-                
-                # Make the Webhook Call (Matching Vapi Structure for Make.com)
-                webhook_payload = {
-                    "message": {
-                        "type": "tool_calls",
-                        "toolCalls": [
-                            {
-                                "id": "call_" + str(context_data.get('customer_id', 'sms')),
-                                "type": "function",
-                                "function": {
-                                    "name": func_name,
-                                    "arguments": json.dumps(func_args)
-                                }
-                            }
-                        ]
-                    },
-                    "customer_data": {
-                        "phone": customer.get("phone_normalized", "unknown"),
-                        "name": name,
-                        "email": customer.get("email", ""),
-                        "customer_id": context_data.get('customer_id'),
-                        "context_id": context_data.get('context_id')
-                    }
-                }
-                
-                if not MAKE_WEBHOOK_URL:
-                    function_result = '{"status": "error", "message": "MAKE_WEBHOOK_URL environment variable not configured"}'
-                    print(f"❌ {function_result}")
-                else:
-                    try:
-                        import requests
-                        wh_resp = requests.post(MAKE_WEBHOOK_URL, json=webhook_payload, timeout=10)
-                        function_result = wh_resp.text if wh_resp.text else '{"status": "success", "message": "Request processed but no text returned."}'
-                        print(f"DEBUG: Webhook response: {function_result}")
-                    except Exception as e:
-                        function_result = f'{{"status": "error", "message": "Make.com Webhook timeout/error: {e}"}}'
-                        print(function_result)
-
-                # Send the webhook's response back to the LLM
-                messages.append(response_message)
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": func_name,
-                    "content": function_result
-                })
-                
-                print("DEBUG: Asking LLM to interpret the webhook result and reply to user...")
-                second_completion = openai.ChatCompletion.create(
-                    model=OPENAI_MODEL,
-                    messages=messages,
-                    max_completion_tokens=300,
-                    temperature=0.7
-                )
-                return second_completion.choices[0].message.content.strip()
+        tool_reply = handle_calendar_tool_call(response_message, messages, context_data)
+        if tool_reply is not None:
+            return tool_reply
 
         # If no function was called, just return the normal text reply
         return response_message.content.strip()
@@ -288,102 +191,236 @@ Use calendar functions ONLY when they want to schedule a future appointment (not
         print(f"DEBUG: OpenAI Reply Error: {e}")
         return "I'm analyzing that... one moment."
 
-def update_conversation_state(old_summary, history, user_input, ai_reply):
+def calendar_tool_call(response_message):
+    """(tool_call, func_name, func_args) if the model asked for a calendar function, else None."""
+    if not (hasattr(response_message, "tool_calls") and response_message.tool_calls):
+        return None
+    tool_call = response_message.tool_calls[0]
+    func_name = tool_call.function.name
+    try:
+        func_args = json.loads(tool_call.function.arguments)
+    except:
+        func_args = {}
+    if func_name not in ["get_availability", "book_appointment"]:
+        return None
+    return tool_call, func_name, func_args
+
+def calendar_webhook_payload(func_name, func_args, context_data):
+    """The Make.com webhook body for a calendar call (matching Vapi's tool-call structure)."""
+    customer = context_data.get('customer', {})
+    return {
+        "message": {
+            "type": "tool_calls",
+            "toolCalls": [
+                {
+                    "id": "call_" + str(context_data.get('customer_id', 'sms')),
+                    "type": "function",
+                    "function": {
+                        "name": func_name,
+                        "arguments": json.dumps(func_args)
+                    }
+                }
+            ]
+        },
+        "customer_data": {
+            "phone": customer.get("phone_normalized", "unknown"),
+            "name": customer.get('name', 'there'),
+            "email": customer.get("email", ""),
+            "customer_id": context_data.get('customer_id'),
+            "context_id": context_data.get('context_id')
+        }
+    }
+
+MAKE_NOT_CONFIGURED_RESULT = '{"status": "error", "message": "MAKE_WEBHOOK_URL environment variable not configured"}'
+MAKE_CIRCUIT_OPEN_RESULT = '{"status": "error", "message": "Calendar service is temporarily unavailable. Offer to confirm the time by text later."}'
+MAKE_EMPTY_RESULT = '{"status": "success", "message": "Request processed but no text returned."}'
+
+def add_tool_result(messages, response_message, tool_call, func_name, function_result):
+    """Appends the tool call and the webhook's response for the model's second completion."""
+    messages.append(response_message)
+    messages.append({
+        "role": "tool",
+        "tool_call_id": tool_call.id,
+        "name": func_name,
+        "content": function_result
+    })
+
+def handle_calendar_tool_call(response_message, messages, context_data):
     """
-    Update Summary AND Sentiment based on the exchange.
-    Returns a dict with {summary, sentiment, extracted_name, extracted_email, booking_requested, interest_level, product_interest, call_recommended}
+    If the model asked for a calendar function, run it through the Make.com
+    webhook and return the model's follow-up reply. Returns None otherwise.
     """
-    prompt = f"""
-Analyze this conversation exchange and update the CRM records.
-
-**Context:**
-- Old Summary: "{old_summary}"
-- User Message: "{user_input}"
-- Sarah's Reply: "{ai_reply}"
-
-**Task:** Return a JSON object with these fields:
-
-1. "summary": Updated concise summary (include what product/problem they discussed)
-
-2. "sentiment": User's emotional state
-   - "positive" = engaged, interested, friendly
-   - "neutral" = just responding, unclear intent
-   - "negative" = frustrated, annoyed, objecting
-   - "confused" = unclear, asking for clarification
-
-3. "extracted_name": User's name if mentioned (e.g., "I'm Shiva" → "Shiva"), else null
-
-4. "extracted_email": User's email if provided, else null
-
-5. "booking_requested": true if user:
-   - Explicitly asks to book/schedule a FUTURE appointment
-   - Agrees to a call (says "yes", "sure", "ok", "call me" when Sarah offered a call)
-   - Wants a callback or to talk to someone
-
-6. "interest_level": Assess their buying intent
-   - "hot" = mentions timeline, asks about pricing, says they're ready, agrees to call NOW
-   - "warm" = asks questions, engages positively, describes a problem they have
-   - "cold" = short replies, seems uninterested, just browsing
-
-7. "product_interest": Which product they seem most interested in (or null):
-   - "ai_receptionist"
-   - "ai_sales_agent"
-   - "ai_chatbot"
-   - "custom_automation"
-   - null (if unclear)
+    call = calendar_tool_call(response_message)
+    if call is None:
+        return None
+    tool_call, func_name, func_args = call
+    print(f"DEBUG: AI calling {func_name}: {func_args}")
+
+    # Make the Webhook Call (Matching Vapi Structure for Make.com)
+    webhook_payload = calendar_webhook_payload(func_name, func_args, context_data)
+
+    if not MAKE_WEBHOOK_URL:
+        function_result = MAKE_NOT_CONFIGURED_RESULT
+        print(f"❌ {function_result}")
+    elif not breakers["make"].allow():
+        function_result = MAKE_CIRCUIT_OPEN_RESULT
+        print(f"⚡ Make.com circuit open, skipping webhook")
+    elif not rate_limiter.acquire("make", max_wait=RATE_LIMIT_WEBHOOK_WAIT):
+        function_result = MAKE_CIRCUIT_OPEN_RESULT
+        print("⏳ Make.com rate limit reached, skipping webhook")
+    else:
+        try:
+            with span("make_webhook"):
+                wh_resp = upstream_clients.session("make").post(MAKE_WEBHOOK_URL, json=webhook_payload)
+            if wh_resp.status_code >= 500 or wh_resp.status_code == 429:
+                breakers["make"].record_failure()
+            else:
+                breakers["make"].record_success()
+            function_result = wh_resp.text if wh_resp.text else MAKE_EMPTY_RESULT
+            print(f"DEBUG: Webhook response: {function_result}")
+        except Exception as e:
+            breakers["make"].record_failure(e)
+            function_result = f'{{"status": "error", "message": "Make.com Webhook timeout/error: {e}"}}'
+            print(function_result)
+
+    # Send the webhook's response back to the LLM
+    add_tool_result(messages, response_message, tool_call, func_name, function_result)
+
+    print("DEBUG: Asking LLM to interpret the webhook result and reply to user...")
+    rate_limiter.require("openai", OPENAI_MODEL, max_wait=RATE_LIMIT_WEBHOOK_WAIT)
+    with span("openai.reply_after_tool"):
+        second_completion = breakers["openai"].call(
+            openai.ChatCompletion.create,
+            model=OPENAI_MODEL,
+            messages=messages,
+            max_completion_tokens=300,
+            temperature=0.7
+        )
+    return second_completion.choices[0].message.content.strip()
 
-8. "call_recommended": true if Sarah should offer to call them NOW based on:
-   - They asked multiple questions
-   - They described a specific pain point
-   - Sentiment is positive and they're engaged
-   - They asked about pricing or timeline
-   - They agreed when Sarah offered a call
+def stream_smart_reply(context_data, user_input, on_chunk):
+    """
+    Streaming variant of generate_smart_reply (SMS_STREAMING=true, async reply mode).
+    Consumes the completion as a token stream and calls on_chunk(bubble) as soon as
+    each SMS bubble is final; bubbles match split_sms() on the full reply.
+    Returns the full reply text. Calendar tool calls fall back to generate_smart_reply.
+    """
+    messages = build_reply_messages(context_data, user_input)
+    chunker = SmsChunker()
 
-9. "call_timing": When do they want the call? Only set if booking_requested is true:
-   - "now" = they want an immediate call ("call me", "yes", "sure" in response to call offer)
-   - "scheduled" = they specified a future time ("tomorrow at 2pm", "next week")
-   - "persistent" = they are INSISTING on an immediate call after being told it is after hours
-   - null = no call requested
+    try:
+        print("DEBUG: Streaming Smart Reply...")
+        rate_limiter.require("openai", OPENAI_MODEL, max_wait=RATE_LIMIT_WEBHOOK_WAIT)
+        with span("openai.reply_stream_open"):
+            stream = breakers["openai"].call(
+                openai.ChatCompletion.create,
+                model=OPENAI_MODEL,
+                messages=messages,
+                tools=[{"type": "function", "function": CALENDAR_FUNCTIONS[0]}],
+                tool_choice="auto",
+                max_completion_tokens=300,
+                temperature=0.7,
+                stream=True
+            )
+        for event in stream:
+            if not event["choices"]:
+                continue
+            delta = event["choices"][0].get("delta", {})
+            if delta.get("tool_calls") and not chunker.text:
+                print("DEBUG: Model chose a calendar tool, using the non-streaming path")
+                reply_text = generate_smart_reply(context_data, user_input)
+                for chunk in split_sms(reply_text):
+                    on_chunk(chunk)
+                return reply_text
+            content = delta.get("content") or ""
+            if not chunker.text:
+                content = content.lstrip()  # Match split_sms() on the stripped reply
+            for chunk in chunker.feed(content):
+                on_chunk(chunk)
 
-10. "scheduled_call_time": If call_timing is "scheduled", extract the requested date/time as a string (e.g., "tomorrow at 2pm", "Monday morning"). null otherwise.
+    except Exception as e:
+        print(f"DEBUG: OpenAI Stream Error: {e}")
+        if not chunker.text.strip():
+            chunker.feed("I'm analyzing that... one moment.")
+
+    for chunk in chunker.close():
+        on_chunk(chunk)
+    return chunker.text.strip()
+
+CRM_SENTIMENTS = {"positive", "neutral", "negative", "confused"}
+CRM_INTEREST_LEVELS = {"hot", "warm", "cold"}
+CRM_CALL_TIMINGS = {"now", "scheduled", "persistent", None}
+
+def parse_llm_json(response_text):
+    """Parse a JSON reply from the model, tolerating ```json fences. Raises ValueError."""
+    response_text = response_text.strip()
+    # Handle potential markdown code blocks like ```json ... ```
+    if response_text.startswith("```json") and response_text.endswith("```"):
+        response_text = response_text[7:-3].strip()
+    elif response_text.startswith("```") and response_text.endswith("```"):
+        response_text = response_text[3:-3].strip()
+    return json.loads(response_text)
+
+def validate_crm_fields(parsed_data):
+    """Returns a list of schema problems with a parsed CRM object (empty = valid)."""
+    if not isinstance(parsed_data, dict):
+        return ["not a JSON object"]
+    problems = []
+    if not isinstance(parsed_data.get("summary"), str) or not parsed_data.get("summary"):
+        problems.append("summary must be a non-empty string")
+    if parsed_data.get("sentiment") not in CRM_SENTIMENTS:
+        problems.append(f"sentiment must be one of {sorted(CRM_SENTIMENTS)}")
+    if parsed_data.get("interest_level") not in CRM_INTEREST_LEVELS:
+        problems.append(f"interest_level must be one of {sorted(CRM_INTEREST_LEVELS)}")
+    if not isinstance(parsed_data.get("booking_requested", False), bool):
+        problems.append("booking_requested must be a boolean")
+    if not isinstance(parsed_data.get("call_recommended", False), bool):
+        problems.append("call_recommended must be a boolean")
+    if parsed_data.get("call_timing") not in CRM_CALL_TIMINGS:
+        problems.append("call_timing must be now, scheduled, persistent or null")
+    return problems
+
+def normalize_crm_fields(parsed_data, old_summary):
+    """Map a parsed CRM object onto the state dict the rest of the turn expects."""
+    return {
+        "summary": parsed_data.get("summary", old_summary),
+        "sentiment": parsed_data.get("sentiment", "neutral"),
+        "extracted_name": parsed_data.get("extracted_name"),
+        "extracted_email": parsed_data.get("extracted_email"),
+        "booking_requested": parsed_data.get("booking_requested", False),
+        "interest_level": parsed_data.get("interest_level", "cold"),
+        "product_interest": parsed_data.get("product_interest"),
+        "call_recommended": parsed_data.get("call_recommended", False),
+        "call_timing": parsed_data.get("call_timing"),
+        "scheduled_call_time": parsed_data.get("scheduled_call_time")
+    }
 
-Return raw JSON only (no markdown formatting).
+def update_conversation_state(old_summary, history, user_input, ai_reply):
+    """
+    Update Summary AND Sentiment based on the exchange.
+    Returns a dict with {summary, sentiment, extracted_name, extracted_email, booking_requested, interest_level, product_interest, call_recommended, call_timing, scheduled_call_time}
     """
+    messages = STATE_UPDATE_PROMPT.messages({
+        "role": "user",
+        "content": STATE_UPDATE_PROMPT.render(old_summary=old_summary, user_input=user_input, ai_reply=ai_reply)
+    })
 
     try:
         print("DEBUG: Updating State...")
-        completion = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_completion_tokens=350,
-            temperature=0.3
-        )
+        rate_limiter.acquire("openai", OPENAI_MODEL)
+        with span("openai.state"):
+            completion = breakers["openai"].call(
+                openai.ChatCompletion.create,
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_completion_tokens=350,
+                temperature=0.3
+            )
         response_text = completion.choices[0].message.content.strip()
         
         # Try to parse the JSON string to extract the actual fields
         try:
-            # Handle potential markdown code blocks like ```json ... ```
-            if response_text.startswith("```json") and response_text.endswith("```"):
-                response_text = response_text[7:-3].strip()
-            elif response_text.startswith("```") and response_text.endswith("```"):
-                response_text = response_text[3:-3].strip()
-                
-            parsed_data = json.loads(response_text)
-            
-            # Extract fields
-            summary_text = parsed_data.get("summary", old_summary)
-            sentiment_val = parsed_data.get("sentiment", "neutral")
-            
-            return {
-                "summary": summary_text,
-                "sentiment": sentiment_val,
-                "extracted_name": parsed_data.get("extracted_name"),
-                "extracted_email": parsed_data.get("extracted_email"),
-                "booking_requested": parsed_data.get("booking_requested", False),
-                "interest_level": parsed_data.get("interest_level", "cold"),
-                "product_interest": parsed_data.get("product_interest"),
-                "call_recommended": parsed_data.get("call_recommended", False)
-            }
+            return normalize_crm_fields(parse_llm_json(response_text), old_summary)
         except json.JSONDecodeError:
             print(f"DEBUG: Failed to parse JSON from AI: {response_text}")
             # Fallback: Just return the raw text as summary if it wasn't valid JSON
@@ -402,76 +439,275 @@ Return raw JSON only (no markdown formatting).
             "sentiment": "neutral"
         }
 
+def generate_reply_and_state(context_data, user_input):
+    """
+    Single-call mode (LLM_SINGLE_CALL=true): one completion returns both the
+    SMS reply and the CRM fields, validated against the CRM schema.
+    Returns (reply_text, state_updates). state_updates is None when the caller
+    must fall back to the two-call path's analysis: the model used a calendar
+    tool, or its output failed to parse or validate.
+    """
+    messages = build_reply_messages(context_data, user_input, REPLY_AND_STATE_PROMPT)
+
+    try:
+        print("DEBUG: Generating Reply + State (single call)...")
+        rate_limiter.require("openai", OPENAI_MODEL, max_wait=RATE_LIMIT_WEBHOOK_WAIT)
+        with span("openai.reply_and_state"):
+            completion = breakers["openai"].call(
+                openai.ChatCompletion.create,
+                model=OPENAI_MODEL,
+                messages=messages,
+                tools=[{"type": "function", "function": CALENDAR_FUNCTIONS[0]}],
+                tool_choice="auto",
+                response_format={"type": "json_object"},
+                max_completion_tokens=650,
+                temperature=0.5
+            )
+        response_message = completion.choices[0].message
+    except Exception as e:
+        print(f"DEBUG: Single-call reply failed ({e}), falling back to two calls")
+        return generate_smart_reply(context_data, user_input), None
+
+    # Calendar lookups need a second completion anyway. Once the webhook has run
+    # (a booking may exist), never ask the model again: that could book twice
+    if calendar_tool_call(response_message) is not None:
+        tool_messages = build_reply_messages(context_data, user_input)
+        try:
+            return handle_calendar_tool_call(response_message, tool_messages, context_data), None
+        except Exception as e:
+            print(f"DEBUG: Reply after calendar tool failed: {e}")
+            return "I'm analyzing that... one moment.", None
+
+    try:
+        parsed_data = parse_llm_json(response_message.content or "")
+        problems = validate_crm_fields(parsed_data)
+        reply_text = parsed_data.get("reply") if isinstance(parsed_data, dict) else None
+        if not isinstance(reply_text, str) or not reply_text.strip():
+            problems.append("reply must be a non-empty string")
+        if problems:
+            raise ValueError("; ".join(problems))
+
+        return reply_text.strip(), normalize_crm_fields(parsed_data, context_data.get('summary', ''))
+
+    except Exception as e:
+        print(f"DEBUG: Single-call reply failed ({e}), falling back to two calls")
+        return generate_smart_reply(context_data, user_input), None
+
 @app.route('/sms/inbound', methods=['POST'])
 def handle_incoming_sms():
     sender = request.form.get('From')
     body = request.form.get('Body', '').strip()
+    message_sid = request.form.get('MessageSid')
     
     print(f"DEBUG: Received SMS from {sender}: {body}")
     log_event(f"Received SMS from {sender}: {body}")
 
+    if not message_sid:
+        return respond_to_sms(sender, body)
+
+    if not inbound_dedupe.claim(message_sid):
+        # Twilio retry of a turn that already ran (or is still running): replay its response
+        cached = inbound_dedupe.response_for(message_sid)
+        print(f"DEBUG: Duplicate delivery of {message_sid}, "
+              f"{'replaying its response' if cached is not None else 'original still in flight'}")
+        return cached if cached is not None else str(MessagingResponse())
+
+    try:
+        twiml = respond_to_sms(sender, body)
+    except Exception:
+        inbound_dedupe.release(message_sid)
+        raise
+    inbound_dedupe.complete(message_sid, twiml)
+    return twiml
+
+def respond_to_sms(sender, body):
+    """TwiML for one inbound SMS: an empty ack in async mode, else the reply itself."""
+    if not coalescer.add(sender, body):
+        # The delivery leading this burst answers for it
+        print(f"DEBUG: Text from {sender} joined the burst in progress")
+        return str(MessagingResponse())
+
+    if SMS_REPLY_MODE == "async":
+        # Acknowledge Twilio at once; an rq worker collects the burst, runs the turn and texts the reply
+        try:
+            enqueue_in_order(f"sender:{sender}", reply_to_inbound_sms, sender, body, True)
+            return str(MessagingResponse())
+        except Exception as e:
+            print(f"DEBUG: Failed to enqueue SMS turn, replying inline: {e}")
+
+    body, messages = collect_burst(sender, body)
+    with turn("sms_webhook", messages=messages):
+        try:
+            return build_twiml(process_sms_turn(sender, body))
+        except ConversationBusy as e:
+            # Reply from an rq worker once the holder lets go, never beside it
+            print(f"DEBUG: {e}, replying from the queue")
+            enqueue_in_order(f"sender:{sender}", reply_to_inbound_sms, sender, body)
+            return str(MessagingResponse())
+
+def collect_burst(sender, body):
+    """(joined texts, how many) for the burst `body` leads, once the lead has gone quiet."""
+    bodies = coalescer.collect(sender, body)
+    if len(bodies) > 1:
+        print(f"DEBUG: Coalesced {len(bodies)} texts from {sender} into one turn")
+        count(COALESCED_METRIC, "merged", len(bodies) - 1)
+    count(COALESCED_METRIC, "turns")
+    return join_messages(bodies, STOP_KEYWORDS), len(bodies)
+
+def log_flushed_batch(batch, stats):
+    """Logs what a WriteBatch.flush() sent, and each write that failed."""
+    if stats["queued"]:
+        log_event(f"Flushed write batch: {stats['sent']} requests for {stats['queued']} writes "
+                  f"({stats['coalesced']} coalesced, {stats['errors']} errors)")
+    for error in batch.errors:
+        log_event(f"Batched write failed: {error}")
+
+def build_twiml(chunks):
+    """Wraps reply chunks in a TwiML response (no chunks = empty response)."""
+    with span("twiml"):
+        resp = MessagingResponse()
+        for chunk in chunks:
+            resp.message(chunk)
+        return str(resp)
+
+def process_sms_turn(sender, body, on_chunk=None, lock_wait=None):
+    """
+    Runs one inbound SMS turn: context lookup, logging, reply and CRM update.
+    Returns the reply split into SMS-sized chunks ([] means don't reply).
+    Shared by the webhook (TwiML reply) and the async rq job (REST reply).
+    With on_chunk and SMS_STREAMING, bubbles are delivered through on_chunk
+    while the reply streams, and only the undelivered rest is returned.
+    The conversation's lease is held from the context read to the last write;
+    if it is still busy after lock_wait seconds (default CONVERSATION_LOCK_WAIT),
+    raises ConversationBusy before anything is written.
+    """
+    with ExitStack() as held:
+        return _process_sms_turn(sender, body, on_chunk, lock_wait, held)
+
+def _process_sms_turn(sender, body, on_chunk, lock_wait, held):
     customer_id = None
     context_id = None
     context_data = {}
 
+    # Writes made after the reply are queued and flushed together once it is generated
+    batch = db_client.batch()
+
     # 1. Get Context
     try:
         try:
-            context_data = db_client.get_context(identifier=sender, lookup_by="phone_normalized")
+            with span("core_api.get_context"):
+                context_data = db_client.get_context(identifier=sender, lookup_by="phone_normalized")
         except Exception as e:
             if "404" in str(e):
                 print(f"DEBUG: Creating Customer...")
                 try:
-                    new_cust = db_client.create_customer(phone=sender, phone_normalized=sender)
+                    with span("core_api.create_customer"):
+                        new_cust = db_client.create_customer(phone=sender, phone_normalized=sender)
                     customer_id = new_cust.get('customer_id')
-                    context_data = db_client.get_context(identifier=sender, lookup_by="phone_normalized")
+                    with span("core_api.get_context"):
+                        context_data = db_client.get_context(identifier=sender, lookup_by="phone_normalized")
                 except:
-                    return str(MessagingResponse())
+                    return []
             else:
                 raise e
 
         customer_id = context_data.get('customer_id')
         context_id = context_data.get('context_id') 
+
+        # Serialize with follow-ups and other turns on this conversation (see conversation_locks.py)
+        if context_id:
+            with span("conversation_lock"):
+                lease = held.enter_context(conversation_locks.hold(context_id, wait=lock_wait))
+            if lease is None:
+                raise ConversationBusy(f"{context_id} still busy after {conversation_locks.wait if lock_wait is None else lock_wait}s")
+            if lease.waited:
+                # Someone else wrote to the conversation while we waited: read it again
+                with span("core_api.get_context"):
+                    context_data = db_client.get_context(identifier=sender, lookup_by="phone_normalized")
         
-        # 2. Log Inbound
-        log_resp = db_client.log_message(
-            customer_id=customer_id,
-            channel="sms",
-            identifier=sender,
-            direction="inbound",
-            body=body,
-            context_id=context_id
-        )
-        if not context_id:
+        # 2. Log Inbound: alongside the reply when the context exists (other readers
+        # see it at once; the batch waits for it), else first to get a context_id
+        if context_id:
+            batch.log_message_now(customer_id, "sms", sender, "inbound", body, context_id)
+        else:
+            with span("core_api.log_message"):
+                log_resp = db_client.log_message(
+                    customer_id=customer_id,
+                    channel="sms",
+                    identifier=sender,
+                    direction="inbound",
+                    body=body,
+                    context_id=context_id
+                )
             context_id = log_resp.get('context_id')
 
+    except ConversationBusy:
+        raise
     except Exception as e:
         print(f"DEBUG: API Error: {e}")
-        return str(MessagingResponse())
+        return []
+
+    delivered = []
 
+    def deliver(chunk):
+        delivered.append(chunk)
+        on_chunk(chunk)
+
+    stream_to = deliver if on_chunk and SMS_STREAMING and not LLM_SINGLE_CALL else None
+
+    try:
+        reply_text, needs_analysis, state_updates = _reply_to_sms(batch, context_data, customer_id, context_id, sender, body, stream_to)
+    finally:
+        # Outbound message log (and any handoff update) go out here, after the inbound log
+        with span("core_api.flush_batch"):
+            log_flushed_batch(batch, batch.flush())
+
+    # CRM analysis, enrichment and the VAPI decision run after the reply is out
+    # (and after its outbound log is flushed, so the update lands on a complete history)
+    if needs_analysis:
+        defer_state_update(context_data, customer_id, context_id, body, reply_text, state_updates)
+
+    # 6. Response Construction (Smart Splitting)
+    # Always build and return response - don't let DB errors prevent SMS delivery
+    return split_sms(reply_text)[len(delivered):] if reply_text else []
+
+STOP_KEYWORDS = ["STOP", "CANCEL", "UNSUBSCRIBE"]
+HANDOFF_KEYWORDS = ["HUMAN", "CALL ME"]
+HANDOFF_REPLY = "I've noted your request. A member of our team will call you shortly."
+
+def _reply_to_sms(batch, context_data, customer_id, context_id, sender, body, stream_to=None):
+    """
+    Runs the brain for one inbound SMS, queueing Core API writes on `batch`.
+    Returns (reply_text, needs_analysis, state_updates); reply_text is None when
+    nothing should be sent, state_updates is set when single-call mode already
+    produced the CRM fields.
+    """
     # 3. Brain (Stop/Handoff)
     normalized_body = body.upper()
-    if normalized_body in ["STOP", "CANCEL", "UNSUBSCRIBE"]:
-        resp = MessagingResponse()
-        return str(resp)
+    if normalized_body in STOP_KEYWORDS:
+        return None, False, None
 
-    if any(k in normalized_body for k in ["HUMAN", "CALL ME"]):
-        reply_text = "I've noted your request. A member of our team will call you shortly."
-        resp = MessagingResponse()
-        resp.message(reply_text)
+    if any(k in normalized_body for k in HANDOFF_KEYWORDS):
+        reply_text = HANDOFF_REPLY
         try:
-            db_client.log_message(customer_id, "sms", sender, "outbound", reply_text, context_id)
-            db_client.update_conversation(context_id, last_agent_action="Handoff Requested")
+            batch.log_message(customer_id, "sms", sender, "outbound", reply_text, context_id)
+            batch.update_conversation(context_id, last_agent_action="Handoff Requested")
         except: pass
-        return str(resp)
+        return reply_text, False, None
 
     # 4. Generate Smart Reply (Full Context)
-    reply_text = generate_smart_reply(context_data, body)
+    state_updates = None
+    if LLM_SINGLE_CALL:
+        reply_text, state_updates = generate_reply_and_state(context_data, body)
+    elif stream_to:
+        reply_text = stream_smart_reply(context_data, body, stream_to)
+    else:
+        reply_text = generate_smart_reply(context_data, body)
     print(f"DEBUG: Generated Reply: {reply_text}")
 
     # 5. Outbound Log & State Update
     try:
-        db_client.log_message(
+        batch.log_message(
             customer_id=customer_id,
             channel="sms",
             identifier=sender,
@@ -482,12 +718,65 @@ def handle_incoming_sms():
     except Exception as e:
         print(f"DEBUG: Failed to log outbound message: {e}")
 
+    return reply_text, True, state_updates
+
+def defer_state_update(context_data, customer_id, context_id, body, reply_text, state_updates=None):
+    """
+    Hands the CRM state stage to an rq worker. Jobs for the same context_id are
+    chained, so two quick messages from one lead apply their updates in order.
+    Falls back to running inline if the queue is unavailable.
+    """
+    if STATE_UPDATE_MODE == "deferred" and context_id:
+        try:
+            enqueue_in_order(f"context:{context_id}", apply_conversation_state_job,
+                             context_data, customer_id, context_id, body, reply_text, state_updates)
+            return
+        except Exception as e:
+            print(f"DEBUG: Failed to enqueue state update, applying inline: {e}")
+    apply_conversation_state(context_data, customer_id, context_id, body, reply_text, state_updates)
+
+def apply_conversation_state(context_data, customer_id, context_id, body, reply_text, state_updates=None, refresh=False,
+                             lease=None):
+    """
+    CRM analysis of a finished exchange: summary/intent update, enrichment and VAPI trigger.
+    state_updates skips the analysis LLM call when single-call mode already made it.
+    refresh=True re-reads the summary first, so a chained job builds on the
+    update applied by the job before it rather than the turn's snapshot.
+    With a lease, it is renewed after the analysis; if the conversation was
+    taken meanwhile, nothing is written and no call is placed.
+    """
+    if refresh and state_updates is None:
+        try:
+            with span("core_api.get_context"):
+                latest = db_client.get_context(str(customer_id), lookup_by="id")
+            if latest.get('context_id') == context_id:
+                context_data = dict(context_data, summary=latest.get('summary', context_data.get('summary')))
+        except Exception as e:
+            print(f"DEBUG: Could not refresh context before state update: {e}")
+
+    batch = db_client.batch()
+    try:
+        _apply_conversation_state(batch, context_data, customer_id, context_id, body, reply_text, state_updates, lease)
+    finally:
+        with span("core_api.state_writes"):
+            log_flushed_batch(batch, batch.flush())
+
+def _apply_conversation_state(batch, context_data, customer_id, context_id, body, reply_text, state_updates, lease=None):
     try:
         history = context_data.get('history', [])
         current_summary = context_data.get('summary', '')
         
         # Get AI analysis (dictionary)
-        state_updates = update_conversation_state(current_summary, history, body, reply_text)
+        if state_updates is None:
+            state_updates = update_conversation_state(narrative_of(current_summary), history, body, reply_text)
+
+        if not conversation_locks.renew(lease):
+            # The analysis outlasted the lease and another process took the conversation
+            print(f"🔒 Lost the lease on {context_id}, not applying a stale state update")
+            return
+
+        # The rewritten narrative keeps the summary's event slots; compacted only if over the cap
+        new_summary = compact_summary(merge_summary(current_summary, state_updates.get("summary", current_summary)))
         
         # Decide the new intent based on booking request or interest level
         # If booking is requested, flag as HOT_LEAD to stop follow-up cron loops!
@@ -502,9 +791,9 @@ def handle_incoming_sms():
             new_intent = "WAITING_FOR_ANSWER"
 
         # Update DB:
-        db_client.update_conversation(
+        batch.update_conversation(
             context_id=context_id,
-            summary=state_updates.get("summary", current_summary),
+            summary=new_summary,
             sentiment=state_updates.get("sentiment", "neutral"),
             intent=new_intent, 
             last_agent_action="AI Replied via SMS"
@@ -526,7 +815,7 @@ def handle_incoming_sms():
         if ext_name or ext_email:
             print(f"DEBUG: Found new customer info - Name: {ext_name}, Email: {ext_email}")
             try:
-                db_client.update_customer(customer_id=customer_id, name=ext_name, email=ext_email)
+                batch.update_customer(customer_id=customer_id, name=ext_name, email=ext_email)
             except Exception as ce:
                 print(f"DEBUG: Failed to update customer profile: {ce}")
         
@@ -554,9 +843,10 @@ def handle_incoming_sms():
                     )
                     if vapi_result.get("success"):
                         new_intent = "HOT_LEAD"
-                        db_client.update_conversation(
+                        batch.update_conversation(
                             context_id=context_id,
                             intent="HOT_LEAD",
+                            summary=with_event(new_summary, "call", "placed via VAPI"),
                             last_agent_action=f"VAPI call triggered: {vapi_result.get('call_id')}"
                         )
                     else:
@@ -566,10 +856,10 @@ def handle_incoming_sms():
                     nw = next_business_window()
                     print(f"VAPI: After hours. Suggesting: {nw['friendly']}")
                     new_intent = "CALL_OFFERED_AFTER_HOURS"
-                    db_client.update_conversation(
+                    batch.update_conversation(
                         context_id=context_id,
                         intent="CALL_OFFERED_AFTER_HOURS",
-                        summary=f"{call_summary} [CALL PENDING] Suggested {nw['friendly']}.",
+                        summary=with_event(new_summary, "call", f"offered after hours, suggested {nw['friendly']}"),
                         last_agent_action=f"Suggested call at {nw['friendly']} (after hours)"
                     )
 
@@ -585,9 +875,10 @@ def handle_incoming_sms():
                 )
                 if vapi_result.get("success"):
                     new_intent = "HOT_LEAD"
-                    db_client.update_conversation(
+                    batch.update_conversation(
                         context_id=context_id,
                         intent="HOT_LEAD",
+                        summary=with_event(new_summary, "call", "placed via VAPI (after hours, at the lead's request)"),
                         last_agent_action=f"VAPI call triggered (persistent): {vapi_result.get('call_id')}"
                     )
 
@@ -595,33 +886,19 @@ def handle_incoming_sms():
                 # Lead wants a call at a specific future time
                 print(f"VAPI: Call scheduled for: {scheduled_call_time}")
                 new_intent = "CALL_SCHEDULED"
-                db_client.update_conversation(
+                batch.update_conversation(
                     context_id=context_id,
                     intent="CALL_SCHEDULED",
-                    summary=f"{call_summary} [CALL SCHEDULED] {scheduled_call_time}",
+                    summary=with_event(new_summary, "call", f"scheduled for {scheduled_call_time}"),
                     last_agent_action=f"Call scheduled for {scheduled_call_time}"
                 )
 
+        # The lead just replied: the follow-up clock restarts for the new intent
+        due_index.schedule(context_id, customer_id, new_intent)
+
     except Exception as e:
         print(f"DEBUG: Failed to update conversation context: {e}")
 
-    # 6. Response Construction (Smart Splitting)
-    # Always build and return response - don't let DB errors prevent SMS delivery
-    resp = MessagingResponse()
-    
-    # Split message if > 160 chars to avoid carrier truncation issues
-    # Ideally keep under 1600 total (Twilio limit), but split into 160-char chunks for delivery order
-    # Using 320 to allow slightly longer cohesive thoughts per bubble if carrier supports concatenation
-    # But for safety and UX, 160-200 is a good visual breakpoint.
-    
-    # NOTE: textwrap.wrap returns a list of strings
-    chunks = textwrap.wrap(reply_text, width=300, break_long_words=False, replace_whitespace=False)
-    
-    for chunk in chunks:
-        resp.message(chunk)
-        
-    return str(resp)
-
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,341 @@
+"""
+Async-native inbound SMS server (aiohttp).
+
+Serves the same /sms/inbound, /health and /metrics as app.py, but a turn
+awaits its upstream I/O instead of holding a worker: the Core API through
+AsyncSarahDBClient, OpenAI through ChatCompletion.acreate and the Make.com
+calendar webhook on a pooled aiohttp session. One process can then hold
+hundreds of turns that are mostly waiting on OpenAI, where a sync gunicorn
+worker holds one.
+
+Run with:
+    gunicorn async_app:web_app --bind 0.0.0.0:5000 --worker-class aiohttp.GunicornWebWorker
+or `python async_app.py`.
+
+Prompts, TwiML, MessageSid idempotency, coalescing, conversation leases and
+the context cache are shared with app.py. The CRM state stage (and the VAPI call it may
+place) goes to an rq worker as in app.py, or with STATE_UPDATE_MODE=inline
+runs on a worker thread. LLM_SINGLE_CALL and SMS_STREAMING are not
+supported here; turns use the two-call path.
+"""
+
+import asyncio
+import os
+from contextlib import AsyncExitStack
+
+import aiohttp
+import openai
+from aiohttp import web
+from twilio.twiml.messaging_response import MessagingResponse
+
+from app import (
+    CALENDAR_FUNCTIONS, CORE_API_KEY, HANDOFF_KEYWORDS, HANDOFF_REPLY, MAKE_CIRCUIT_OPEN_RESULT,
+    MAKE_EMPTY_RESULT, MAKE_NOT_CONFIGURED_RESULT, MAKE_WEBHOOK_URL, OPENAI_MODEL, SMS_REPLY_MODE,
+    STOP_KEYWORDS, add_tool_result, build_reply_messages, build_twiml, calendar_tool_call,
+    calendar_webhook_payload, coalescer, context_cache, defer_state_update, inbound_dedupe,
+)
+from async_sarah_db_client import AsyncSarahDBClient
+from circuit_breaker import breakers
+from coalescer import join_messages
+from conversation_locks import conversation_locks, ConversationBusy
+from metrics import COALESCED_METRIC, count, render_metrics, span, turn
+from rate_limiter import RATE_LIMIT_WEBHOOK_WAIT, rate_limiter
+from tasks import enqueue_in_order, reply_to_inbound_sms
+from upstream_clients import upstream_clients
+from utils import log_event, split_sms
+
+# Connections per upstream for this process; sized for many turns in flight at once
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "100"))
+
+db_client = AsyncSarahDBClient(api_key=CORE_API_KEY, pool_size=ASYNC_POOL_SIZE, cache=context_cache,
+                               rate_limiter=rate_limiter, rate_limit_wait=RATE_LIMIT_WEBHOOK_WAIT,
+                               circuit_breaker=breakers["core_api"])
+
+_http_session = None
+
+
+def get_http_session():
+    """Pooled session for OpenAI and Make.com, created lazily on the running loop."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE))
+    return _http_session
+
+
+async def chat(stage, **kwargs):
+    """One awaited completion, through the shared OpenAI rate limit and breaker."""
+    # openai 0.28 opens a session per request unless one is set for the context
+    openai.aiosession.set(get_http_session())
+    await rate_limiter.require_async("openai", OPENAI_MODEL, max_wait=RATE_LIMIT_WEBHOOK_WAIT)
+    with span(stage):
+        return await breakers["openai"].call_async(openai.ChatCompletion.acreate, model=OPENAI_MODEL, **kwargs)
+
+
+async def post_make_webhook(payload):
+    """The Make.com webhook's response text, through the shared breaker."""
+    with span("make_webhook"):
+        timeout = aiohttp.ClientTimeout(total=upstream_clients.timeouts["make"])
+        async with get_http_session().post(MAKE_WEBHOOK_URL, json=payload, timeout=timeout) as resp:
+            status, text = resp.status, await resp.text()
+    if status >= 500 or status == 429:
+        await asyncio.to_thread(breakers["make"].record_failure)
+    else:
+        await asyncio.to_thread(breakers["make"].record_success)
+    return text
+
+
+async def handle_calendar_tool_call(response_message, messages, context_data):
+    """Awaited twin of app.handle_calendar_tool_call."""
+    call = calendar_tool_call(response_message)
+    if call is None:
+        return None
+    tool_call, func_name, func_args = call
+    print(f"DEBUG: AI calling {func_name}: {func_args}")
+
+    if not MAKE_WEBHOOK_URL:
+        function_result = MAKE_NOT_CONFIGURED_RESULT
+        print(f"❌ {function_result}")
+    elif not await asyncio.to_thread(breakers["make"].allow):
+        function_result = MAKE_CIRCUIT_OPEN_RESULT
+        print(f"⚡ Make.com circuit open, skipping webhook")
+    elif not await rate_limiter.acquire_async("make", max_wait=RATE_LIMIT_WEBHOOK_WAIT):
+        function_result = MAKE_CIRCUIT_OPEN_RESULT
+        print("⏳ Make.com rate limit reached, skipping webhook")
+    else:
+        try:
+            text = await post_make_webhook(calendar_webhook_payload(func_name, func_args, context_data))
+            function_result = text if text else MAKE_EMPTY_RESULT
+            print(f"DEBUG: Webhook response: {function_result}")
+        except Exception as e:
+            await asyncio.to_thread(breakers["make"].record_failure, e)
+            function_result = f'{{"status": "error", "message": "Make.com Webhook timeout/error: {e}"}}'
+            print(function_result)
+
+    add_tool_result(messages, response_message, tool_call, func_name, function_result)
+
+    print("DEBUG: Asking LLM to interpret the webhook result and reply to user...")
+    second_completion = await chat("openai.reply_after_tool", messages=messages,
+                                   max_completion_tokens=300, temperature=0.7)
+    return second_completion.choices[0].message.content.strip()
+
+
+async def generate_smart_reply(context_data, user_input):
+    """Awaited twin of app.generate_smart_reply."""
+    messages = build_reply_messages(context_data, user_input)
+
+    try:
+        print("DEBUG: Generating Smart Reply...")
+        completion = await chat(
+            "openai.reply",
+            messages=messages,
+            tools=[{"type": "function", "function": CALENDAR_FUNCTIONS[0]}],
+            tool_choice="auto",
+            max_completion_tokens=300,
+            temperature=0.7
+        )
+        response_message = completion.choices[0].message
+
+        tool_reply = await handle_calendar_tool_call(response_message, messages, context_data)
+        if tool_reply is not None:
+            return tool_reply
+        return response_message.content.strip()
+
+    except Exception as e:
+        print(f"DEBUG: OpenAI Reply Error: {e}")
+        return "I'm analyzing that... one moment."
+
+
+async def log_message(**fields):
+    try:
+        with span("core_api.log_message"):
+            await db_client.log_message(**fields)
+    except Exception as e:
+        print(f"DEBUG: Failed to log {fields.get('direction')} message: {e}")
+
+
+async def process_sms_turn(sender, body):
+    """
+    Awaited twin of app.process_sms_turn for the TwiML reply: context lookup,
+    logging, reply and the hand-off of the CRM update. Returns the reply's
+    SMS chunks ([] means don't reply).
+    """
+    async with AsyncExitStack() as held:
+        return await _process_sms_turn(sender, body, held)
+
+
+async def _process_sms_turn(sender, body, held):
+    customer_id = None
+    context_id = None
+    context_data = {}
+    inbound_log = None
+
+    # 1. Get Context
+    try:
+        try:
+            with span("core_api.get_context"):
+                context_data = await db_client.get_context(sender, lookup_by="phone_normalized")
+        except Exception as e:
+            # The client wraps every failure; match on the status the way app.py does
+            if "404" not in str(e):
+                raise
+            print(f"DEBUG: Creating Customer...")
+            try:
+                with span("core_api.create_customer"):
+                    await db_client.create_customer(phone=sender, phone_normalized=sender)
+                with span("core_api.get_context"):
+                    context_data = await db_client.get_context(sender, lookup_by="phone_normalized")
+            except Exception:
+                return []
+
+        customer_id = context_data.get('customer_id')
+        context_id = context_data.get('context_id')
+
+        # Serialize with follow-ups and other turns on this conversation (see conversation_locks.py)
+        if context_id:
+            with span("conversation_lock"):
+                lease = await held.enter_async_context(conversation_locks.hold_async(context_id))
+            if lease is None:
+                raise ConversationBusy(f"{context_id} still busy after {conversation_locks.wait}s")
+            if lease.waited:
+                # Someone else wrote to the conversation while we waited: read it again
+                with span("core_api.get_context"):
+                    context_data = await db_client.get_context(sender, lookup_by="phone_normalized")
+
+        # 2. Log Inbound: alongside the reply when the context exists, else first to get a context_id
+        inbound = dict(customer_id=customer_id, channel="sms", identifier=sender,
+                       direction="inbound", body=body, context_id=context_id)
+        if context_id:
+            inbound_log = asyncio.ensure_future(log_message(**inbound))
+        else:
+            with span("core_api.log_message"):
+                log_resp = await db_client.log_message(**inbound)
+            context_id = log_resp.get('context_id')
+
+    except ConversationBusy:
+        raise
+    except Exception as e:
+        print(f"DEBUG: API Error: {e}")
+        return []
+
+    # 3. Brain (Stop/Handoff), 4. Smart Reply
+    normalized_body = body.upper()
+    handoff = False
+    if normalized_body in STOP_KEYWORDS:
+        reply_text = None
+    elif any(k in normalized_body for k in HANDOFF_KEYWORDS):
+        reply_text = HANDOFF_REPLY
+        handoff = True
+    else:
+        reply_text = await generate_smart_reply(context_data, body)
+        print(f"DEBUG: Generated Reply: {reply_text}")
+
+    # 5. Writes in WriteBatch order: inbound then outbound log, then the conversation update
+    if inbound_log is not None:
+        await inbound_log
+    if reply_text:
+        await log_message(customer_id=customer_id, channel="sms", identifier=sender,
+                          direction="outbound", body=reply_text, context_id=context_id)
+    if handoff:
+        try:
+            with span("core_api.update_conversation"):
+                await db_client.update_conversation(context_id, last_agent_action="Handoff Requested")
+        except Exception as e:
+            print(f"DEBUG: Failed to record handoff: {e}")
+
+    # CRM analysis, enrichment and the VAPI decision: rq job, or a worker thread when inline
+    if reply_text and not handoff:
+        await asyncio.to_thread(defer_state_update, context_data, customer_id, context_id, body, reply_text)
+
+    # 6. Response Construction (Smart Splitting)
+    return split_sms(reply_text) if reply_text else []
+
+
+async def collect_burst(sender, body):
+    """Awaited twin of app.collect_burst."""
+    bodies = await coalescer.collect_async(sender, body)
+    if len(bodies) > 1:
+        print(f"DEBUG: Coalesced {len(bodies)} texts from {sender} into one turn")
+        count(COALESCED_METRIC, "merged", len(bodies) - 1)
+    count(COALESCED_METRIC, "turns")
+    return join_messages(bodies, STOP_KEYWORDS), len(bodies)
+
+
+async def respond_to_sms(sender, body):
+    """TwiML for one inbound SMS: an empty ack in async reply mode, else the reply itself."""
+    if not await asyncio.to_thread(coalescer.add, sender, body):
+        print(f"DEBUG: Text from {sender} joined the burst in progress")
+        return str(MessagingResponse())
+
+    if SMS_REPLY_MODE == "async":
+        try:
+            await asyncio.to_thread(enqueue_in_order, f"sender:{sender}", reply_to_inbound_sms, sender, body, True)
+            return str(MessagingResponse())
+        except Exception as e:
+            print(f"DEBUG: Failed to enqueue SMS turn, replying inline: {e}")
+
+    body, messages = await collect_burst(sender, body)
+    with turn("sms_webhook_async", messages=messages):
+        try:
+            return build_twiml(await process_sms_turn(sender, body))
+        except ConversationBusy as e:
+            # Reply from an rq worker once the holder lets go, never beside it
+            print(f"DEBUG: {e}, replying from the queue")
+            await asyncio.to_thread(enqueue_in_order, f"sender:{sender}", reply_to_inbound_sms, sender, body)
+            return str(MessagingResponse())
+
+
+async def handle_incoming_sms(request):
+    form = await request.post()
+    sender = form.get('From')
+    body = (form.get('Body') or '').strip()
+    message_sid = form.get('MessageSid')
+
+    print(f"DEBUG: Received SMS from {sender}: {body}")
+    log_event(f"Received SMS from {sender}: {body}")
+
+    if not message_sid:
+        return web.Response(text=await respond_to_sms(sender, body), content_type="text/xml")
+
+    if not await asyncio.to_thread(inbound_dedupe.claim, message_sid):
+        cached = await inbound_dedupe.response_for_async(message_sid)
+        print(f"DEBUG: Duplicate delivery of {message_sid}, "
+              f"{'replaying its response' if cached is not None else 'original still in flight'}")
+        return web.Response(text=cached if cached is not None else str(MessagingResponse()), content_type="text/xml")
+
+    try:
+        twiml = await respond_to_sms(sender, body)
+    except Exception:
+        await asyncio.to_thread(inbound_dedupe.release, message_sid)
+        raise
+    await asyncio.to_thread(inbound_dedupe.complete, message_sid, twiml)
+    return web.Response(text=twiml, content_type="text/xml")
+
+
+async def health_check(request):
+    return web.json_response({"status": "ok", "service": "follow-up-agent", "server": "async"})
+
+
+async def metrics(request):
+    text = await asyncio.to_thread(render_metrics)
+    return web.Response(text=text, headers={"Content-Type": "text/plain; version=0.0.4"})
+
+
+async def close_clients(app):
+    await db_client.close()
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_post('/sms/inbound', handle_incoming_sms)
+    app.on_cleanup.append(close_clients)
+    return app
+
+
+web_app = create_app()
+
+if __name__ == '__main__':
+    web.run_app(web_app, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
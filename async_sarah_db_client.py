@@ -0,0 +1,281 @@
+import asyncio
+import os
+import aiohttp
+from typing import Optional, Dict, Any
+
+from sarah_db_client import (
+    CORE_API_POOL_SIZE,
+    CORE_API_MAX_RETRIES,
+    CORE_API_BACKOFF,
+    CORE_API_TIMEOUT,
+    DEFAULT_TIMEOUTS,
+    RETRY_AFTER_STATUSES,
+    RETRY_STATUSES,
+    build_customer_payload,
+    build_context_path,
+    build_log_payload,
+    build_conversation_payload,
+    build_customer_update_payload,
+)
+
+
+class AsyncSarahDBClient:
+    """
+    asyncio twin of SarahDBClient with the same method surface.
+    All calls share one aiohttp connection pool, so independent lookups and
+    writes can be issued together with asyncio.gather().
+
+    Use as `async with AsyncSarahDBClient(api_key) as client:` or call
+    `await client.close()` when done. The session is created lazily on the
+    running loop.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 base_url: Optional[str] = None,
+                 pool_size: Optional[int] = None,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 max_retries: Optional[int] = None,
+                 backoff_factor: Optional[float] = None,
+                 cache=None,
+                 rate_limiter=None,
+                 rate_limit_wait: Optional[float] = None,
+                 circuit_breaker=None):
+        if not api_key:
+            raise ValueError("API Key is required")
+        self.api_key = api_key
+        self.base_url = base_url or os.getenv(
+            'CORE_API_URL',
+            'https://lpodk9ddwa.execute-api.ca-central-1.amazonaws.com/prod'
+        )
+        self.headers = {
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json"
+        }
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.pool_size = pool_size or CORE_API_POOL_SIZE
+        self.max_retries = CORE_API_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = CORE_API_BACKOFF if backoff_factor is None else backoff_factor
+        # Optional read-through cache for get_context (see context_cache.py), as in
+        # SarahDBClient; its calls block on Redis, so they run on a worker thread
+        self.cache = cache
+        # Optional shared token bucket (see rate_limiter.py), taken before every request;
+        # a request that gets no token within rate_limit_wait seconds is not sent
+        self.rate_limiter = rate_limiter
+        self.rate_limit_wait = rate_limit_wait
+        # Optional breaker (see circuit_breaker.py), checked once per request
+        self.circuit_breaker = circuit_breaker
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._request_count = 0
+        self._connections_opened = 0
+        self._connections_reused = 0
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_created)
+            trace.on_connection_reuseconn.append(self._on_connection_reused)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                trace_configs=[trace]
+            )
+        return self._session
+
+    async def _on_connection_created(self, session, ctx, params):
+        self._connections_opened += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        self._connections_reused += 1
+
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs) -> Any:
+        """
+        Send a request on the shared pool and return the decoded JSON body.
+        Mirrors CoreAPIRetry: 429/5xx are retried with backoff, except POSTs,
+        which are only replayed on 429; failed connects are retried for any
+        method (nothing was sent). As in SarahDBClient, the rate limit token
+        and the request counter are taken once per call, not per attempt.
+        """
+        if self.rate_limiter and not await self.rate_limiter.acquire_async("core_api", max_wait=self.rate_limit_wait):
+            raise aiohttp.ClientConnectionError("Core API rate limit reached")
+        if not self.circuit_breaker:
+            return await self._send(endpoint, method, url, **kwargs)
+        # Breaker state lives in Redis; keep its blocking calls off the loop
+        if not await asyncio.to_thread(self.circuit_breaker.allow):
+            raise aiohttp.ClientConnectionError("Core API circuit open")
+        try:
+            result = await self._send(endpoint, method, url, **kwargs)
+        except Exception as e:
+            await asyncio.to_thread(self.circuit_breaker.record_failure, e)
+            raise
+        await asyncio.to_thread(self.circuit_breaker.record_success)
+        return result
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds before retry number attempt+1, as urllib3's Retry computes them."""
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return 0.0 if attempt == 0 else self.backoff_factor * (2 ** attempt)
+
+    async def _send(self, endpoint: str, method: str, url: str, **kwargs) -> Any:
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=self.timeouts.get(endpoint, CORE_API_TIMEOUT))
+        self._request_count += 1
+        attempt = 0
+        while True:
+            try:
+                async with session.request(method, url, timeout=timeout, **kwargs) as resp:
+                    retryable = resp.status in RETRY_STATUSES and (method != "POST" or resp.status == 429)
+                    if not retryable or attempt >= self.max_retries:
+                        resp.raise_for_status()
+                        return await resp.json(content_type=None)
+                    retry_after = resp.headers.get("Retry-After") if resp.status in RETRY_AFTER_STATUSES else None
+            except aiohttp.ClientConnectorError:
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    def get_connection_stats(self) -> Dict[str, int]:
+        """Connection reuse counters for the shared pool."""
+        return {
+            "requests": self._request_count,
+            "connections_opened": self._connections_opened,
+            "connections_reused": self._connections_reused,
+            "pool_size": self.pool_size
+        }
+
+    async def close(self):
+        """Close all pooled connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def create_customer(self,
+                              email: Optional[str] = None,
+                              phone: Optional[str] = None,
+                              name: Optional[str] = None,
+                              phone_normalized: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Create a new customer.
+        At least one of email or phone is required.
+        """
+        payload = build_customer_payload(email, phone, name, phone_normalized)
+        url = f"{self.base_url}/customers"
+
+        try:
+            return await self._request("create_customer", "POST", url, json=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Exception(f"Failed to create customer: {str(e)}")
+
+    async def list_customers(self, limit: int = 100, offset: int = 0) -> dict:
+        """List all customers."""
+        url = f"{self.base_url}/customers?limit={limit}&offset={offset}"
+        try:
+            return await self._request("list_customers", "GET", url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Exception(f"Failed to list customers: {str(e)}")
+
+    async def get_context(self, identifier: str, lookup_by: str = "id") -> Dict[str, Any]:
+        """
+        Get customer context by ID, email, or phone.
+        identifier: The value to look up (e.g., "john@example.com", "+1555...")
+        lookup_by: "id", "email", "phone", or "phone_normalized" (default "id")
+        """
+        url = f"{self.base_url}{build_context_path(identifier, lookup_by)}"
+
+        if self.cache:
+            cached = await asyncio.to_thread(self.cache.get, lookup_by, identifier)
+            if cached is not None:
+                return cached
+
+        try:
+            context = await self._request("get_context", "GET", url)
+            if self.cache:
+                await asyncio.to_thread(self.cache.set, lookup_by, identifier, context)
+            return context
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Exception(f"Failed to get context for {identifier}: {str(e)}")
+
+    async def log_message(self,
+                          customer_id: int,
+                          channel: str,
+                          identifier: str,
+                          direction: str,
+                          body: str,
+                          context_id: Optional[str] = None,
+                          subject: Optional[str] = None,
+                          metadata: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        Log an inbound or outbound message.
+        Returns: Dict containing 'log_id' and 'context_id'
+        """
+        payload = build_log_payload(customer_id, channel, identifier, direction, body,
+                                    context_id, subject, metadata)
+        url = f"{self.base_url}/log"
+
+        try:
+            return await self._request("log_message", "POST", url, json=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Exception(f"Failed to log message: {str(e)}")
+        finally:
+            if self.cache:
+                await asyncio.to_thread(self.cache.invalidate_customer, customer_id)
+
+    async def update_conversation(self,
+                                  context_id: str,
+                                  summary: Optional[str] = None,
+                                  intent: Optional[str] = None,
+                                  sentiment: Optional[str] = None,
+                                  last_agent_action: Optional[str] = None,
+                                  open_questions: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Update conversation state after AI processing.
+        Only provide fields you want to update.
+        """
+        payload = build_conversation_payload(context_id, summary, intent, sentiment,
+                                             last_agent_action, open_questions)
+        if not payload:
+            return {"status": "no_changes"}
+
+        url = f"{self.base_url}/conversation/{context_id}/update"
+
+        try:
+            return await self._request("update_conversation", "POST", url, json=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Exception(f"Failed to update conversation {context_id}: {str(e)}")
+        finally:
+            if self.cache:
+                await asyncio.to_thread(self.cache.invalidate_context, context_id)
+
+    async def update_customer(self, customer_id: int, name: Optional[str] = None, email: Optional[str] = None, company: Optional[str] = None) -> Dict[str, Any]:
+        """Update existing customer details by ID."""
+        payload = build_customer_update_payload(customer_id, name, email, company)
+        if not payload:
+            return {"status": "no_changes"}
+
+        url = f"{self.base_url}/customers/{customer_id}"
+
+        try:
+            try:
+                return await self._request("update_customer", "PUT", url, json=payload)
+            except aiohttp.ClientResponseError as e:
+                if e.status not in [404, 405]:
+                    raise
+                # Fallback to POST if PUT is rejected by API Gateway config
+                return await self._request("update_customer", "POST", url, json=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise Exception(f"Failed to update customer {customer_id}: {str(e)}")
+        finally:
+            if self.cache:
+                await asyncio.to_thread(self.cache.invalidate_customer, customer_id)
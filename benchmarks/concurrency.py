@@ -0,0 +1,251 @@
+"""
+Concurrent inbound turns: gunicorn sync workers (app.py) against one
+aiohttp worker (async_app.py), at fixed memory.
+
+Starts the stubs from stubs.py, then for each server mode launches gunicorn
+as a subprocess pointed at them and fires `--messages` webhook posts at
+each `--levels` concurrency. Reports requests per second, p50/p95/p99
+latency, errors and the peak resident memory of the server's process tree.
+With OpenAI latency around a second, sync throughput is capped at about
+workers / turn time, while the async worker keeps scaling with concurrency.
+
+Usage:
+    python benchmarks/concurrency.py [--levels 8,32,128,256] [--messages 400]
+        [--sync-workers 4] [--async-workers 1] [--openai-latency 1.0] [--save results.json]
+
+CRM state updates are left queued for rq (no rq worker is started), so both
+modes are measured on the webhook's own work.
+
+Needs gunicorn, aiohttp and a Redis server (--redis-url, default db 15,
+which is FLUSHED before each run). Linux only: memory is read from /proc.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+
+from stubs import StubUpstreams
+from throughput import MESSAGES, configure_environment, latency_summary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def tree_rss_mb(pid):
+    """Resident memory of pid and all its descendants, in MB (from /proc)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+class MemorySampler:
+    """Samples a process tree's RSS in the background; peak is the max seen."""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss_mb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = tree_rss_mb(self.pid)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_server(mode, workers, port, timeout):
+    """gunicorn for app:app (sync workers) or async_app:web_app (aiohttp workers)."""
+    command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+               "--timeout", str(timeout), "--log-level", "warning"]
+    if mode == "async":
+        command += ["--worker-class", "aiohttp.GunicornWebWorker", "async_app:web_app"]
+    else:
+        command += ["app:app"]
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, start_new_session=True)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{mode} server exited with {server.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+
+def stop_server(server):
+    try:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=15)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(server.pid, signal.SIGKILL)
+
+
+async def fire(url, phones, messages, concurrency, timeout):
+    """Posts `messages` inbound texts, `concurrency` at a time. Returns (elapsed, [(seconds, status)])."""
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def send(session):
+        form = {"From": random.choice(phones), "Body": random.choice(MESSAGES),
+                "MessageSid": f"SM{uuid.uuid4().hex}"}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, data=form) as resp:
+                    await resp.read()
+                    status = resp.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = 599
+            return time.perf_counter() - started, status
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(send(session) for _ in range(messages)))
+        return time.perf_counter() - started, results
+
+
+def run_mode(mode, workers, stubs, phones, args):
+    port = free_port()
+    server = start_server(mode, workers, port, args.request_timeout)
+    url = f"http://127.0.0.1:{port}/sms/inbound"
+    results = []
+    try:
+        idle_mb = tree_rss_mb(server.pid)
+        for level in args.levels:
+            stubs.reset_counts()
+            with MemorySampler(server.pid) as memory:
+                elapsed, responses = asyncio.run(fire(url, phones, args.messages, level, args.request_timeout))
+            latencies = [seconds for seconds, status in responses if status < 400]
+            results.append({
+                "scenario": f"{mode}_c{level}",
+                "mode": mode,
+                "workers": workers,
+                "concurrency": level,
+                "messages": args.messages,
+                "seconds": round(elapsed, 3),
+                "requests_per_second": round(args.messages / elapsed, 2),
+                "errors": sum(1 for _, status in responses if status >= 400),
+                "latency": latency_summary(latencies),
+                "idle_rss_mb": round(idle_mb, 1),
+                "peak_rss_mb": round(memory.peak, 1),
+                "upstream_calls": stubs.reset_counts(),
+            })
+            report(results[-1])
+    finally:
+        stop_server(server)
+    return results
+
+
+def report(result):
+    lat = result["latency"]
+    print(f"  {result['mode']:>5} x{result['workers']} at concurrency {result['concurrency']:>4}: "
+          f"{result['requests_per_second']:>7} req/s | p50 {lat.get('p50_ms', '-')}ms "
+          f"p95 {lat.get('p95_ms', '-')}ms p99 {lat.get('p99_ms', '-')}ms | {result['errors']} errors | "
+          f"peak RSS {result['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--levels", type=lambda v: [int(n) for n in v.split(",")], default=[8, 32, 128, 256])
+    parser.add_argument("--messages", type=int, default=400, help="webhook posts per concurrency level")
+    parser.add_argument("--leads", type=int, default=1000)
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--sync-workers", type=int, default=4)
+    parser.add_argument("--async-workers", type=int, default=1)
+    parser.add_argument("--openai-latency", type=float, default=1.0)
+    parser.add_argument("--core-latency", type=float, default=None)
+    parser.add_argument("--calendar-rate", type=float, default=0.05)
+    parser.add_argument("--request-timeout", type=int, default=60)
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write results to this JSON file")
+    args = parser.parse_args()
+    # configure_environment() reads these throughput.py options
+    args.workers = 1
+    args.rate_limits = False
+
+    random.seed(args.seed)
+    latency = {"openai": args.openai_latency}
+    if args.core_latency is not None:
+        latency["core_api"] = args.core_latency
+
+    results = []
+    with StubUpstreams(latency, args.calendar_rate, seed=args.seed) as stubs:
+        configure_environment(stubs, args)
+        # Measure the webhook path only: state updates are queued for rq (no worker runs them here)
+        os.environ["STATE_UPDATE_MODE"] = "deferred"
+
+        import redis
+        from due_index import load_strategy
+
+        phones = stubs.populate(args.leads, load_strategy())
+        print(f"Stubs at {stubs.core_api_url.rsplit('/', 1)[0]} with {args.leads} leads, latency {stubs.latency}")
+
+        for mode in args.modes.split(","):
+            redis.Redis.from_url(args.redis_url).flushdb()
+            workers = args.async_workers if mode == "async" else args.sync_workers
+            print(f"\n== {mode} ({workers} worker{'s' if workers > 1 else ''}) ==")
+            results.extend(run_mode(mode, workers, stubs, phones, args))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
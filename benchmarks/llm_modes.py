@@ -0,0 +1,119 @@
+"""
+Compare the two-call and single-call (LLM_SINGLE_CALL) reply paths on
+recorded conversations: latency, model calls and tokens per turn (including
+prompt tokens served from the provider's prefix cache).
+
+Usage:
+    python benchmarks/llm_modes.py [recorded_conversations.jsonl] [--runs N]
+
+Hits the OpenAI API configured in .env (OPENAI_API_KEY / OPENAI_MODEL).
+Core API, Twilio and VAPI are never called: only the LLM functions run.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai
+import app
+
+DEFAULT_RECORDINGS = os.path.join(os.path.dirname(__file__), "recorded_conversations.jsonl")
+
+
+class UsageMeter:
+    """Wraps ChatCompletion.create to count calls and tokens per turn."""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self._create = openai.ChatCompletion.create
+
+    def __enter__(self):
+        def create(*args, **kwargs):
+            completion = self._create(*args, **kwargs)
+            usage = getattr(completion, "usage", None) or {}
+            self.calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            self.cached_tokens += (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            return completion
+        openai.ChatCompletion.create = create
+        return self
+
+    def __exit__(self, *exc):
+        openai.ChatCompletion.create = self._create
+
+
+def run_two_call(context, message):
+    reply = app.generate_smart_reply(context, message)
+    state = app.update_conversation_state(context.get("summary", ""), context.get("history", []), message, reply)
+    return reply, state, False
+
+
+def run_single_call(context, message):
+    reply, state = app.generate_reply_and_state(context, message)
+    fell_back = state is None
+    if fell_back:
+        state = app.update_conversation_state(context.get("summary", ""), context.get("history", []), message, reply)
+    return reply, state, fell_back
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def benchmark(mode, runner, conversations, runs):
+    latencies, calls, prompt_tokens, completion_tokens, cached_tokens, fallbacks = [], [], [], [], [], 0
+    for _ in range(runs):
+        for conv in conversations:
+            with UsageMeter() as meter:
+                started = time.monotonic()
+                _, _, fell_back = runner(conv["context"], conv["message"])
+                latencies.append(time.monotonic() - started)
+            calls.append(meter.calls)
+            prompt_tokens.append(meter.prompt_tokens)
+            completion_tokens.append(meter.completion_tokens)
+            cached_tokens.append(meter.cached_tokens)
+            fallbacks += int(fell_back)
+
+    return {
+        "mode": mode,
+        "turns": len(latencies),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "mean_s": round(statistics.mean(latencies), 3),
+        "calls_per_turn": round(statistics.mean(calls), 2),
+        "prompt_tokens_per_turn": round(statistics.mean(prompt_tokens), 1),
+        "completion_tokens_per_turn": round(statistics.mean(completion_tokens), 1),
+        "cached_prompt_tokens_per_turn": round(statistics.mean(cached_tokens), 1),
+        "fallbacks": fallbacks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="?", default=DEFAULT_RECORDINGS)
+    parser.add_argument("--runs", type=int, default=3, help="passes over the recordings per mode")
+    args = parser.parse_args()
+
+    with open(args.recordings) as f:
+        conversations = [json.loads(line) for line in f if line.strip()]
+
+    results = [
+        benchmark("two_call", run_two_call, conversations, args.runs),
+        benchmark("single_call", run_single_call, conversations, args.runs),
+    ]
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
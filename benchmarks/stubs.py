@@ -0,0 +1,421 @@
+"""
+Local stand-ins for the upstreams the agent calls, for offline benchmarks.
+
+One threaded HTTP server answers, by path prefix:
+    /core/...                       Core API (the endpoints SarahDBClient uses)
+    /openai/v1/chat/completions     OpenAI-compatible completions (incl. streaming)
+    /twilio/2010-04-01/...          Twilio Messages
+    /vapi/call/phone                VAPI outbound calls
+    /make                           Make.com calendar webhook
+
+Each upstream has a configurable latency. The Core API keeps an in-memory
+lead population (see populate()) and every call is counted per endpoint.
+With record=True the Core API also keeps every request it was sent (for the
+client parity tests), and fail_core() makes its next responses errors.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+DEFAULT_LATENCY = {
+    "core_api": 0.03,
+    "openai": 0.8,
+    "twilio": 0.15,
+    "vapi": 0.3,
+    "make": 0.5,
+}
+
+HISTORY_LIMIT = 20
+
+CRM_STATE = {
+    "summary": "Lead is a clinic owner asking about an AI receptionist for after-hours calls.",
+    "sentiment": "positive",
+    "extracted_name": None,
+    "extracted_email": None,
+    "booking_requested": False,
+    "interest_level": "warm",
+    "product_interest": "ai_receptionist",
+    "call_recommended": False,
+    "call_timing": None,
+    "scheduled_call_time": None,
+}
+
+REPLY_TEXT = ("Totally get it - missed calls after 5pm are exactly what our AI receptionist "
+              "picks up. Want me to show you how it would sound for your clinic?")
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class CoreAPIStore:
+    """In-memory customers and contexts, shaped like the Core API's responses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.customers = []     # ordered, for /customers paging
+        self.by_id = {}         # customer_id -> customer
+        self.by_phone = {}      # phone -> customer_id
+        self.contexts = {}      # customer_id -> context
+        self.by_context = {}    # context_id -> customer_id
+
+    def add(self, name, phone, intent="WAITING_FOR_ANSWER", last_interaction=None, summary="New conversation"):
+        with self._lock:
+            customer_id = len(self.customers) + 1
+            customer = {"customer_id": customer_id, "name": name, "phone": phone,
+                        "phone_normalized": phone, "email": None}
+            context_id = f"ctx-{customer_id}"
+            self.customers.append(customer)
+            self.by_id[customer_id] = customer
+            self.by_phone[phone] = customer_id
+            self.by_context[context_id] = customer_id
+            self.contexts[customer_id] = {
+                "customer_id": customer_id,
+                "context_id": context_id,
+                "status": "active",
+                "intent": intent,
+                "sentiment": "neutral",
+                "summary": summary,
+                "last_interaction_at": iso(last_interaction or time.time()),
+                "history": [],
+            }
+            return customer_id
+
+    def lookup(self, identifier, by):
+        with self._lock:
+            if by == "id":
+                customer_id = int(identifier) if identifier.isdigit() else None
+            elif by in ("phone", "phone_normalized"):
+                customer_id = self.by_phone.get(identifier)
+            else:
+                customer_id = next((c["customer_id"] for c in self.customers if c.get("email") == identifier), None)
+            if customer_id not in self.contexts:
+                return None
+            return dict(self.contexts[customer_id], customer=dict(self.by_id[customer_id]),
+                        history=list(self.contexts[customer_id]["history"]))
+
+    def page(self, limit, offset):
+        with self._lock:
+            return {"customers": [dict(c) for c in self.customers[offset:offset + limit]],
+                    "total": len(self.customers)}
+
+    def log(self, payload):
+        with self._lock:
+            customer_id = self.by_context.get(payload.get("context_id")) or payload.get("customer_id")
+            context = self.contexts.get(customer_id)
+            if context is None:
+                return None
+            # Most recent first, like the real API
+            context["history"] = ([{
+                "direction": payload.get("direction"),
+                "message_body": payload.get("message_body"),
+                "created_at": iso(time.time()),
+            }] + context["history"])[:HISTORY_LIMIT]
+            context["last_interaction_at"] = iso(time.time())
+            return {"log_id": str(uuid.uuid4()), "context_id": context["context_id"]}
+
+    def update_conversation(self, context_id, fields):
+        with self._lock:
+            context = self.contexts.get(self.by_context.get(context_id))
+            if context is None:
+                return None
+            context.update(fields)
+            return {"status": "updated", "context_id": context_id}
+
+    def update_customer(self, customer_id, fields):
+        with self._lock:
+            customer = self.by_id.get(customer_id)
+            if customer is None:
+                return None
+            customer.update({k: v for k, v in fields.items() if v})
+            return {"status": "updated", "customer_id": customer_id}
+
+
+class StubUpstreams:
+    """
+    The stub server. Use as a context manager (or start()/stop()); base URLs
+    for each upstream are on the instance once started.
+    """
+
+    def __init__(self, latency=None, calendar_rate=0.0, call_rate=0.0, seed=None, record=False):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.calendar_rate = calendar_rate  # share of replies that call the calendar tool
+        self.call_rate = call_rate          # share of CRM updates that ask for a call now
+        self.random = random.Random(seed)
+        self.store = CoreAPIStore()
+        self.counts = {}
+        self.record = record
+        self.core_requests = []  # (method, path, query, body) per Core API request, when recording
+        self._core_faults = []   # statuses for the next Core API responses
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self, host="127.0.0.1", port=0):
+        stubs = self
+
+        class Handler(StubHandler):
+            upstreams = stubs
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        base = f"http://{host}:{self._server.server_address[1]}"
+        self.core_api_url = f"{base}/core"
+        self.openai_api_base = f"{base}/openai/v1"
+        self.twilio_base_url = f"{base}/twilio"
+        self.vapi_url = f"{base}/vapi/call/phone"
+        self.make_url = f"{base}/make"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def fail_core(self, *statuses):
+        """The next Core API requests are answered with these statuses, in order."""
+        with self._lock:
+            self._core_faults.extend(statuses)
+
+    def _core_request(self, method, path, query, body):
+        """Records the request (if recording) and returns an injected status, if any."""
+        with self._lock:
+            if self.record:
+                self.core_requests.append((method, path, query, body))
+            return self._core_faults.pop(0) if self._core_faults else None
+
+    def chance(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def populate(self, leads, strategy, due_fraction=0.1):
+        """
+        Adds `leads` customers spread over the strategy's intents. About
+        due_fraction of them are past their follow-up wait; the rest are not.
+        Returns the leads' phone numbers.
+        """
+        intents = [intent for intent, rule in strategy.items() if rule.get("wait_minutes") is not None]
+        now = time.time()
+        phones = []
+        for n in range(leads):
+            intent = intents[n % len(intents)]
+            wait = float(strategy[intent]["wait_minutes"]) * 60
+            if self.random.random() < due_fraction:
+                last = now - wait - self.random.uniform(60, 3600)
+            else:
+                last = now - self.random.uniform(0, wait * 0.9)
+            phone = f"+1555{n:07d}"
+            self.store.add(f"Lead {n}", phone, intent, last)
+            phones.append(phone)
+        return phones
+
+    def completion(self, request):
+        """A chat.completion for the request: CRM JSON, a calendar tool call or a reply."""
+        prompt = " ".join(str(m.get("content") or "") for m in request.get("messages", []))
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": 60,
+                 "total_tokens": len(prompt) // 4 + 60,
+                 "prompt_tokens_details": {"cached_tokens": 0}}
+        message = {"role": "assistant", "content": REPLY_TEXT}
+
+        wants_json = "Return raw JSON only" in prompt or request.get("response_format")
+        already_called_tool = any(m.get("role") == "tool" for m in request.get("messages", []))
+        if wants_json:
+            state = dict(CRM_STATE)
+            if self.chance(self.call_rate):
+                state.update(booking_requested=True, interest_level="hot",
+                             call_recommended=True, call_timing="persistent")
+            if request.get("response_format"):
+                state["reply"] = REPLY_TEXT
+            message["content"] = json.dumps(state)
+        elif request.get("tools") and not already_called_tool and self.chance(self.calendar_rate):
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": "get_availability",
+                             "arguments": json.dumps({"datetime_string": "Tomorrow at 2pm"})},
+            }]}
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pools are exercised
+    upstreams = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return {}
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        return json.loads(raw)
+
+    def _send(self, status, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _wait(self, upstream):
+        delay = self.upstreams.latency.get(upstream, 0)
+        if delay:
+            time.sleep(delay)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        path = url.path
+        try:
+            if path.startswith("/core/"):
+                return self._core(method, path[len("/core"):], parse_qs(url.query))
+            if path.startswith("/openai/"):
+                return self._openai()
+            if path.startswith("/twilio/"):
+                return self._twilio(path)
+            if path.startswith("/vapi/"):
+                return self._vapi()
+            if path.startswith("/make"):
+                return self._make()
+            self._send(404, {"error": "unknown path"})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def _core(self, method, path, query):
+        stubs = self.upstreams
+        store = stubs.store
+        body = self._body() if method != "GET" else {}
+        self._wait("core_api")
+        fault = stubs._core_request(method, path, query, body)
+        if fault:
+            return self._send(fault, {"error": "injected"})
+
+        match = re.fullmatch(r"/context/([^/]+)", path)
+        if method == "GET" and match:
+            stubs.count("core_api.get_context")
+            context = store.lookup(unquote(match.group(1)), query.get("by", ["id"])[0])
+            return self._send(200, context) if context else self._send(404, {"error": "not found"})
+        if method == "GET" and path == "/customers":
+            stubs.count("core_api.list_customers")
+            limit = int(query.get("limit", ["100"])[0])
+            offset = int(query.get("offset", ["0"])[0])
+            return self._send(200, store.page(limit, offset))
+        if method == "POST" and path == "/customers":
+            stubs.count("core_api.create_customer")
+            phone = body.get("phone_normalized") or body.get("phone")
+            customer_id = store.add(body.get("name") or "there", phone, intent="unknown")
+            return self._send(201, {"customer_id": customer_id})
+        if method == "POST" and path == "/log":
+            stubs.count("core_api.log_message")
+            result = store.log(body)
+            return self._send(200, result) if result else self._send(404, {"error": "not found"})
+        match = re.fullmatch(r"/conversation/([^/]+)/update", path)
+        if method == "POST" and match:
+            stubs.count("core_api.update_conversation")
+            result = store.update_conversation(unquote(match.group(1)), body)
+            return self._send(200, result) if result else self._send(404, {"error": "not found"})
+        match = re.fullmatch(r"/customers/(\d+)", path)
+        if method in ("PUT", "POST") and match:
+            stubs.count("core_api.update_customer")
+            result = store.update_customer(int(match.group(1)), body)
+            return self._send(200, result) if result else self._send(404, {"error": "not found"})
+        self._send(404, {"error": "unknown endpoint"})
+
+    def _openai(self):
+        request = self._body()
+        self.upstreams.count("openai")
+        completion = self.upstreams.completion(request)
+        if not request.get("stream"):
+            self._wait("openai")
+            return self._send(200, completion)
+
+        # Stream the reply word by word over the same total latency
+        message = completion["choices"][0]["message"]
+        words = (message.get("content") or "").split(" ")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        delay = self.upstreams.latency.get("openai", 0) / max(1, len(words))
+        for n, word in enumerate(words):
+            time.sleep(delay)
+            chunk = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                     "model": completion["model"],
+                     "choices": [{"index": 0, "delta": {"content": word if n == 0 else " " + word},
+                                  "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _twilio(self, path):
+        body = self._body()
+        self.upstreams.count("twilio")
+        self._wait("twilio")
+        if not path.endswith("/Messages.json"):
+            return self._send(404, {"message": "unknown resource"})
+        sid = f"SM{uuid.uuid4().hex}"
+        self._send(201, {
+            "sid": sid,
+            "status": "queued",
+            "to": body.get("To"),
+            "from": body.get("From"),
+            "body": body.get("Body"),
+            "date_created": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000"),
+        })
+
+    def _vapi(self):
+        self._body()
+        self.upstreams.count("vapi")
+        self._wait("vapi")
+        self._send(201, {"id": str(uuid.uuid4()), "status": "queued"})
+
+    def _make(self):
+        self._body()
+        self.upstreams.count("make")
+        self._wait("make")
+        tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%A")
+        self._send(200, {"status": "success", "available_slots": [f"{tomorrow} 2:00 PM", f"{tomorrow} 3:30 PM"]})
@@ -0,0 +1,172 @@
+"""
+Summary size and prompt tokens over a simulated 30-day lead lifecycle, with
+the old append-only summary updates and with summaries.py (events line +
+lazy compaction).
+
+Usage:
+    python benchmarks/summary_growth.py [--days 30] [--max-chars N] [--target-chars N]
+
+Runs offline. The CRM state update is simulated as a model that keeps
+the old summary and adds one sentence per exchange. That is the drift
+that made summaries grow. Compaction uses the keep-recent-sentences
+fallback instead of the LLM rewrite. The sizes it reports are therefore
+the same bound the LLM path is held to, but the content differs.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts import REPLY_PROMPT, STATE_UPDATE_PROMPT, FOLLOWUP_STATIC, FOLLOWUP_LEAD, count_tokens
+from summaries import (SUMMARY_MAX_CHARS, SUMMARY_TARGET_CHARS, compact_summary, merge_summary,
+                       narrative_of, with_event, with_followup_sent)
+
+FOLLOWUP_PREFIX_TOKENS = count_tokens(FOLLOWUP_STATIC.format(agent_name="Sarah"))
+
+# What the state update adds to the narrative on each exchange
+SENTENCES = [
+    "Lead runs a two-location dental clinic and misses most calls after 5pm and on Saturdays.",
+    "They asked whether the AI receptionist can book directly into their practice software.",
+    "Sarah explained calendar integrations and offered a short demo call; lead was interested but busy.",
+    "Lead raised pricing as the main concern and compared us to a human answering service.",
+    "Sarah shared that most clinics recover the cost within the first month of captured bookings.",
+    "Lead mentioned their office manager, Karen, would need to approve any new software.",
+    "They asked if the assistant can handle French-speaking patients; Sarah confirmed it can.",
+    "Lead wants to see a recording of a real call before committing to anything.",
+]
+
+# (day, event) over the lifecycle; follow-ups then fire on the strategy's timings
+SCRIPT = [
+    (0, "turns:3"),
+    (4, "turns:2"), (4, "call_offered"),
+    (5, "turns:2"), (5, "call_scheduled"),
+    (12, "turns:3"),
+    (20, "turns:2"),
+    (27, "turns:1"),
+]
+# Follow-up days after the lead goes quiet: WAITING_FOR_ANSWER (30 min), FOLLOWUP_1 (+1 day), FOLLOWUP_2 (+2 days)
+FOLLOWUP_OFFSETS = [(0, "FOLLOWUP_1"), (1, "FOLLOWUP_2"), (3, "NURTURE")]
+FOLLOWUP_TEXT = "Hey! Quick thought on the after-hours calls - happy to send a sample recording."
+
+
+class Lifecycle:
+    """One lead's summary under one update policy, with the prompt tokens its LLM calls cost."""
+
+    def __init__(self, name, bounded, max_chars, target_chars):
+        self.name = name
+        self.bounded = bounded
+        self.max_chars = max_chars
+        self.target_chars = target_chars
+        self.summary = "New conversation"
+        self.sentence = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.compactions = 0
+
+    def _spend(self, prefix_tokens, tail):
+        self.calls += 1
+        self.prompt_tokens += prefix_tokens + count_tokens(tail)
+
+    def _compact(self, summary):
+        compacted = compact_summary(summary, self.max_chars, self.target_chars, summarize=None)
+        if len(compacted) < len(summary):
+            self.compactions += 1
+        return compacted
+
+    def turn(self):
+        # Reply call, then the state update that rewrites the summary
+        dashboard = REPLY_PROMPT.render(name="Marie", intent="WAITING_FOR_ANSWER", sentiment="positive",
+                                        summary=self.summary)
+        self._spend(REPLY_PROMPT.prefix_tokens, dashboard)
+        old = narrative_of(self.summary) if self.bounded else self.summary
+        self._spend(STATE_UPDATE_PROMPT.prefix_tokens,
+                    STATE_UPDATE_PROMPT.render(old_summary=old, user_input="...", ai_reply="..."))
+        rewritten = f"{old} {SENTENCES[self.sentence % len(SENTENCES)]}".strip()
+        self.sentence += 1
+        self.summary = self._compact(merge_summary(self.summary, rewritten)) if self.bounded else rewritten
+
+    def followup(self, next_intent):
+        self._spend(FOLLOWUP_PREFIX_TOKENS, FOLLOWUP_LEAD.format(
+            customer_name="Marie", summary=self.summary, product_context="", history="", instruction=""))
+        if self.bounded:
+            self.summary = self._compact(with_followup_sent(self.summary, next_intent))
+        else:
+            self.summary = f"{self.summary}\n\n[System Update] Sarah auto-sent follow-up: {FOLLOWUP_TEXT[:40]}..."
+
+    def call_offered(self):
+        if self.bounded:
+            self.summary = with_event(self.summary, "call", "offered after hours, suggested Monday at 10:00 AM")
+        else:
+            self.summary = f"{self.summary} [CALL PENDING] Suggested Monday at 10:00 AM."
+
+    def call_scheduled(self):
+        if self.bounded:
+            self.summary = with_event(self.summary, "call", "scheduled for Thursday 3pm")
+        else:
+            self.summary = f"{self.summary} [CALL SCHEDULED] Thursday 3pm"
+
+
+def simulate(days, max_chars, target_chars):
+    legacy = Lifecycle("append-only", False, max_chars, target_chars)
+    bounded = Lifecycle("bounded", True, max_chars, target_chars)
+
+    # Expand the script into a per-day event list, adding follow-ups after each burst of turns
+    events = {}
+    last_turn_day = {}
+    for day, event in SCRIPT:
+        events.setdefault(day, []).append(event)
+        if event.startswith("turns"):
+            last_turn_day[day] = True
+    turn_days = sorted(last_turn_day)
+    for index, day in enumerate(turn_days):
+        quiet_until = turn_days[index + 1] if index + 1 < len(turn_days) else days + 1
+        for offset, next_intent in FOLLOWUP_OFFSETS:
+            if day + offset < quiet_until and day + offset <= days and next_intent != "NURTURE":
+                events.setdefault(day + offset, []).append(f"followup:{next_intent}")
+
+    rows = []
+    for day in range(days + 1):
+        for event in events.get(day, []):
+            kind, _, arg = event.partition(":")
+            for lead in (legacy, bounded):
+                if kind == "turns":
+                    for _ in range(int(arg)):
+                        lead.turn()
+                elif kind == "followup":
+                    lead.followup(arg)
+                else:
+                    getattr(lead, kind)()
+        if day in events or day == days:
+            rows.append((day, len(legacy.summary), len(bounded.summary),
+                         count_tokens(legacy.summary), count_tokens(bounded.summary)))
+    return legacy, bounded, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--max-chars", type=int, default=SUMMARY_MAX_CHARS)
+    parser.add_argument("--target-chars", type=int, default=SUMMARY_TARGET_CHARS)
+    args = parser.parse_args()
+
+    legacy, bounded, rows = simulate(args.days, args.max_chars, args.target_chars)
+
+    print(f"Summary cap {args.max_chars} chars (compacted to {args.target_chars})\n")
+    print(f"{'day':>4} | {'append-only chars':>17} | {'bounded chars':>13} | {'append-only tokens':>18} | {'bounded tokens':>14}")
+    for day, legacy_chars, bounded_chars, legacy_tokens, bounded_tokens in rows:
+        print(f"{day:>4} | {legacy_chars:>17} | {bounded_chars:>13} | {legacy_tokens:>18} | {bounded_tokens:>14}")
+
+    print()
+    for lead in (legacy, bounded):
+        print(f"{lead.name:>11}: {lead.calls} LLM calls, {lead.prompt_tokens} prompt tokens "
+              f"({lead.prompt_tokens / lead.calls:.0f}/call), final summary {len(lead.summary)} chars"
+              + (f", {lead.compactions} compactions" if lead.bounded else ""))
+    saved = legacy.prompt_tokens - bounded.prompt_tokens
+    print(f"\nBounded summaries saved {saved} prompt tokens ({saved / legacy.prompt_tokens * 100:.1f}%) over {args.days} days")
+    print(f"\nFinal bounded summary:\n{bounded.summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Offline throughput benchmark for the inbound SMS webhook and the follow-up
+sweep, against local stubs for every upstream (see stubs.py).
+
+Scenarios:
+    inbound  POSTs synthetic texts from random leads to /sms/inbound through
+             Flask's test client, `--concurrency` at a time (sync TwiML replies,
+             CRM state update inline).
+    sweep    Runs cron_worker.process_conversations() over the population in
+             full mode, then in due mode with the due index seeded as the
+             webhook would have left it.
+
+Reports requests (or contexts) per second, p50/p95/p99 latency and upstream
+calls per scenario. --save writes the results as JSON; --baseline compares a
+run against a saved one.
+
+Usage:
+    python benchmarks/throughput.py [--leads 1000] [--messages 500] [--concurrency 8]
+        [--scenario inbound|sweep|all] [--openai-latency 0.8] [--core-latency 0.03]
+        [--save results.json] [--baseline baseline.json]
+
+Needs a Redis server (--redis-url, default db 15). That database is FLUSHED
+before each run, so point it at one nothing else uses. Rate limits are off
+unless --rate-limits is given, so runs measure the agent and not the quotas.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import CoreAPIStore, StubUpstreams
+
+MESSAGES = [
+    "Hi, saw your ad. What do you do exactly?",
+    "I run a dental clinic and we miss a lot of calls after 5pm",
+    "How much does it cost?",
+    "Can you call me tomorrow at 2pm?",
+    "Not interested right now, maybe next month",
+    "Does it work in French too?",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {}
+    return {
+        "p50_ms": round(percentile(seconds, 50) * 1000, 1),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 1),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 1),
+        "max_ms": round(max(seconds) * 1000, 1),
+        "mean_ms": round(statistics.mean(seconds) * 1000, 1),
+    }
+
+
+def configure_environment(stubs, args):
+    """Points every client at the stubs. Must run before app / cron_worker are imported."""
+    env = {
+        "REDIS_URL": args.redis_url,
+        "CORE_API_URL": stubs.core_api_url,
+        "CORE_API_KEY": "bench",
+        "OPENAI_API_BASE": stubs.openai_api_base,
+        "OPENAI_API_KEY": "bench",
+        "MAKE_WEBHOOK_URL": stubs.make_url,
+        "VAPI_API_URL": stubs.vapi_url,
+        "VAPI_API_KEY": "bench",
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_PHONE_NUMBER": "+15550000000",
+        "SMS_REPLY_MODE": "sync",
+        "STATE_UPDATE_MODE": "inline",
+        "SWEEP_WORKERS": str(args.workers),
+        # Each synthetic text is its own turn; coalescing would just add the quiet window
+        "SMS_COALESCE_WINDOW": "0",
+    }
+    if not args.rate_limits:
+        for upstream in ("OPENAI", "TWILIO", "VAPI", "MAKE", "CORE_API"):
+            env[f"RATE_LIMIT_{upstream}"] = "0"
+    os.environ.update(env)
+
+
+@contextlib.contextmanager
+def quiet(enabled):
+    """Swallows the agent's DEBUG prints and INFO logs while a scenario runs."""
+    if not enabled:
+        yield
+        return
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.getLogger().setLevel(level)
+
+
+def run_inbound(stubs, phones, args):
+    import app
+
+    local = threading.local()
+
+    def send(phone):
+        if not hasattr(local, "client"):
+            local.client = app.app.test_client()
+        started = time.perf_counter()
+        resp = local.client.post("/sms/inbound", data={"From": phone, "Body": random.choice(MESSAGES)})
+        return time.perf_counter() - started, resp.status_code
+
+    senders = [random.choice(phones) for _ in range(args.messages)]
+    stubs.reset_counts()
+    with quiet(args.quiet), ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(send, senders))
+        elapsed = time.perf_counter() - started
+
+    latencies = [seconds for seconds, _ in results]
+    upstream = stubs.reset_counts()
+    return {
+        "scenario": "inbound",
+        "leads": len(phones),
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(args.messages / elapsed, 2),
+        "errors": sum(1 for _, status in results if status >= 400),
+        "latency": latency_summary(latencies),
+        "upstream_calls": upstream,
+        "upstream_calls_per_turn": {name: round(n / args.messages, 2) for name, n in upstream.items()},
+    }
+
+
+def run_sweep(stubs, args):
+    import cron_worker
+    from due_index import parse_timestamp
+
+    # The Twilio SDK has no base URL setting; point its API domain at the stub
+    cron_worker.twilio_client.api.base_url = stubs.twilio_base_url
+
+    results = []
+    for mode in ("full", "due"):
+        cron_worker.redis_conn.flushdb()
+        if mode == "due":
+            # Seed the index the way the webhook keeps it, and mark it as freshly built
+            for context in stubs.store.contexts.values():
+                cron_worker.due_index.schedule(context["context_id"], context["customer_id"], context["intent"],
+                                               parse_timestamp(context["last_interaction_at"]))
+            cron_worker.due_index.needs_rebuild(cron_worker.FOLLOWUP_INDEX_REBUILD_SECONDS)
+        cron_worker.SWEEP_MODE = mode
+        stubs.reset_counts()
+        with quiet(args.quiet):
+            started = time.perf_counter()
+            stats = cron_worker.process_conversations(workers=args.workers)
+            elapsed = time.perf_counter() - started
+        upstream = stubs.reset_counts()
+        contexts = stats["contexts_fetched"]
+        results.append({
+            "scenario": f"sweep_{mode}",
+            "leads": len(stubs.store.customers),
+            "workers": args.workers,
+            "seconds": round(elapsed, 3),
+            "contexts_fetched": contexts,
+            "contexts_per_second": round(contexts / elapsed, 2) if elapsed else 0.0,
+            "followups_sent": upstream.get("twilio", 0),
+            "upstream_calls": upstream,
+            "pipeline": {name: {k: s[k] for k in ("processed", "errors", "items_per_minute", "capacity_per_minute")}
+                         for name, s in stats["pipeline"].items()},
+        })
+        # Due follow-ups moved on a step; restore the population for the next mode
+        restore_population(stubs, args)
+    return results
+
+
+def restore_population(stubs, args):
+    from due_index import load_strategy
+
+    stubs.store = CoreAPIStore()
+    stubs.random.seed(args.seed)
+    stubs.populate(args.leads, load_strategy(), args.due_fraction)
+
+
+# Headline numbers compared against a baseline: higher is better unless listed in LOWER_IS_BETTER
+COMPARED = ("requests_per_second", "contexts_per_second", "p50_ms", "p95_ms", "p99_ms")
+LOWER_IS_BETTER = {"p50_ms", "p95_ms", "p99_ms"}
+
+
+def flatten(result):
+    flat = {k: v for k, v in result.items() if k in COMPARED}
+    flat.update({k: v for k, v in result.get("latency", {}).items() if k in COMPARED})
+    return flat
+
+
+def compare(results, baseline):
+    previous = {r["scenario"]: flatten(r) for r in baseline}
+    print("\nAgainst baseline:")
+    for result in results:
+        before = previous.get(result["scenario"])
+        if not before:
+            continue
+        changes = []
+        for key, value in flatten(result).items():
+            old = before.get(key)
+            if not old:
+                continue
+            change = (value - old) / old * 100
+            better = change < 0 if key in LOWER_IS_BETTER else change > 0
+            changes.append(f"{key} {old} -> {value} ({change:+.1f}%{'' if abs(change) < 1 else ' better' if better else ' worse'})")
+        print(f"  {result['scenario']}: " + ", ".join(changes))
+
+
+def report(result):
+    print(f"\n== {result['scenario']} ({result['leads']} leads) ==")
+    if "requests_per_second" in result:
+        lat = result["latency"]
+        print(f"  {result['messages']} turns in {result['seconds']}s at concurrency {result['concurrency']}: "
+              f"{result['requests_per_second']} req/s, {result['errors']} errors")
+        print(f"  latency p50 {lat['p50_ms']}ms | p95 {lat['p95_ms']}ms | p99 {lat['p99_ms']}ms | max {lat['max_ms']}ms")
+        calls = result["upstream_calls_per_turn"]
+    else:
+        print(f"  {result['contexts_fetched']} contexts in {result['seconds']}s with {result['workers']} workers: "
+              f"{result['contexts_per_second']} contexts/s, {result['followups_sent']} follow-ups sent")
+        calls = result["upstream_calls"]
+    print("  upstream calls" + (" per turn" if "upstream_calls_per_turn" in result else "") + ": "
+          + ", ".join(f"{name} {n}" for name, n in sorted(calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=["inbound", "sweep", "all"], default="all")
+    parser.add_argument("--leads", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=8, help="sweep worker threads")
+    parser.add_argument("--due-fraction", type=float, default=0.1, help="share of leads due a follow-up")
+    parser.add_argument("--core-latency", type=float, default=None)
+    parser.add_argument("--openai-latency", type=float, default=None)
+    parser.add_argument("--twilio-latency", type=float, default=None)
+    parser.add_argument("--vapi-latency", type=float, default=None)
+    parser.add_argument("--make-latency", type=float, default=None)
+    parser.add_argument("--calendar-rate", type=float, default=0.05, help="share of replies that use the calendar tool")
+    parser.add_argument("--call-rate", type=float, default=0.02, help="share of turns that trigger a VAPI call")
+    parser.add_argument("--rate-limits", action="store_true", help="keep RATE_LIMIT_* from the environment")
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="show the agent's own output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    latency = {
+        upstream: value for upstream, value in (
+            ("core_api", args.core_latency), ("openai", args.openai_latency), ("twilio", args.twilio_latency),
+            ("vapi", args.vapi_latency), ("make", args.make_latency),
+        ) if value is not None
+    }
+
+    results = []
+    with StubUpstreams(latency, args.calendar_rate, args.call_rate, seed=args.seed) as stubs:
+        configure_environment(stubs, args)
+
+        import redis
+        from due_index import load_strategy
+
+        redis.Redis.from_url(args.redis_url).flushdb()
+        stubs.random.seed(args.seed)
+        phones = stubs.populate(args.leads, load_strategy(), args.due_fraction)
+        print(f"Stubs at {stubs.core_api_url.rsplit('/', 1)[0]} with {args.leads} leads, latency {stubs.latency}")
+
+        if args.scenario in ("inbound", "all"):
+            results.append(run_inbound(stubs, phones, args))
+            report(results[-1])
+            restore_population(stubs, args)
+        if args.scenario in ("sweep", "all"):
+            for result in run_sweep(stubs, args):
+                results.append(result)
+                report(result)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)["results"])
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
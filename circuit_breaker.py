@@ -0,0 +1,169 @@
+"""
+Circuit breakers for upstream services, with state shared through Redis.
+
+A breaker opens after CIRCUIT_FAILURE_THRESHOLD failures (timeouts,
+connection errors, 5xx, 429) within CIRCUIT_FAILURE_WINDOW seconds, stays
+open for CIRCUIT_RESET_SECONDS, then lets one probe through. Redis errors
+leave the breaker closed.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+
+from shared_redis import redis_conn
+from utils import log_event
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_FAILURE_WINDOW = int(os.getenv("CIRCUIT_FAILURE_WINDOW", "60"))
+CIRCUIT_RESET_SECONDS = int(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+UPSTREAMS = ("openai", "twilio", "vapi", "make", "core_api")
+
+
+class CircuitOpenError(Exception):
+    """Raised by CircuitBreaker.call() while the breaker is open."""
+
+
+def is_upstream_failure(exc):
+    """True unless exc carries a 4xx status other than 429."""
+    status = getattr(exc, "http_status", None) or getattr(exc, "status", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return True
+
+
+class CircuitBreaker:
+    """
+    Breaker for one upstream. State is four Redis keys: a sorted set of
+    failure timestamps (trimmed to the window), the open flag (expires after
+    the reset timeout), the tripped flag (set while open or half-open) and
+    the half-open probe lock.
+    """
+
+    def __init__(self, redis_client, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 failure_window=CIRCUIT_FAILURE_WINDOW, reset_timeout=CIRCUIT_RESET_SECONDS,
+                 prefix="circuit"):
+        self.redis = redis_client
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self.failures_key = f"{prefix}:{name}:failures"
+        self.open_key = f"{prefix}:{name}:open"
+        self.tripped_key = f"{prefix}:{name}:tripped"
+        self.probe_key = f"{prefix}:{name}:probe"
+
+    def _failures(self):
+        return self.redis.zcount(self.failures_key, time.time() - self.failure_window, "+inf")
+
+    def state(self):
+        """"closed", "open" or "half_open"."""
+        try:
+            if self.redis.exists(self.open_key):
+                return "open"
+            return "half_open" if self.redis.exists(self.tripped_key) else "closed"
+        except Exception as e:
+            log_event(f"Circuit {self.name} state unavailable: {e}")
+            return "closed"
+
+    def is_open(self):
+        """True while calls would be short-circuited (does not take the half-open probe)."""
+        return self.state() == "open"
+
+    def allow(self):
+        """
+        Whether a call may go out now. In the half-open state only the first
+        caller gets True; it must report back with record_success/record_failure.
+        """
+        state = self.state()
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+        try:
+            return bool(self.redis.set(self.probe_key, 1, nx=True, ex=self.reset_timeout))
+        except Exception as e:
+            log_event(f"Circuit {self.name} probe lock failed: {e}")
+            return True
+
+    def record_success(self):
+        """Closes a half-open breaker. Failures in the window stay counted otherwise."""
+        try:
+            if self.state() == "half_open":
+                self.redis.delete(self.failures_key, self.tripped_key, self.probe_key)
+                log_event(f"Circuit {self.name} closed")
+        except Exception as e:
+            log_event(f"Circuit {self.name} update failed: {e}")
+
+    def record_failure(self, exc=None):
+        """
+        Counts a failure; opens the breaker at the threshold, or again at
+        once if it was half-open. A client error means the upstream answered,
+        so it is recorded as a success instead (which also ends a half-open
+        probe, as the status checks do).
+        """
+        if exc is not None and not is_upstream_failure(exc):
+            self.record_success()
+            return
+        try:
+            now = time.time()
+            pipe = self.redis.pipeline()
+            pipe.zadd(self.failures_key, {f"{now}:{uuid.uuid4().hex}": now})
+            pipe.zremrangebyscore(self.failures_key, "-inf", now - self.failure_window)
+            pipe.zcard(self.failures_key)
+            pipe.expire(self.failures_key, self.failure_window)
+            pipe.exists(self.tripped_key)
+            _, _, failures, _, tripped = pipe.execute()
+            if failures >= self.failure_threshold or tripped:
+                pipe = self.redis.pipeline()
+                pipe.set(self.open_key, 1, ex=self.reset_timeout)
+                # Cleared only by a successful probe, so the breaker goes half-open rather than straight to closed
+                pipe.set(self.tripped_key, 1)
+                pipe.delete(self.probe_key)
+                pipe.execute()
+                log_event(f"Circuit {self.name} open for {self.reset_timeout}s after {failures} failures")
+        except Exception as e:
+            log_event(f"Circuit {self.name} update failed: {e}")
+
+    def call(self, func, *args, **kwargs):
+        """func(*args, **kwargs) through the breaker; raises CircuitOpenError while open."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """call() for a coroutine function; the breaker's Redis calls run off the loop."""
+        if not await asyncio.to_thread(self.allow):
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            await asyncio.to_thread(self.record_failure, e)
+            raise
+        await asyncio.to_thread(self.record_success)
+        return result
+
+    def get_stats(self):
+        try:
+            failures = self._failures()
+        except Exception:
+            failures = None
+        return {"state": self.state(), "failures": failures}
+
+
+# One breaker per upstream
+breakers = {name: CircuitBreaker(redis_conn, name) for name in UPSTREAMS}
+
+
+def get_circuit_stats():
+    return {name: breaker.get_stats() for name, breaker in breakers.items()}
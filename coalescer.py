@@ -0,0 +1,114 @@
+"""
+Merges a burst of texts from one lead into a single turn. The first text
+waits SMS_COALESCE_WINDOW seconds of quiet (at most SMS_COALESCE_MAX_WAIT)
+and answers for the whole burst; the rest get an empty ack. A STOP text is
+never merged. Redis errors fail open.
+"""
+
+import asyncio
+import os
+import time
+
+from utils import log_event
+
+# Quiet time that ends a burst; 0 turns coalescing off. Off by default with sync
+# replies, where every turn (a lone text too) would hold a web worker for the window
+SMS_COALESCE_WINDOW = float(os.getenv(
+    "SMS_COALESCE_WINDOW", "2.5" if os.getenv("SMS_REPLY_MODE", "sync").lower() == "async" else "0"))
+# Longest a burst is held open. Sync replies also need the LLM turn inside
+# Twilio's 15s webhook timeout, so keep this well under it
+SMS_COALESCE_MAX_WAIT = float(os.getenv("SMS_COALESCE_MAX_WAIT", "6"))
+
+
+class RedisMessageCoalescer:
+    """Per-sender buffer, leader claim and last-arrival time, all in Redis."""
+
+    def __init__(self, redis_client, window=SMS_COALESCE_WINDOW, max_wait=SMS_COALESCE_MAX_WAIT,
+                 prefix="coalesce"):
+        self.redis = redis_client
+        self.window = window
+        self.max_wait = max_wait
+        self.prefix = prefix
+        # Outlives a leader that died mid-wait, but not by much
+        self.ttl = int(max_wait) + 30
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _keys(self, sender):
+        base = f"{self.prefix}:{sender}"
+        return f"{base}:buffer", f"{base}:leader", f"{base}:last"
+
+    def add(self, sender, body):
+        """Buffers body; True if this delivery leads the burst (and must collect it)."""
+        if not self.enabled:
+            return True
+        buffer_key, leader_key, last_key = self._keys(sender)
+        now = time.time()
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.rpush(buffer_key, body)
+            pipe.expire(buffer_key, self.ttl)
+            pipe.set(leader_key, now, nx=True, ex=self.ttl)
+            pipe.set(last_key, now, ex=self.ttl)
+            return bool(pipe.execute()[2])
+        except Exception as e:
+            log_event(f"Coalescer unavailable, handling text from {sender} alone: {e}")
+            return True
+
+    def _time_left(self, sender):
+        """Seconds until the burst sender is in ends (0 = it has)."""
+        _, leader_key, last_key = self._keys(sender)
+        started, last = self.redis.mget(leader_key, last_key)
+        now = time.time()
+        started = float(started or now)
+        last = float(last or started)
+        return max(0.0, min(last + self.window, started + self.max_wait) - now)
+
+    def _drain(self, sender, body):
+        buffer_key, leader_key, last_key = self._keys(sender)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(buffer_key, 0, -1)
+        pipe.delete(buffer_key, leader_key, last_key)
+        bodies = pipe.execute()[0]
+        return [b.decode() if isinstance(b, bytes) else b for b in bodies] or [body]
+
+    def collect(self, sender, body):
+        """
+        Leader only: waits out the burst, then drains it. Returns the buffered
+        texts in arrival order ([body] if Redis failed or the buffer was lost).
+        """
+        if not self.enabled:
+            return [body]
+        try:
+            while True:
+                left = self._time_left(sender)
+                if not left:
+                    return self._drain(sender, body)
+                time.sleep(left)
+        except Exception as e:
+            log_event(f"Coalescer unavailable, handling text from {sender} alone: {e}")
+            return [body]
+
+    async def collect_async(self, sender, body):
+        """Async version of collect()."""
+        if not self.enabled:
+            return [body]
+        try:
+            while True:
+                left = await asyncio.to_thread(self._time_left, sender)
+                if not left:
+                    return await asyncio.to_thread(self._drain, sender, body)
+                await asyncio.sleep(left)
+        except Exception as e:
+            log_event(f"Coalescer unavailable, handling text from {sender} alone: {e}")
+            return [body]
+
+
+def join_messages(bodies, stop_keywords=()):
+    """One turn's input from a burst of texts, one per line; a text in stop_keywords alone, if there is one."""
+    for body in bodies:
+        if body and body.upper() in stop_keywords:
+            return body
+    return "\n".join(body for body in bodies if body)
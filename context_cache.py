@@ -0,0 +1,163 @@
+"""
+Read-through cache for SarahDBClient.get_context.
+
+A context is stored once under its customer_id and reachable through aliases
+(phone_normalized, email, context_id, ...), so a write that only knows the
+customer_id or the context_id can still invalidate every way of looking it up.
+Entries expire after a TTL and the least recently used ones are evicted once
+the cache is full.
+
+Writes made outside this service (e.g. Make.com logging VAPI calls straight
+to the Core API) are not seen here, which is why the TTL stays short.
+"""
+
+import json
+import os
+import time
+
+from utils import log_event
+
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "60"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "10000"))
+
+
+def _alias_key(lookup_by, identifier):
+    return f"{lookup_by}:{identifier}"
+
+
+class RedisContextCache:
+    """
+    Context cache shared by every web/worker process through Redis.
+    Entries and aliases carry the TTL; a sorted set scored by last access
+    time drives LRU eviction, and hit/miss/eviction counters live in a hash.
+    Redis errors are logged and treated as misses so a cache outage never
+    blocks a reply.
+    """
+
+    def __init__(self, redis_client, ttl=CONTEXT_CACHE_TTL, max_entries=CONTEXT_CACHE_MAX_ENTRIES, prefix="ctxcache"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.lru_key = f"{prefix}:lru"
+        self.stats_key = f"{prefix}:stats"
+
+    def _entry_key(self, customer_id):
+        return f"{self.prefix}:cust:{customer_id}"
+
+    def _alias_key(self, lookup_by, identifier):
+        return f"{self.prefix}:alias:{_alias_key(lookup_by, identifier)}"
+
+    def _resolve(self, lookup_by, identifier):
+        if lookup_by == "id":
+            return str(identifier)
+        customer_id = self.redis.get(self._alias_key(lookup_by, identifier))
+        return customer_id.decode() if isinstance(customer_id, bytes) else customer_id
+
+    def get(self, lookup_by, identifier):
+        """Return the cached context or None."""
+        try:
+            customer_id = self._resolve(lookup_by, identifier)
+            raw = self.redis.get(self._entry_key(customer_id)) if customer_id else None
+            pipe = self.redis.pipeline()
+            if raw is None:
+                pipe.hincrby(self.stats_key, "misses", 1)
+            else:
+                pipe.hincrby(self.stats_key, "hits", 1)
+                pipe.zadd(self.lru_key, {customer_id: time.time()})
+            pipe.execute()
+            return json.loads(raw) if raw is not None else None
+        except Exception as e:
+            log_event(f"Context cache read failed: {e}")
+            return None
+
+    def set(self, lookup_by, identifier, context):
+        """Store a context fetched by (lookup_by, identifier)."""
+        customer_id = context.get("customer_id")
+        if customer_id is None:
+            return
+        customer_id = str(customer_id)
+        now = time.time()
+        try:
+            pipe = self.redis.pipeline()
+            pipe.setex(self._entry_key(customer_id), self.ttl, json.dumps(context))
+            if lookup_by != "id":
+                pipe.setex(self._alias_key(lookup_by, identifier), self.ttl, customer_id)
+            if context.get("context_id"):
+                pipe.setex(self._alias_key("context_id", context["context_id"]), self.ttl, customer_id)
+            pipe.zadd(self.lru_key, {customer_id: now})
+            # Members older than the TTL have already expired; drop them without counting an eviction
+            pipe.zremrangebyscore(self.lru_key, "-inf", now - self.ttl)
+            pipe.zcard(self.lru_key)
+            size = pipe.execute()[-1]
+
+            overflow = size - self.max_entries
+            if overflow > 0:
+                evicted = [m.decode() if isinstance(m, bytes) else m for m, _ in self.redis.zpopmin(self.lru_key, overflow)]
+                if evicted:
+                    pipe = self.redis.pipeline()
+                    pipe.delete(*[self._entry_key(m) for m in evicted])
+                    pipe.hincrby(self.stats_key, "evictions", len(evicted))
+                    pipe.execute()
+        except Exception as e:
+            log_event(f"Context cache write failed: {e}")
+
+    def invalidate_customer(self, customer_id):
+        if customer_id is None:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            pipe.delete(self._entry_key(customer_id))
+            pipe.zrem(self.lru_key, str(customer_id))
+            pipe.hincrby(self.stats_key, "invalidations", 1)
+            pipe.execute()
+        except Exception as e:
+            log_event(f"Context cache invalidation failed: {e}")
+
+    def invalidate_context(self, context_id):
+        if not context_id:
+            return
+        try:
+            customer_id = self._resolve("context_id", context_id)
+        except Exception as e:
+            log_event(f"Context cache invalidation failed: {e}")
+            return
+        self.invalidate_customer(customer_id)
+
+    def get_stats(self):
+        try:
+            raw = self.redis.hgetall(self.stats_key)
+            stats = {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in raw.items()}
+            stats["entries"] = self.redis.zcard(self.lru_key)
+        except Exception as e:
+            log_event(f"Context cache stats failed: {e}")
+            stats = {}
+        for key in ("hits", "misses", "evictions", "invalidations"):
+            stats.setdefault(key, 0)
+        return stats
+
+
+class ContextCacheInvalidator:
+    """
+    Write side of a shared context cache, for processes that write to the
+    Core API but must always read fresh contexts (the cron worker re-reads a
+    context under its lease). Lookups always miss; invalidations go through.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, lookup_by, identifier):
+        return None
+
+    def set(self, lookup_by, identifier, context):
+        pass
+
+    def invalidate_customer(self, customer_id):
+        self.cache.invalidate_customer(customer_id)
+
+    def invalidate_context(self, context_id):
+        self.cache.invalidate_context(context_id)
+
+    def get_stats(self):
+        return self.cache.get_stats()
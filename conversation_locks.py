@@ -0,0 +1,210 @@
+"""
+Per-conversation leases, so only one process at a time reads, decides and
+writes a given context_id.
+
+A lease is a Redis key set with NX and an expiry (CONVERSATION_LOCK_TTL),
+plus a fencing token: renew() before anything irreversible, and back off if
+someone else took the conversation in the meantime. The webhook waits up to
+CONVERSATION_LOCK_WAIT, rq jobs CONVERSATION_LOCK_JOB_WAIT; the sweep skips
+busy conversations. Redis errors fail open.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from shared_redis import redis_conn
+from utils import log_event
+
+CONVERSATION_LOCK_TTL = int(os.getenv("CONVERSATION_LOCK_TTL", "120"))
+# The webhook's wait: the reply still has to fit in Twilio's 15s webhook timeout
+CONVERSATION_LOCK_WAIT = float(os.getenv("CONVERSATION_LOCK_WAIT", "5"))
+# Turns on an rq worker have no deadline, so they can wait out a holder's whole lease
+CONVERSATION_LOCK_JOB_WAIT = float(os.getenv("CONVERSATION_LOCK_JOB_WAIT", str(CONVERSATION_LOCK_TTL)))
+# Fencing counters outlive any lease by far; an idle counter restarting later is harmless
+FENCE_TTL = 7 * 86400
+
+# Takes the lease if free; returns its fencing token, or 0 if another owner holds it
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local token = redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return token
+end
+return 0
+"""
+
+# Only the owner may extend a lease; an expired one is taken back if its fencing
+# token is still the latest, i.e. nobody acquired the conversation since
+RENEW_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] or (not owner and redis.call('GET', KEYS[2]) == ARGV[3]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Only the owner may drop a lease
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ConversationBusy(Exception):
+    """Raised by a turn that could not take its conversation's lease in time."""
+
+
+class Lease:
+    """A held conversation lease. token is None when Redis was down and nothing is held."""
+
+    def __init__(self, context_id, owner, token, waited=0.0):
+        self.context_id = context_id
+        self.owner = owner
+        self.token = token
+        # Seconds spent waiting for another holder; anything read before that is stale
+        self.waited = waited
+
+
+class RedisConversationLocks:
+    """Leases in Redis, one key per context_id; contention stats in a Redis hash."""
+
+    def __init__(self, redis_client, ttl=CONVERSATION_LOCK_TTL, wait=CONVERSATION_LOCK_WAIT, prefix="conversation_lock"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.wait = wait
+        self.prefix = prefix
+        self.stats_key = f"{prefix}:stats"
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._renew = redis_client.register_script(RENEW_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+
+    def _key(self, context_id):
+        return f"{self.prefix}:{context_id}"
+
+    def _fence_key(self, context_id):
+        return f"{self.prefix}:fence:{context_id}"
+
+    def _count(self, field):
+        try:
+            self.redis.hincrby(self.stats_key, field, 1)
+        except Exception as e:
+            log_event(f"Conversation lock stats failed: {e}")
+
+    def _try_acquire(self, context_id, owner):
+        """The fencing token if taken, 0 if held by someone else, None if Redis failed."""
+        try:
+            return int(self._acquire(keys=[self._key(context_id), self._fence_key(context_id)],
+                                     args=[owner, int(self.ttl * 1000), FENCE_TTL]))
+        except Exception as e:
+            log_event(f"Conversation locks unavailable, not locking {context_id}: {e}")
+            return None
+
+    def acquire(self, context_id, blocking=True, wait=None):
+        """
+        The lease for context_id, or None if another process still holds it
+        after `wait` seconds (at once with blocking=False).
+        """
+        wait = self.wait if wait is None else wait
+        owner = uuid.uuid4().hex
+        started = time.monotonic()
+        delay = 0.05
+        contended = False
+        while True:
+            token = self._try_acquire(context_id, owner)
+            if token is None:
+                return Lease(context_id, owner, None)
+            if token:
+                if contended:
+                    self._count("waited")
+                return Lease(context_id, owner, token, time.monotonic() - started if contended else 0.0)
+            if not contended:
+                contended = True
+                self._count("contended")
+            remaining = started + wait - time.monotonic()
+            if not blocking or remaining <= 0:
+                self._count("skipped" if not blocking else "timeouts")
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+
+    async def acquire_async(self, context_id, wait=None):
+        """Async version of acquire()."""
+        wait = self.wait if wait is None else wait
+        owner = uuid.uuid4().hex
+        started = time.monotonic()
+        delay = 0.05
+        contended = False
+        while True:
+            token = await asyncio.to_thread(self._try_acquire, context_id, owner)
+            if token is None:
+                return Lease(context_id, owner, None)
+            if token:
+                if contended:
+                    await asyncio.to_thread(self._count, "waited")
+                return Lease(context_id, owner, token, time.monotonic() - started if contended else 0.0)
+            if not contended:
+                contended = True
+                await asyncio.to_thread(self._count, "contended")
+            remaining = started + wait - time.monotonic()
+            if remaining <= 0:
+                await asyncio.to_thread(self._count, "timeouts")
+                return None
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+
+    def renew(self, lease):
+        """Extends lease by the TTL; False if it expired and someone else has acquired the conversation since."""
+        if lease is None or lease.token is None:
+            return True
+        try:
+            held = bool(self._renew(keys=[self._key(lease.context_id), self._fence_key(lease.context_id)],
+                                    args=[lease.owner, int(self.ttl * 1000), lease.token]))
+        except Exception as e:
+            log_event(f"Conversation locks unavailable, assuming {lease.context_id} is still held: {e}")
+            return True
+        if not held:
+            self._count("lost")
+        return held
+
+    def release(self, lease):
+        if lease is None or lease.token is None:
+            return
+        try:
+            self._release(keys=[self._key(lease.context_id)], args=[lease.owner])
+        except Exception as e:
+            log_event(f"Conversation lock release failed for {lease.context_id}: {e}")
+
+    @contextmanager
+    def hold(self, context_id, blocking=True, wait=None):
+        """acquire() for a with-block; yields the lease (None if it was not taken) and releases it after."""
+        lease = self.acquire(context_id, blocking, wait)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    @asynccontextmanager
+    async def hold_async(self, context_id, wait=None):
+        """hold() for asyncio callers."""
+        lease = await self.acquire_async(context_id, wait)
+        try:
+            yield lease
+        finally:
+            await asyncio.to_thread(self.release, lease)
+
+    def get_stats(self):
+        try:
+            raw = self.redis.hgetall(self.stats_key)
+        except Exception as e:
+            log_event(f"Conversation lock stats failed: {e}")
+            return {}
+        return {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
+
+
+conversation_locks = RedisConversationLocks(redis_conn)
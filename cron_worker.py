@@ -1,11 +1,29 @@
+import argparse
+import asyncio
+import functools
 import os
+import signal
+import threading
 import time
-import json
 import openai
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from sarah_db_client import SarahDBClient
-from twilio.rest import Client
+from context_cache import ContextCacheInvalidator, RedisContextCache
+from async_sarah_db_client import AsyncSarahDBClient
+from retry_store import RedisRetryStore
+from due_index import FollowupDueIndex, load_strategy, parse_timestamp, STRATEGY_FILE
+from pipeline import Pipeline, Stage
+from rate_limiter import rate_limiter
+from circuit_breaker import CircuitOpenError, breakers
+from conversation_locks import conversation_locks
+from metrics import span
+from prompts import PromptTemplate, FOLLOWUP_STATIC, FOLLOWUP_LEAD, window_history, format_history
+from summaries import compact_summary, with_event, with_followup_sent
+from upstream_clients import upstream_clients
+from shared_redis import redis_conn
 import requests
 
 # Load environment variables
@@ -13,59 +31,78 @@ load_dotenv()
 
 # Retry tracking
 MAX_SMS_RETRIES = 3
-RETRY_FILE = os.path.join(os.path.dirname(__file__), 'sms_retry_counts.json')
-
-def load_retry_counts():
-    try:
-        with open(RETRY_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-def save_retry_counts(counts):
-    with open(RETRY_FILE, 'w') as f:
-        json.dump(counts, f, indent=2)
 
 def get_retry_count(context_id):
-    counts = load_retry_counts()
-    return counts.get(context_id, 0)
+    return retry_store.get(context_id)
 
 def increment_retry(context_id):
-    counts = load_retry_counts()
-    counts[context_id] = counts.get(context_id, 0) + 1
-    save_retry_counts(counts)
-    return counts[context_id]
+    return retry_store.increment(context_id)
 
 def clear_retry(context_id):
-    counts = load_retry_counts()
-    if context_id in counts:
-        del counts[context_id]
-        save_retry_counts(counts)
+    retry_store.clear(context_id)
 
 # Configuration
 API_KEY = os.getenv("CORE_API_KEY")
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 AGENT_NAME = os.getenv("AGENT_NAME", "Wonderbot")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5.2")
 openai.api_key = OPENAI_API_KEY
+openai.requestssession = upstream_clients.sdk_session("openai")
+
+# Sweep tuning
+SWEEP_PAGE_SIZE = int(os.getenv("SWEEP_PAGE_SIZE", "100"))
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", "8"))
+SWEEP_ASYNC = os.getenv("SWEEP_ASYNC", "false").lower() == "true"
+# "due" pops only due contexts off the Redis due-time index; "full" walks every customer
+SWEEP_MODE = os.getenv("SWEEP_MODE", "due").lower()
+# How often a due-mode worker runs a full sweep anyway, to re-index contexts changed elsewhere
+FOLLOWUP_INDEX_REBUILD_SECONDS = int(os.getenv("FOLLOWUP_INDEX_REBUILD_SECONDS", "86400"))
+# Delay before a failed SMS send or context lookup is retried
+FOLLOWUP_RETRY_DELAY = int(os.getenv("FOLLOWUP_RETRY_DELAY", "300"))
+# Delay before a follow-up skipped because a reply was in progress is tried again
+FOLLOWUP_BUSY_DELAY = int(os.getenv("FOLLOWUP_BUSY_DELAY", "60"))
+
+# Follow-up dispatch pipeline: threads and per-minute cap (0 = none) for each stage
+FOLLOWUP_LLM_WORKERS = int(os.getenv("FOLLOWUP_LLM_WORKERS", "4"))
+FOLLOWUP_LLM_PER_MINUTE = int(os.getenv("FOLLOWUP_LLM_PER_MINUTE", "0"))
+FOLLOWUP_SMS_WORKERS = int(os.getenv("FOLLOWUP_SMS_WORKERS", "2"))
+# Twilio's per-number quota is enforced across processes by rate_limiter (RATE_LIMIT_TWILIO)
+FOLLOWUP_SMS_PER_MINUTE = int(os.getenv("FOLLOWUP_SMS_PER_MINUTE", "0"))
+FOLLOWUP_DB_WORKERS = int(os.getenv("FOLLOWUP_DB_WORKERS", "4"))
+FOLLOWUP_DB_PER_MINUTE = int(os.getenv("FOLLOWUP_DB_PER_MINUTE", "0"))
+# Items a stage may have waiting before the stage feeding it blocks
+FOLLOWUP_QUEUE_SIZE = int(os.getenv("FOLLOWUP_QUEUE_SIZE", "20"))
+
+# Scheduler daemon (--daemon): sleep until the next due follow-up, within these bounds
+SCHEDULER_MIN_SLEEP = float(os.getenv("SCHEDULER_MIN_SLEEP", "1"))
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", "60"))
 
 # Initialize Clients
-db_client = SarahDBClient(api_key=API_KEY)
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+# Follow-up writes drop the webhook's cached context, so its next turn sees them;
+# the sweep's own reads always go to the Core API
+db_client = SarahDBClient(api_key=API_KEY, pool_size=max(SWEEP_WORKERS, 10), rate_limiter=rate_limiter,
+                          circuit_breaker=breakers["core_api"],
+                          cache=ContextCacheInvalidator(RedisContextCache(redis_conn)))
+twilio_client = upstream_clients.twilio
+retry_store = RedisRetryStore(redis_conn)
 
 # Load Strategy
-STRATEGY_FILE = os.path.join(os.path.dirname(__file__), "followup_strategy.json")
-with open(STRATEGY_FILE, "r") as f:
-    STRATEGY = json.load(f)
+STRATEGY = load_strategy(STRATEGY_FILE)
+# Reloads STRATEGY in place when the file changes, as app.py's index does
+due_index = FollowupDueIndex(redis_conn, STRATEGY, strategy_file=STRATEGY_FILE)
+
+# Set by SIGTERM/SIGINT in daemon mode: finish the items in hand, then exit
+shutdown_requested = threading.Event()
+
+# Follow-up prompt: agent instructions as the cached prefix, lead data last
+FOLLOWUP_PROMPT = PromptTemplate("followup", FOLLOWUP_STATIC.format(agent_name=AGENT_NAME), FOLLOWUP_LEAD)
 
 def generate_smart_followup(context, instruction, customer_name):
     """Uses LLM to generate a contextual follow-up message."""
-    history = context.get("history", [])
-    recent_history = history[-4:] if len(history) >= 4 else history
+    # History is most recent first; keep the latest few turns, bodies only
+    recent_history = window_history(context.get("history", []), max_messages=4)
     summary = context.get("summary", "No summary available.")
     product_interest = context.get("product_interest", "")
     
@@ -80,29 +117,26 @@ def generate_smart_followup(context, instruction, customer_name):
         }
         product_context = f"\n\nThey showed interest in: {product_map.get(product_interest, product_interest)}"
     
-    prompt = f"""
-You are {AGENT_NAME}, an AI assistant following up with a lead named {customer_name}.
-
-Current conversation summary:
-"{summary}"{product_context}
-
-Recent message history:
-{json.dumps(recent_history, indent=2)}
-
-Task / Instruction for this follow-up:
-{instruction}
-
-Draft a short, natural, friendly SMS text message (max 160 chars) to send them right now. 
-Make sure it feels like a natural continuation of the history.
-Do NOT include quotes around the message. Just return the raw text.
-    """
-    try:
-        completion = openai.ChatCompletion.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=100,
-            temperature=0.7
+    messages = FOLLOWUP_PROMPT.messages({
+        "role": "user",
+        "content": FOLLOWUP_PROMPT.render(
+            customer_name=customer_name,
+            summary=summary,
+            product_context=product_context,
+            history=format_history(recent_history),
+            instruction=instruction
         )
+    })
+    try:
+        rate_limiter.acquire("openai", OPENAI_MODEL)
+        with span("openai.followup"):
+            completion = breakers["openai"].call(
+                openai.ChatCompletion.create,
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_tokens=100,
+                temperature=0.7
+            )
         return completion.choices[0].message.content.strip()
     except Exception as e:
         print(f"❌ OpenAI Error: {e}")
@@ -110,133 +144,548 @@ Do NOT include quotes around the message. Just return the raw text.
         return f"Hi {customer_name}, just bumping this up! Did you have any thoughts on my last message? - {AGENT_NAME}"
 
 def send_sms(to_number, body):
-    """Sends SMS via Twilio and logs it to the DB."""
+    """
+    Sends SMS via Twilio and logs it to the DB. Raises CircuitOpenError when
+    the Twilio breaker refuses the send (e.g. half-open with the probe taken).
+    """
     try:
         if not to_number:
             print("❌ Cannot send SMS: No phone number provided")
             return None
-            
-        message = twilio_client.messages.create(
-            body=body,
-            from_=TWILIO_PHONE_NUMBER,
-            to=to_number
-        )
+
+        rate_limiter.acquire("twilio", TWILIO_PHONE_NUMBER)
+        with span("twilio_send"):
+            message = breakers["twilio"].call(
+                twilio_client.messages.create,
+                body=body,
+                from_=TWILIO_PHONE_NUMBER,
+                to=to_number
+            )
         print(f"✅ Sent SMS to {to_number}: {message.sid}")
         return message.sid
+    except CircuitOpenError:
+        raise
     except Exception as e:
         print(f"❌ Failed to send SMS to {to_number}: {e}")
         return None
 
-def process_conversations():
-    print(f"🔄 Running Worker at {datetime.now(timezone.utc)}")
-    
-    # 1. Fetch Customers (Workaround for missing /conversations endpoint)
+def iter_customers(page_size=SWEEP_PAGE_SIZE, stats=None):
+    """Yields every customer, walking /customers one offset page at a time."""
+    offset = 0
+    while True:
+        started = time.monotonic()
+        customers_resp = db_client.list_customers(limit=page_size, offset=offset)
+        page = customers_resp.get("customers", [])
+        if stats is not None:
+            stats["pages"] += 1
+            stats["list_seconds"] += time.monotonic() - started
+        for cust in page:
+            yield cust
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+def fetch_context(customer_id):
+    """Fetches a customer's context, returning None if the lookup fails."""
     try:
-        customers_resp = db_client.list_customers(limit=100)
-        customers = customers_resp.get("customers", [])
+        # Use string ID for lookup
+        return db_client.get_context(str(customer_id), lookup_by="id")
     except Exception as e:
-        print(f"Error fetching customers: {e}")
+        # print(f"Error getting context for {customer_id}: {e}")
+        return None
+
+def evaluate_context(context, pipeline=None):
+    """
+    Applies the follow-up strategy to a single customer context and leaves it
+    indexed for its next follow-up (or drops it from the due index).
+    A due follow-up message is handed to `pipeline` when given (see
+    build_followup_pipeline), otherwise generated, sent and recorded inline.
+    """
+    customer_id = context.get("customer_id")
+    intent = context.get("intent")
+    last_interaction_str = context.get("last_interaction_at")
+    context_id = context.get("context_id")
+
+    # Skip if no active context
+    if context.get("status") != "active":
+        due_index.remove(context_id)
         return
 
-    print(f"Found {len(customers)} customers. Checking contexts...")
+    if not intent or intent not in STRATEGY:
+        due_index.remove(context_id)
+        return
 
-    for cust in customers:
-        customer_id = cust.get("customer_id")
-        
-        # 2. Fetch Context for each customer
+    # Parse timestamp
+    last_interaction = parse_timestamp(last_interaction_str)
+    if last_interaction is None:
+        due_index.remove(context_id)
+        return
+
+    mins_since_last = (time.time() - last_interaction) / 60
+
+    # Get Strategy Rules
+    rule = STRATEGY[intent]
+    wait_minutes = rule.get("wait_minutes")
+    next_intent = rule.get("next_intent")
+    instruction = rule.get("instruction")
+
+    # Skip states that don't need auto-follow-ups
+    if wait_minutes is None:
+        due_index.remove(context_id)
+        return
+
+    if mins_since_last >= float(wait_minutes):
+        print(f"⚡ Triggering rule {intent} -> {next_intent} for {context_id}")
+
+        if instruction:
+            # Personalize Template
+            customer_data = context.get("customer", {})
+            phone = customer_data.get("phone_normalized") or customer_data.get("phone")
+            name = customer_data.get("name")
+            if not name or name.lower() == "test user" or "unknown" in name.lower():
+                name = "there"
+
+            followup = {
+                "context": context,
+                "context_id": context_id,
+                "customer_id": customer_id,
+                "next_intent": next_intent,
+                "instruction": instruction,
+                "phone": phone,
+                "name": name,
+            }
+            if pipeline is not None:
+                pipeline.submit(followup)
+            else:
+                # Same stages inline; a stage returning None stops the follow-up there
+                for stage in FOLLOWUP_STAGES:
+                    followup = stage(followup)
+                    if followup is None:
+                        break
+        else:
+            # No template means it's a silent phase transition (e.g. moving to NURTURE)
+            lease = lease_context(context)
+            if lease is None:
+                return
+            try:
+                print(f"💤 Moving {context_id} to {next_intent} (Silent)")
+                db_client.update_conversation(
+                    context_id=context_id,
+                    intent=next_intent,
+                    summary=with_event(context.get("summary", ""), "unresponsive", f"moved to {next_intent}"),
+                    last_agent_action=f"Moved to {next_intent} (unresponsive)"
+                )
+                due_index.schedule(context_id, customer_id, next_intent)
+            finally:
+                conversation_locks.release(lease)
+    else:
+        # Not due yet (e.g. the lead replied since it was indexed)
+        due_index.schedule(context_id, customer_id, intent, last_interaction)
+
+def lease_context(context):
+    """
+    Takes the conversation's lease without waiting and re-reads the context
+    under it (updating `context` in place). Returns None, leaving the context
+    indexed for later, if a reply holds the conversation or it changed since
+    the sweep read it.
+    """
+    context_id = context.get("context_id")
+    customer_id = context.get("customer_id")
+    lease = conversation_locks.acquire(context_id, blocking=False)
+    if lease is None:
+        print(f"🔒 {context_id} is busy, retrying in {FOLLOWUP_BUSY_DELAY}s")
+        due_index.requeue(context_id, customer_id, time.time() + FOLLOWUP_BUSY_DELAY)
+        return None
+
+    fresh = fetch_context(customer_id)
+    if fresh is None:
+        conversation_locks.release(lease)
+        due_index.requeue(context_id, customer_id, time.time() + FOLLOWUP_RETRY_DELAY)
+        return None
+    if (fresh.get("context_id"), fresh.get("status"), fresh.get("intent"), fresh.get("last_interaction_at")) != \
+            (context_id, context.get("status"), context.get("intent"), context.get("last_interaction_at")):
+        # The lead wrote (or a turn moved the intent on) since the sweep read it
+        conversation_locks.release(lease)
+        print(f"🔄 {context_id} changed since it was read, re-indexing")
+        if fresh.get("context_id") == context_id and fresh.get("status") == "active":
+            due_index.schedule(context_id, customer_id, fresh.get("intent"),
+                               parse_timestamp(fresh.get("last_interaction_at")))
+        else:
+            due_index.remove(context_id)
+        return None
+    context.update(fresh)
+    return lease
+
+def _releasing_lease(stage):
+    """Wraps a follow-up stage so the conversation's lease is let go once the follow-up stops there."""
+    @functools.wraps(stage)
+    def run(followup):
         try:
-            # Use string ID for lookup
-            context = db_client.get_context(str(customer_id), lookup_by="id")
-        except Exception as e:
-            # print(f"Error getting context for {customer_id}: {e}")
-            continue
-
-        # Skip if no active context
-        if context.get("status") != "active":
-            continue
-            
-        intent = context.get("intent")
-        last_interaction_str = context.get("last_interaction_at")
-        context_id = context.get("context_id")
-        
-        if not intent or intent not in STRATEGY:
-            continue
-
-        if not last_interaction_str:
-            continue
-
-        # Parse timestamp
+            result = stage(followup)
+        except Exception:
+            conversation_locks.release(followup.get("lease"))
+            raise
+        if result is None:
+            conversation_locks.release(followup.get("lease"))
+        return result
+    return run
+
+def _defer_while_sms_down(followup, force=False):
+    """
+    True (and the context is put back for later) while the Twilio breaker is
+    open, or with force after it refused the send: the send would fail
+    anyway, so skip it without using up a retry.
+    """
+    if not force and not breakers["twilio"].is_open():
+        return False
+    print(f"⚡ Twilio circuit open, deferring follow-up for {followup['context_id']}")
+    due_index.requeue(followup["context_id"], followup["customer_id"], time.time() + FOLLOWUP_RETRY_DELAY)
+    return True
+
+def generate_followup(followup):
+    """Pipeline stage 1 (LLM): drafts the follow-up message."""
+    if _defer_while_sms_down(followup):
+        return None
+    # Held through send and record; released by _releasing_lease when the follow-up stops
+    followup["lease"] = lease_context(followup["context"])
+    if followup["lease"] is None:
+        return None
+    print(f"DEBUG: Generating AI follow-up for {followup['name']}...")
+    followup["body"] = generate_smart_followup(followup["context"], followup["instruction"], followup["name"])
+    # The summary to record once it is sent. Compacting may call the LLM too, so it runs
+    # here under this stage's workers and per-minute cap, not on a DB worker
+    followup["sent_summary"] = compact_summary(
+        with_followup_sent(followup["context"].get("summary", ""), followup["next_intent"]))
+    return followup
+
+def send_followup(followup):
+    """Pipeline stage 2 (Twilio): sends it. sid is None when the send failed."""
+    if _defer_while_sms_down(followup):
+        return None
+    if not conversation_locks.renew(followup["lease"]):
+        # Queued here past the lease's expiry; a reply may have taken the conversation since
+        print(f"🔒 Lost the lease on {followup['context_id']}, not sending a stale follow-up")
+        due_index.requeue(followup["context_id"], followup["customer_id"], time.time() + FOLLOWUP_BUSY_DELAY)
+        return None
+    try:
+        followup["sid"] = send_sms(followup["phone"], followup["body"])
+    except CircuitOpenError:
+        # Half-open, and another process has the probe
+        _defer_while_sms_down(followup, force=True)
+        return None
+    return followup
+
+def record_followup(followup):
+    """Pipeline stage 3 (Core API): logs the message, moves the intent on and reindexes, or tracks the retry."""
+    context_id = followup["context_id"]
+    customer_id = followup["customer_id"]
+    next_intent = followup["next_intent"]
+    msg_body = followup["body"]
+    sid = followup["sid"]
+    current_summary = followup["context"].get("summary", "")
+
+    if sid:
+        db_client.log_message(
+            customer_id=customer_id,
+            channel="sms",
+            identifier=followup["phone"],
+            direction="outbound",
+            body=msg_body,
+            context_id=context_id,
+            metadata={"twilio_sid": sid, "type": f"auto_{next_intent.lower()}"}
+        )
+
+        # The follow-up counted in the summary's events line (a fixed-size slot), drafted in the LLM stage
+        db_client.update_conversation(
+            context_id=context_id,
+            intent=next_intent,
+            summary=followup["sent_summary"],
+            last_agent_action=f"Auto-sent follow-up: {msg_body[:40]}..."
+        )
+        due_index.schedule(context_id, customer_id, next_intent)
+        clear_retry(context_id)
+    else:
+        # SMS failed - track retries
+        retries = increment_retry(context_id)
+        if retries >= MAX_SMS_RETRIES:
+            print(f"🚫 Max retries ({MAX_SMS_RETRIES}) reached for {context_id}. Moving to {next_intent} (SMS_FAILED).")
+            db_client.update_conversation(
+                context_id=context_id,
+                intent=next_intent,
+                summary=with_event(current_summary, "sms", f"failed after {retries} attempts, phone invalid or unreachable"),
+                last_agent_action=f"SMS delivery failed after {retries} retries"
+            )
+            due_index.schedule(context_id, customer_id, next_intent)
+            clear_retry(context_id)
+        else:
+            print(f"⚠️ SMS failed for {context_id} (attempt {retries}/{MAX_SMS_RETRIES}). Will retry next cycle.")
+            # Still due: popped again once the retry delay is up
+            due_index.requeue(context_id, customer_id, time.time() + FOLLOWUP_RETRY_DELAY)
+
+# A follow-up's stages in order; each lets go of the conversation lease if the follow-up ends there
+FOLLOWUP_STAGES = tuple(_releasing_lease(stage) for stage in (generate_followup, send_followup, record_followup))
+
+def build_followup_pipeline():
+    """
+    LLM -> SMS -> DB pipeline for due follow-ups. Each stage has its own
+    worker count and per-minute cap (OpenAI and Twilio quotas); bounded
+    queues between stages make a throttled stage slow down the ones before it.
+    """
+    generate, send, record = FOLLOWUP_STAGES
+    return Pipeline([
+        Stage("llm", generate, FOLLOWUP_LLM_WORKERS, FOLLOWUP_LLM_PER_MINUTE),
+        Stage("sms", send, FOLLOWUP_SMS_WORKERS, FOLLOWUP_SMS_PER_MINUTE),
+        Stage("db", record, FOLLOWUP_DB_WORKERS, FOLLOWUP_DB_PER_MINUTE),
+    ], queue_size=FOLLOWUP_QUEUE_SIZE)
+
+def _evaluate_fetched(context, stats, pipeline=None):
+    """Evaluates one fetched context (None = failed lookup), tracking sweep stats."""
+    if context is None:
+        stats["context_errors"] += 1
+        return
+    stats["contexts_fetched"] += 1
+    started = time.monotonic()
+    try:
+        evaluate_context(context, pipeline)
+    except Exception as e:
+        print(f"❌ Failed to evaluate context {context.get('context_id')}: {e}")
+    stats["evaluate_seconds"] += time.monotonic() - started
+
+def _drain(futures, stats, pipeline=None):
+    """Evaluates each finished context fetch."""
+    for future in futures:
+        _evaluate_fetched(future.result(), stats, pipeline)
+
+def _pool(workers, executor=None):
+    """The scheduler daemon's long-lived executor, or a fresh one for this sweep."""
+    return nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=workers)
+
+def _sweep_threaded(workers, page_size, stats, executor=None, pipeline=None):
+    """Fetches contexts on a thread pool, keeping at most workers * 4 in flight."""
+    max_in_flight = workers * 4
+    with _pool(workers, executor) as executor:
+        pending = set()
         try:
-            last_interaction = datetime.fromisoformat(last_interaction_str.replace("Z", "+00:00"))
-            if last_interaction.tzinfo is None:
-                last_interaction = last_interaction.replace(tzinfo=timezone.utc)
-        except ValueError:
-            continue
-
-        now = datetime.now(timezone.utc)
-        time_diff = now - last_interaction
-        mins_since_last = time_diff.total_seconds() / 60
-
-        # Get Strategy Rules
-        rule = STRATEGY[intent]
-        wait_minutes = rule.get("wait_minutes")
-        next_intent = rule.get("next_intent")
-        instruction = rule.get("instruction")
-
-        # Skip states that don't need auto-follow-ups
-        if wait_minutes is None:
-            continue
-
-        if mins_since_last >= float(wait_minutes):
-            print(f"⚡ Triggering rule {intent} -> {next_intent} for {context_id}")
-            
-            if instruction:
-                # Personalize Template
-                customer_data = context.get("customer", {})
-                phone = customer_data.get("phone_normalized") or customer_data.get("phone")
-                name = customer_data.get("name")
-                if not name or name.lower() == "test user" or "unknown" in name.lower():
-                    name = "there"
-
-                print(f"DEBUG: Generating AI follow-up for {name}...")
-                msg_body = generate_smart_followup(context, instruction, name)
-                
-                sid = send_sms(phone, msg_body)
-                if sid:
-                    db_client.log_message(
-                        customer_id=customer_id,
-                        channel="sms",
-                        identifier=phone,
-                        direction="outbound",
-                        body=msg_body,
-                        context_id=context_id,
-                        metadata={"twilio_sid": sid, "type": f"auto_{next_intent.lower()}"}
-                    )
-                    
-                    # Update summary dynamically to reflect the sent message
-                    current_summary = context.get("summary", "")
-                    updated_summary = f"{current_summary}\n\n[System Update] Sarah auto-sent follow-up: {msg_body[:40]}..."
-                    
-                    db_client.update_conversation(context_id=context_id, intent=next_intent, summary=updated_summary)
-                    clear_retry(context_id)
-                else:
-                    # SMS failed - track retries
-                    retries = increment_retry(context_id)
-                    if retries >= MAX_SMS_RETRIES:
-                        print(f"🚫 Max retries ({MAX_SMS_RETRIES}) reached for {context_id}. Moving to {next_intent} (SMS_FAILED).")
-                        db_client.update_conversation(
-                            context_id=context_id,
-                            intent=next_intent,
-                            summary=f"[SMS FAILED after {retries} attempts] Moved to {next_intent} - invalid or unreachable phone.",
-                            last_agent_action=f"SMS delivery failed after {retries} retries"
-                        )
-                        clear_retry(context_id)
-                    else:
-                        print(f"⚠️ SMS failed for {context_id} (attempt {retries}/{MAX_SMS_RETRIES}). Will retry next cycle.")
+            for cust in iter_customers(page_size, stats):
+                if shutdown_requested.is_set():
+                    break
+                stats["customers"] += 1
+                pending.add(executor.submit(fetch_context, cust.get("customer_id")))
+                if len(pending) >= max_in_flight:
+                    started = time.monotonic()
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    stats["fetch_wait_seconds"] += time.monotonic() - started
+                    _drain(done, stats, pipeline)
+        except Exception as e:
+            print(f"Error fetching customers: {e}")
+
+        while pending:
+            started = time.monotonic()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            stats["fetch_wait_seconds"] += time.monotonic() - started
+            _drain(done, stats, pipeline)
+
+async def _sweep_async(workers, page_size, stats, pipeline=None):
+    """
+    Fetches contexts with AsyncSarahDBClient, at most `workers` lookups at a time.
+    Evaluation (LLM + Twilio, both blocking) runs in a thread so lookups keep flowing.
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async def fetch(client, customer_id):
+        async with semaphore:
+            try:
+                return await client.get_context(str(customer_id), lookup_by="id")
+            except Exception:
+                return None
+
+    async def drain(tasks):
+        for task in asyncio.as_completed(tasks):
+            started = time.monotonic()
+            context = await task
+            stats["fetch_wait_seconds"] += time.monotonic() - started
+            await asyncio.to_thread(_evaluate_fetched, context, stats, pipeline)
+
+    async with AsyncSarahDBClient(api_key=API_KEY, pool_size=workers, rate_limiter=rate_limiter,
+                                  circuit_breaker=breakers["core_api"]) as client:
+        offset = 0
+        while True:
+            started = time.monotonic()
+            try:
+                page = (await client.list_customers(limit=page_size, offset=offset)).get("customers", [])
+            except Exception as e:
+                print(f"Error fetching customers: {e}")
+                break
+            stats["pages"] += 1
+            stats["list_seconds"] += time.monotonic() - started
+            stats["customers"] += len(page)
+
+            await drain([asyncio.ensure_future(fetch(client, c.get("customer_id"))) for c in page])
+            if len(page) < page_size:
+                break
+            offset += len(page)
+
+def _sweep_due(workers, page_size, stats, executor=None, pipeline=None):
+    """
+    Pops due contexts off the due index page by page and fetches + evaluates
+    them on a thread pool. Only entries due by the start of the sweep are
+    popped, so anything requeued while it runs waits for the next tick.
+    """
+    now = time.time()
+    with _pool(workers, executor) as executor:
+        while not shutdown_requested.is_set():
+            started = time.monotonic()
+            try:
+                due = due_index.pop_due(now, limit=page_size)
+            except Exception as e:
+                print(f"Error reading due index: {e}")
+                break
+            stats["pages"] += 1
+            stats["list_seconds"] += time.monotonic() - started
+            stats["due"] += len(due)
+
+            for context_id, customer_id in due:
+                if not customer_id:
+                    due_index.remove(context_id)
+            futures = {executor.submit(fetch_context, customer_id): (context_id, customer_id)
+                       for context_id, customer_id in due if customer_id}
+            pending = set(futures)
+            while pending:
+                started = time.monotonic()
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                stats["fetch_wait_seconds"] += time.monotonic() - started
+                for future in done:
+                    if future.result() is None:
+                        # Lookup failed: try again once the retry delay is up
+                        due_index.requeue(*futures[future], time.time() + FOLLOWUP_RETRY_DELAY)
+                _drain(done, stats, pipeline)
+
+            if len(due) < page_size:
+                break
+
+def _use_due_index():
+    """Due mode, except on the periodic full sweep that rebuilds the index (or if Redis is down)."""
+    if SWEEP_MODE != "due":
+        return False
+    try:
+        return not due_index.needs_rebuild(FOLLOWUP_INDEX_REBUILD_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Due index unavailable, running a full sweep: {e}")
+        return False
+
+def process_conversations(workers=SWEEP_WORKERS, page_size=SWEEP_PAGE_SIZE, executor=None, pipeline=None):
+    """
+    In due mode, evaluates only the contexts the due index says are due.
+    Otherwise (and once per FOLLOWUP_INDEX_REBUILD_SECONDS) sweeps every
+    customer page, fetching contexts concurrently on a bounded worker pool
+    and evaluating each one as soon as it arrives; that also re-indexes them.
+    Due follow-ups go through `pipeline` (the daemon's long-lived one) or a
+    pipeline built for this sweep; either way the sweep waits for them.
+    Returns the sweep stats.
+    """
+    print(f"🔄 Running Worker at {datetime.now(timezone.utc)}")
+    sweep_started = time.monotonic()
+    stats = {
+        "workers": workers,
+        "pages": 0,
+        "customers": 0,
+        "due": 0,
+        "contexts_fetched": 0,
+        "context_errors": 0,
+        "list_seconds": 0.0,
+        "fetch_wait_seconds": 0.0,
+        "evaluate_seconds": 0.0,
+    }
+
+    # Due follow-ups go through the LLM -> SMS -> DB pipeline; leaving the block waits for it to drain
+    with (nullcontext(pipeline) if pipeline else build_followup_pipeline()) as pipeline:
+        if _use_due_index():
+            stats["mode"] = "due"
+            _sweep_due(workers, page_size, stats, executor, pipeline)
+        else:
+            # 1. Fetch Customers page by page (Workaround for missing /conversations endpoint)
+            # 2. Fetch Context for each customer concurrently, evaluating results as they land
+            stats["mode"] = "full"
+            if SWEEP_ASYNC:
+                asyncio.run(_sweep_async(workers, page_size, stats, pipeline))
             else:
-                # No template means it's a silent phase transition (e.g. moving to NURTURE)
-                print(f"💤 Moving {context_id} to {next_intent} (Silent)")
-                db_client.update_conversation(context_id=context_id, intent=next_intent, summary=f"Moved to {next_intent} (unresponsive)")
+                _sweep_threaded(workers, page_size, stats, executor, pipeline)
+        pipeline.join()
+
+    stats["total_seconds"] = time.monotonic() - sweep_started
+    stats["pipeline"] = pipeline.get_stats()
+    if stats["mode"] == "due":
+        print(
+            f"📊 Due sweep done: {stats['due']} due contexts, "
+            f"{stats['contexts_fetched']} fetched ({stats['context_errors']} errors) "
+            f"with {workers} workers | index {stats['list_seconds']:.2f}s, "
+            f"fetch wait {stats['fetch_wait_seconds']:.2f}s, evaluate {stats['evaluate_seconds']:.2f}s, "
+            f"total {stats['total_seconds']:.2f}s"
+        )
+    else:
+        print(
+            f"📊 Sweep done: {stats['customers']} customers over {stats['pages']} pages, "
+            f"{stats['contexts_fetched']} contexts fetched ({stats['context_errors']} errors) "
+            f"with {workers} workers | list {stats['list_seconds']:.2f}s, "
+            f"fetch wait {stats['fetch_wait_seconds']:.2f}s, evaluate {stats['evaluate_seconds']:.2f}s, "
+            f"total {stats['total_seconds']:.2f}s"
+        )
+    if stats["pipeline"]["llm"]["processed"]:
+        print("🚚 Follow-up pipeline: " + " | ".join(
+            f"{name} {s['processed']} done ({s['errors']} errors, {s['workers']} workers): "
+            f"{s['items_per_minute']}/min, capacity {s['capacity_per_minute']}/min, "
+            f"throttled {s['throttled_seconds']}s"
+            for name, s in stats["pipeline"].items()
+        ))
+    return stats
+
+def seconds_until_next_due():
+    """How long the daemon may sleep: until the earliest due follow-up, within the configured bounds."""
+    try:
+        next_due = due_index.next_due() if SWEEP_MODE == "due" else None
+    except Exception as e:
+        print(f"⚠️ Could not read due index: {e}")
+        next_due = None
+    if next_due is None:
+        return SCHEDULER_MAX_SLEEP
+    return min(max(next_due - time.time(), SCHEDULER_MIN_SLEEP), SCHEDULER_MAX_SLEEP)
+
+def run_scheduler(workers=SWEEP_WORKERS, page_size=SWEEP_PAGE_SIZE):
+    """
+    Long-running alternative to one sweep per cron run. Clients, the strategy,
+    the worker pool and the follow-up pipeline's threads stay loaded; each loop
+    reloads the strategy if the file changed, runs a sweep and sleeps until the
+    next follow-up is due (re-checking at least every SCHEDULER_MAX_SLEEP
+    seconds for newly indexed ones).
+    SIGTERM/SIGINT stop it after the current sweep's in-flight items finish.
+    """
+    def request_shutdown(signum, frame):
+        print(f"🛑 Received signal {signum}, shutting down after the current sweep")
+        shutdown_requested.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    print(f"⏰ Follow-up scheduler started ({workers} workers, mode {SWEEP_MODE})")
+    with ThreadPoolExecutor(max_workers=workers) as executor, build_followup_pipeline() as pipeline:
+        while not shutdown_requested.is_set():
+            if due_index.reload_strategy():
+                print(f"🔁 Reloaded follow-up strategy ({len(STRATEGY)} rules)")
+            try:
+                process_conversations(workers, page_size, executor, pipeline)
+            except Exception as e:
+                print(f"❌ Sweep failed: {e}")
+            shutdown_requested.wait(seconds_until_next_due())
+
+    db_client.close()
+    print("👋 Follow-up scheduler stopped")
 
 if __name__ == "__main__":
-    process_conversations()
+    parser = argparse.ArgumentParser(description="Sends automatic SMS follow-ups per followup_strategy.json.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and process follow-ups as they come due instead of one sweep")
+    args = parser.parse_args()
+    if args.daemon:
+        run_scheduler()
+    else:
+        process_conversations()
@@ -0,0 +1,209 @@
+"""
+Due-time index for automatic follow-ups.
+
+A Redis sorted set holds one member per context_id, scored by the epoch time
+its next follow-up is due: last interaction + wait_minutes of the current
+intent in followup_strategy.json. A hash next to it maps each context_id to
+its customer_id, which is what the Core API looks contexts up by.
+
+The webhook reschedules a context whenever a turn changes its intent, and the
+cron worker reschedules after acting on it, so a tick only has to pop the
+entries whose score is <= now. Scores can go stale (a lead texts back, an
+intent is changed outside this service); the worker re-checks every popped
+context against its fresh last_interaction_at and puts it back if it is not
+due yet, so a stale entry costs one lookup and never triggers an early send.
+
+Popping only claims an entry: it moves to a second sorted set scored by when
+the claim runs out (FOLLOWUP_CLAIM_SECONDS). Rescheduling, requeueing or
+removing the context acks the claim; a claim nobody acked (the follow-up
+raised somewhere, or the worker died) goes back on the index, due at once,
+on the next pop after it runs out.
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from utils import log_event
+
+STRATEGY_FILE = os.path.join(os.path.dirname(__file__), "followup_strategy.json")
+
+# How long a popped context may take to be acked before it is handed out again;
+# covers the follow-up's wait behind a throttled LLM or SMS stage
+FOLLOWUP_CLAIM_SECONDS = int(os.getenv("FOLLOWUP_CLAIM_SECONDS", "900"))
+
+# Puts lapsed claims back, then claims due members atomically, so two workers never pop the same context
+POP_DUE_SCRIPT = """
+local lapsed = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[3])
+for _, id in ipairs(lapsed) do
+    redis.call('ZADD', KEYS[1], ARGV[3], id)
+end
+if #lapsed > 0 then
+    redis.call('ZREM', KEYS[3], unpack(lapsed))
+end
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids == 0 then
+    return {}
+end
+redis.call('ZREM', KEYS[1], unpack(ids))
+for _, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[3], ARGV[4], id)
+end
+local customers = redis.call('HMGET', KEYS[2], unpack(ids))
+local result = {}
+for i, id in ipairs(ids) do
+    result[#result + 1] = id
+    result[#result + 1] = customers[i] or false
+end
+return result
+"""
+
+
+def load_strategy(path=STRATEGY_FILE):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def parse_timestamp(value):
+    """Epoch seconds for an ISO-8601 timestamp (naive = UTC), or None."""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class FollowupDueIndex:
+    """
+    Sorted set of context_ids by follow-up due time (see module docstring).
+    Redis errors are logged and swallowed: the periodic full sweep rebuilds
+    anything a failed write left out.
+    """
+
+    def __init__(self, redis_client, strategy, prefix="followup_due", claim_seconds=FOLLOWUP_CLAIM_SECONDS,
+                 strategy_file=None):
+        self.redis = redis_client
+        self.strategy = strategy
+        # With strategy_file, schedule() picks up edits to it (see reload_strategy)
+        self.strategy_file = strategy_file
+        self._strategy_mtime = os.path.getmtime(strategy_file) if strategy_file else None
+        self.claim_seconds = claim_seconds
+        self.key = prefix
+        self.customers_key = f"{prefix}:customers"
+        self.claimed_key = f"{prefix}:claimed"
+        self.built_key = f"{prefix}:built"
+        self._pop_due = redis_client.register_script(POP_DUE_SCRIPT)
+
+    def reload_strategy(self):
+        """
+        Re-reads strategy_file into self.strategy, in place, if the file changed.
+        Returns True if it did; a file that fails to parse keeps the current rules.
+        """
+        if not self.strategy_file:
+            return False
+        try:
+            mtime = os.path.getmtime(self.strategy_file)
+            if mtime == self._strategy_mtime:
+                return False
+            strategy = load_strategy(self.strategy_file)
+        except (OSError, ValueError) as e:
+            log_event(f"Could not reload {self.strategy_file}, keeping current rules: {e}")
+            return False
+        self.strategy.clear()
+        self.strategy.update(strategy)
+        self._strategy_mtime = mtime
+        log_event(f"Reloaded {self.strategy_file} ({len(self.strategy)} rules)")
+        return True
+
+    def due_at(self, intent, last_interaction):
+        """Epoch time the follow-up for intent is due, or None if it has none."""
+        rule = self.strategy.get(intent) if intent else None
+        if not rule or rule.get("wait_minutes") is None:
+            return None
+        return last_interaction + float(rule["wait_minutes"]) * 60
+
+    def schedule(self, context_id, customer_id, intent, last_interaction=None):
+        """
+        (Re)index a context for its current intent; last_interaction defaults to now.
+        Intents without an automatic follow-up drop the context from the index.
+        Returns the due time, or None.
+        """
+        if not context_id:
+            return None
+        self.reload_strategy()
+        if last_interaction is None:
+            last_interaction = time.time()
+        due = self.due_at(intent, last_interaction)
+        if due is None or customer_id is None:
+            self.remove(context_id)
+            return None
+        try:
+            pipe = self.redis.pipeline()
+            pipe.zadd(self.key, {context_id: due})
+            pipe.hset(self.customers_key, context_id, str(customer_id))
+            pipe.zrem(self.claimed_key, context_id)
+            pipe.execute()
+        except Exception as e:
+            log_event(f"Due index write failed for {context_id}: {e}")
+        return due
+
+    def requeue(self, context_id, customer_id, at=None):
+        """Put a popped context back as due at `at` (default now), e.g. to retry it next tick."""
+        if not context_id or customer_id is None:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            pipe.zadd(self.key, {context_id: time.time() if at is None else at})
+            pipe.hset(self.customers_key, context_id, str(customer_id))
+            pipe.zrem(self.claimed_key, context_id)
+            pipe.execute()
+        except Exception as e:
+            log_event(f"Due index write failed for {context_id}: {e}")
+
+    def remove(self, context_id):
+        if not context_id:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            pipe.zrem(self.key, context_id)
+            pipe.zrem(self.claimed_key, context_id)
+            pipe.hdel(self.customers_key, context_id)
+            pipe.execute()
+        except Exception as e:
+            log_event(f"Due index write failed for {context_id}: {e}")
+
+    def pop_due(self, now=None, limit=500):
+        """
+        Claim and return up to `limit` (context_id, customer_id) pairs due by now.
+        Callers ack each one by rescheduling, requeueing or removing it; one
+        left unacked is due again once its claim runs out.
+        """
+        current = time.time()
+        now = current if now is None else now
+        flat = self._pop_due(keys=[self.key, self.customers_key, self.claimed_key],
+                             args=[now, limit, current, current + self.claim_seconds])
+        pairs = []
+        for i in range(0, len(flat), 2):
+            context_id, customer_id = flat[i], flat[i + 1]
+            context_id = context_id.decode() if isinstance(context_id, bytes) else context_id
+            customer_id = customer_id.decode() if isinstance(customer_id, bytes) else customer_id
+            pairs.append((context_id, customer_id))
+        return pairs
+
+    def next_due(self):
+        """Epoch time of the earliest indexed follow-up, or None if the index is empty."""
+        entries = self.redis.zrange(self.key, 0, 0, withscores=True)
+        return entries[0][1] if entries else None
+
+    def size(self):
+        return self.redis.zcard(self.key)
+
+    def needs_rebuild(self, interval):
+        """
+        True once per `interval` seconds (across all workers): time for a full
+        sweep that re-indexes every context, including ones never seen here.
+        """
+        return bool(self.redis.set(self.built_key, int(time.time()), nx=True, ex=interval))
@@ -0,0 +1,122 @@
+"""
+Idempotent inbound SMS webhooks, keyed on Twilio's MessageSid: a retried
+delivery gets the first delivery's TwiML instead of running the turn again.
+Redis errors fail open.
+"""
+
+import asyncio
+import os
+import time
+
+from utils import log_event
+
+SMS_IDEMPOTENCY_TTL = int(os.getenv("SMS_IDEMPOTENCY_TTL", "86400"))
+SMS_IN_FLIGHT_TTL = int(os.getenv("SMS_IN_FLIGHT_TTL", "120"))
+# Kept under Twilio's 15s webhook timeout, so the retry itself is not retried
+SMS_DUPLICATE_WAIT = float(os.getenv("SMS_DUPLICATE_WAIT", "12"))
+
+IN_FLIGHT = b"__in_flight__"
+
+
+class RedisIdempotencyStore:
+    """
+    One key per MessageSid, holding a marker while the turn runs and the
+    TwiML response afterwards. Duplicate counts are kept in a Redis hash.
+    """
+
+    def __init__(self, redis_client, ttl=SMS_IDEMPOTENCY_TTL, in_flight_ttl=SMS_IN_FLIGHT_TTL,
+                 wait=SMS_DUPLICATE_WAIT, prefix="sms_sid"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.in_flight_ttl = in_flight_ttl
+        self.wait = wait
+        self.prefix = prefix
+        self.stats_key = f"{prefix}:stats"
+
+    def _key(self, sid):
+        return f"{self.prefix}:{sid}"
+
+    def _count(self, field):
+        try:
+            self.redis.hincrby(self.stats_key, field, 1)
+        except Exception as e:
+            log_event(f"Idempotency stats failed: {e}")
+
+    def claim(self, sid):
+        """True if this delivery owns the turn for sid (first seen, or Redis is down)."""
+        try:
+            claimed = bool(self.redis.set(self._key(sid), IN_FLIGHT, nx=True, ex=self.in_flight_ttl))
+        except Exception as e:
+            log_event(f"Idempotency store unavailable, processing {sid}: {e}")
+            return True
+        if not claimed:
+            self._count("duplicates")
+        return claimed
+
+    def complete(self, sid, response):
+        """Store the finished turn's response for retries of sid."""
+        try:
+            self.redis.set(self._key(sid), response, ex=self.ttl)
+        except Exception as e:
+            log_event(f"Idempotency store write failed for {sid}: {e}")
+
+    def release(self, sid):
+        """Drop the claim of a turn that failed, so a retry can run it."""
+        try:
+            self.redis.delete(self._key(sid))
+        except Exception as e:
+            log_event(f"Idempotency store write failed for {sid}: {e}")
+
+    def _check(self, sid):
+        """(done, response): done once the original has stored its response or given up its claim."""
+        try:
+            value = self.redis.get(self._key(sid))
+        except Exception as e:
+            log_event(f"Idempotency store read failed for {sid}: {e}")
+            return True, None
+        if value is None:
+            # The original failed and released its claim
+            return True, None
+        if value == IN_FLIGHT:
+            return False, None
+        self._count("replayed")
+        return True, value.decode() if isinstance(value, bytes) else value
+
+    def response_for(self, sid):
+        """
+        The stored response for a duplicate of sid, waiting while the original
+        is still in flight. None if it did not finish in time.
+        """
+        deadline = time.monotonic() + self.wait
+        delay = 0.05
+        while True:
+            done, response = self._check(sid)
+            if done:
+                return response
+            if time.monotonic() >= deadline:
+                self._count("in_flight_timeouts")
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def response_for_async(self, sid):
+        """Async version of response_for()."""
+        deadline = time.monotonic() + self.wait
+        delay = 0.05
+        while True:
+            done, response = await asyncio.to_thread(self._check, sid)
+            if done:
+                return response
+            if time.monotonic() >= deadline:
+                await asyncio.to_thread(self._count, "in_flight_timeouts")
+                return None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def get_stats(self):
+        try:
+            raw = self.redis.hgetall(self.stats_key)
+        except Exception as e:
+            log_event(f"Idempotency stats failed: {e}")
+            return {}
+        return {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in raw.items()}
@@ -0,0 +1,197 @@
+"""
+Latency spans for SMS turns. Each turn is logged as one JSON line with its
+per-stage milliseconds, and timings go into Redis histograms served on
+/metrics.
+"""
+
+import bisect
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from shared_redis import redis_conn
+from utils import log_event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Upper bounds in seconds; a Core API read is ~0.05-0.3s, a completion 1-10s
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_METRIC = "sms_stage_seconds"
+TURN_METRIC = "sms_turn_seconds"
+ERRORS_METRIC = "sms_stage_errors_total"
+COALESCED_METRIC = "sms_coalesced_messages_total"
+
+_HELP = {
+    STAGE_METRIC: ("stage", "Latency of one outbound call or step (Core API, OpenAI, Make.com, VAPI, Twilio, TwiML)."),
+    TURN_METRIC: ("kind", "End-to-end latency of an SMS turn."),
+}
+
+# Plain counters: metric -> (label name, help)
+_COUNTER_HELP = {
+    COALESCED_METRIC: ("outcome", "Inbound SMS by coalescing outcome (turns run, and messages merged into another turn)."),
+}
+
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+
+class RedisHistograms:
+    """
+    Histograms in Redis, one hash per metric. Fields are "<label>|<bucket>"
+    (non-cumulative counts; the last bucket is +Inf), "<label>|sum" and
+    "<label>|count"; errors are a counter hash of "<label>" fields.
+    """
+
+    def __init__(self, redis_client, buckets=LATENCY_BUCKETS, prefix="metrics"):
+        self.redis = redis_client
+        self.buckets = buckets
+        self.prefix = prefix
+
+    def _key(self, metric):
+        return f"{self.prefix}:{metric}"
+
+    def write(self, observations, errors=()):
+        """observations: (metric, label, seconds) tuples; errors: stage labels."""
+        if not observations and not errors:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for metric, label, seconds in observations:
+                key = self._key(metric)
+                bucket = bisect.bisect_left(self.buckets, seconds)
+                pipe.hincrby(key, f"{label}|{bucket}", 1)
+                pipe.hincrbyfloat(key, f"{label}|sum", seconds)
+                pipe.hincrby(key, f"{label}|count", 1)
+            for label in errors:
+                pipe.hincrby(self._key(ERRORS_METRIC), label, 1)
+            pipe.execute()
+        except Exception as e:
+            log_event(f"Metrics write failed: {e}")
+
+    def incr(self, metric, label, amount=1):
+        try:
+            self.redis.hincrby(self._key(metric), label, amount)
+        except Exception as e:
+            log_event(f"Metrics write failed: {e}")
+
+    def _read(self, metric):
+        raw = self.redis.hgetall(self._key(metric))
+        return {
+            (k.decode() if isinstance(k, bytes) else k): float(v)
+            for k, v in raw.items()
+        }
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric, (label_name, help_text) in _HELP.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            fields = self._read(metric)
+            labels = sorted({field.partition("|")[0] for field in fields})
+            for label in labels:
+                cumulative = 0
+                bounds = [str(b) for b in self.buckets] + ["+Inf"]
+                for index, bound in enumerate(bounds):
+                    cumulative += int(fields.get(f"{label}|{index}", 0))
+                    lines.append(f'{metric}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label_name}="{label}"}} {round(fields.get(f"{label}|sum", 0.0), 6)}')
+                lines.append(f'{metric}_count{{{label_name}="{label}"}} {int(fields.get(f"{label}|count", 0))}')
+        lines.append(f"# HELP {ERRORS_METRIC} Stages that raised.")
+        lines.append(f"# TYPE {ERRORS_METRIC} counter")
+        for label, count in sorted(self._read(ERRORS_METRIC).items()):
+            lines.append(f'{ERRORS_METRIC}{{stage="{label}"}} {int(count)}')
+        for metric, (label_name, help_text) in _COUNTER_HELP.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for label, count in sorted(self._read(metric).items()):
+                lines.append(f'{metric}{{{label_name}="{label}"}} {int(count)}')
+        return "\n".join(lines) + "\n"
+
+
+class Turn:
+    """Span timings for one turn, sent together when it ends."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> total seconds (a stage can run more than once)
+        self.observations = []
+        self.errors = []
+
+    def add(self, stage, seconds, error):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.observations.append((STAGE_METRIC, stage, seconds))
+        if error:
+            self.errors.append(stage)
+
+
+@contextmanager
+def span(stage):
+    """Times the block as `stage`; an exception escaping it is counted as a stage error."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        current = _current_turn.get()
+        if current is not None:
+            current.add(stage, seconds, error)
+        else:
+            histograms.write([(STAGE_METRIC, stage, seconds)], [stage] if error else ())
+
+
+@contextmanager
+def turn(kind="sms", **fields):
+    """
+    Wraps one SMS turn. On exit logs {"event": "turn", "kind", "total_ms",
+    "stages": {stage: ms}, "other_ms", **fields} and records the histograms.
+    Nested turns are folded into the outer one.
+    """
+    if not METRICS_ENABLED or _current_turn.get() is not None:
+        yield
+        return
+    current = Turn(kind)
+    token = _current_turn.set(current)
+    try:
+        yield current
+    finally:
+        _current_turn.reset(token)
+        total = time.perf_counter() - current.started
+        stages_ms = {stage: round(seconds * 1000, 1) for stage, seconds in current.stages.items()}
+        log_event(json.dumps({
+            "event": "turn",
+            "kind": kind,
+            "total_ms": round(total * 1000, 1),
+            "stages": stages_ms,
+            # Time not covered by any span (prompt building, parsing, queueing)
+            "other_ms": round(max(0.0, total - sum(current.stages.values())) * 1000, 1),
+            **fields
+        }))
+        histograms.write(current.observations + [(TURN_METRIC, kind, total)], current.errors)
+
+
+def count(metric, label, amount=1):
+    """Adds amount to a counter in _COUNTER_HELP."""
+    if METRICS_ENABLED:
+        histograms.incr(metric, label, amount)
+
+
+def render_metrics():
+    try:
+        return histograms.render()
+    except Exception as e:
+        log_event(f"Metrics read failed: {e}")
+        return ""
+
+
+histograms = RedisHistograms(redis_conn)
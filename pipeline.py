@@ -0,0 +1,158 @@
+"""
+Thread-based staged pipeline.
+
+Each stage runs its own pool of worker threads and pulls from a bounded
+queue; a worker hands its result to the next stage's queue and blocks while
+that queue is full, so a slow stage (say, a rate-limited SMS sender) holds
+back the stages in front of it instead of letting work pile up in memory.
+Stages can also be capped at a number of calls per minute.
+"""
+
+import queue
+import threading
+import time
+
+from utils import log_event
+
+_STOP = object()
+
+
+class RateLimiter:
+    """Spaces calls evenly so there are at most per_minute of them per minute (0 = no limit)."""
+
+    def __init__(self, per_minute=0):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the next call is allowed; returns the seconds waited."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class Stage:
+    """
+    One pipeline step: func(item) returns the item for the next stage, or
+    None to stop it here. Exceptions are logged and counted, and drop the item.
+    """
+
+    def __init__(self, name, func, workers=1, per_minute=0):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.limiter = RateLimiter(per_minute)
+        self.per_minute = per_minute
+        self._lock = threading.Lock()
+        self._stats = {"processed": 0, "errors": 0, "busy_seconds": 0.0, "throttled_seconds": 0.0}
+
+    def run(self, item):
+        throttled = self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            result = self.func(item)
+            error = False
+        except Exception as e:
+            log_event(f"Pipeline stage {self.name} failed: {e}")
+            result, error = None, True
+        with self._lock:
+            self._stats["processed"] += 1
+            self._stats["errors"] += int(error)
+            self._stats["busy_seconds"] += time.monotonic() - started
+            self._stats["throttled_seconds"] += throttled
+        return result
+
+    def get_stats(self, elapsed):
+        with self._lock:
+            stats = dict(self._stats)
+        minutes = elapsed / 60
+        stats["workers"] = self.workers
+        stats["per_minute_limit"] = self.per_minute
+        # Observed rate, and what the stage could sustain if it were never starved (capped by its limit)
+        stats["items_per_minute"] = round(stats["processed"] / minutes, 1) if minutes else 0.0
+        stats["capacity_per_minute"] = (
+            round(stats["processed"] / stats["busy_seconds"] * 60 * self.workers, 1)
+            if stats["busy_seconds"] else 0.0
+        )
+        if self.per_minute:
+            stats["capacity_per_minute"] = min(stats["capacity_per_minute"], self.per_minute)
+        stats["busy_seconds"] = round(stats["busy_seconds"], 2)
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 2)
+        return stats
+
+
+class Pipeline:
+    """
+    Runs items through stages in order. submit() blocks while the first
+    stage's queue is full; join() waits for every submitted item to finish,
+    close() does too and then stops the threads. Use as a context manager to
+    start and close it.
+    """
+
+    def __init__(self, stages, queue_size=20):
+        self.stages = stages
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._threads = []
+        self._started = None
+        self._elapsed = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        self._started = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(index,),
+                                          name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                self._threads.append((index, thread))
+
+    def submit(self, item):
+        self._queues[0].put(item)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                inbox.task_done()
+                return
+            result = stage.run(item)
+            if result is not None and outbox is not None:
+                outbox.put(result)
+            # Only after the result is in the next queue, so join() sees it there
+            inbox.task_done()
+
+    def join(self):
+        """Waits until every item submitted so far has left the last stage."""
+        for inbox in self._queues:
+            inbox.join()
+
+    def close(self):
+        """Drains the stages front to back, then stops their threads."""
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._queues[index].put(_STOP)
+            for thread_index, thread in self._threads:
+                if thread_index == index:
+                    thread.join()
+        self._elapsed = time.monotonic() - self._started
+
+    def get_stats(self):
+        elapsed = self._elapsed if self._elapsed is not None else time.monotonic() - self._started
+        return {stage.name: stage.get_stats(elapsed) for stage in self.stages}
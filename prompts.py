@@ -0,0 +1,342 @@
+"""
+Prompt templates for the LLM calls: the SMS reply, the CRM state update,
+the cron follow-up and summary compaction.
+
+Every template is compiled once at import and split in two: a static prefix,
+sent as the first system message and byte-identical on every call, and a tail
+holding the per-lead data (dashboard, summary, history, new message). Keeping
+the variable fields out of the prefix lets the provider serve it from its
+prompt cache (OpenAI caches identical prefixes of 1024+ tokens).
+
+get_prompt_stats() reports the prefix size of each template next to the
+average tail it was sent with.
+
+window_history() turns the Core API's message history into the compact,
+token-budgeted view of the dialogue that goes into the tail.
+"""
+
+import os
+import threading
+
+# Rough chars-per-token ratio used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# Conversation history sent with each call: newest messages first, until either limit is hit
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "8"))
+# Chat-format overhead per message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def count_tokens(text):
+    """Token count of text: exact with tiktoken installed, estimated otherwise."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = None
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+TEMPLATES = {}
+
+
+class PromptTemplate:
+    """
+    A prompt made of a static prefix and a str.format() tail.
+    messages() puts the prefix system message in front of the tail messages
+    and records how many tokens the tail added, so the cached and uncached
+    share of every call shows up in get_prompt_stats().
+    """
+
+    def __init__(self, name, prefix, tail=""):
+        self.name = name
+        self.prefix = prefix.strip()
+        self.tail = tail.strip()
+        self.prefix_tokens = count_tokens(self.prefix)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "tail_tokens": 0}
+        TEMPLATES[name] = self
+
+    def render(self, **fields):
+        """Fill the tail with per-lead fields."""
+        return self.tail.format(**fields)
+
+    def messages(self, *tail_messages):
+        """Returns [prefix system message, *tail_messages]."""
+        tail_tokens = sum(count_tokens(m.get("content") or "") for m in tail_messages)
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["tail_tokens"] += tail_tokens
+        return [{"role": "system", "content": self.prefix}, *tail_messages]
+
+    def get_stats(self):
+        with self._lock:
+            calls = self._stats["calls"]
+            tail_tokens = self._stats["tail_tokens"]
+        return {
+            "prefix_tokens": self.prefix_tokens,
+            "calls": calls,
+            "avg_tail_tokens": round(tail_tokens / calls, 1) if calls else 0,
+        }
+
+
+def get_prompt_stats():
+    return {name: template.get_stats() for name, template in TEMPLATES.items()}
+
+
+def window_history(history, budget=HISTORY_TOKEN_BUDGET, max_messages=HISTORY_MAX_MESSAGES):
+    """
+    The most recent messages of a Core API history (most recent first) that
+    fit in `budget` tokens, as chat turns in chronological order. Only the
+    direction and body of each message are kept. The newest message is
+    always included, cut down to the budget if it is longer on its own.
+    """
+    turns = []
+    used = 0
+    for msg in history or []:
+        if len(turns) >= max_messages:
+            break
+        content = (msg.get("message_body") or "").strip()
+        if not content:
+            continue
+        tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > budget:
+            if turns:
+                break
+            content = content[:max(0, budget - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN]
+            tokens = budget
+        role = "user" if msg.get("direction") == "inbound" else "assistant"
+        turns.append({"role": role, "content": content})
+        used += tokens
+    turns.reverse()
+    return turns
+
+
+def format_history(turns):
+    """window_history() turns as plain transcript lines, for prompts that take history as text."""
+    return "\n".join(f"{'Lead' if turn['role'] == 'user' else 'You'}: {turn['content']}" for turn in turns) or "(no messages yet)"
+
+
+# ─── SMS reply (app.generate_smart_reply / stream_smart_reply) ───
+
+REPLY_STATIC = """
+You are Sarah, an AI consultant for **Kalkia Évolution IA** — we help businesses automate and scale using AI.
+The lead's dashboard (name, stage, sentiment, summary) follows these instructions.
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🎯 YOUR MISSION
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+**Goal:** Qualify leads and get them on a call. You succeed when you book a consultation OR get permission to call them.
+
+**Strategy:** DISCOVER → QUALIFY → ESCALATE
+
+1. **DISCOVER** (if you don't know yet):
+   - What's their business or role?
+   - What problem are they trying to solve?
+
+2. **QUALIFY** (gauge fit & urgency):
+   - Are they exploring or actively looking for a solution?
+   - Do they have a timeline? ("soon", "this quarter", "just researching")
+   - Are they the decision-maker or gathering info for someone?
+
+3. **ESCALATE** (based on interest signals):
+   - **Warm signals:** Asks questions, engages positively, mentions a problem
+     → Proactively suggest: "Would a quick call be easier? I can call you in 2 minutes to explain."
+   - **Hot signals:** Asks about pricing, timeline, implementation, or says they're "ready"
+     → Offer immediate call: "Can I call you right now? I can answer everything in a quick 5-min call."
+   - **When they say YES to a call:**
+     → Simply confirm: "Perfect! Calling you now." (The system will trigger a VAPI call automatically)
+     → DO NOT ask for times or check calendar — just get permission and confirm the call is happening
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🛠️ WHAT WE OFFER (match to their need)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+1. **AI Receptionist** – Bilingual, books appointments, takes orders, sends confirmations
+2. **AI Sales Agents** – Makes calls to close deals or capture leads
+3. **AI Chatbots** – Website or business ecosystem integration
+4. **Custom Automation Agents** – Tailored workflows for business processes
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📞 CALL PERMISSION (Primary Goal)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+- Your PRIMARY goal is to get permission to call them immediately
+- Ask: "Can I call you right now?" or "Want a quick call to discuss this?"
+- If YES (during business hours 9AM-8PM ET) → Confirm: "Great! I'll call you in 1 minute."
+- If YES (after business hours) → Suggest next business window: "It's a bit late right now — how about I call you [tomorrow at 9 AM]? That way I can give you my full attention."
+  - If they INSIST ("no, call me now", "I don't mind", "just call") → Confirm: "You got it! Calling you now."
+- If NO/LATER → Ask when: "No problem! When's a good time for me to call?"
+- DO NOT check calendar for immediate calls — just get permission and confirm
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📅 APPOINTMENT BOOKING (Only for Future Scheduled Meetings)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+Use calendar functions ONLY when they want to schedule a future appointment (not immediate calls):
+1. If they mention a specific day/time for a FUTURE meeting → call `get_availability`
+2. If slot is open → ask for their email (you have their phone)
+3. Once you have email → call `book_appointment` to finalize
+⚠️ NEVER say "booked" unless `book_appointment` succeeded.
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+💬 COMMUNICATION STYLE
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+- **Language:** Match the user (English or Quebec French)
+- **Tone:** Warm, consultative, confident — NOT robotic or salesy
+- **Length:** Keep messages short (2-3 sentences max for SMS)
+- **Be proactive:** Suggest immediate calls when they show interest
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🚫 AVOID
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+- Don't over-explain products in text — save details for the call
+- Don't ask multiple questions at once — one question per message
+- Don't check calendar for IMMEDIATE calls — just ask "Can I call you now?"
+- Don't use functions when confirming immediate calls — just text confirmation
+- After confirming call, don't keep chatting — let the phone call happen
+"""
+
+REPLY_DASHBOARD = """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📊 YOUR DASHBOARD
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+- **Lead Name:** {name}
+- **Current Stage:** {intent}
+- **Sentiment:** {sentiment}
+- **Conversation Summary:** "{summary}"
+"""
+
+# CRM fields extracted from every exchange (shared by the two-call and single-call paths)
+CRM_FIELDS_SPEC = """1. "summary": Updated concise summary (include what product/problem they discussed)
+
+2. "sentiment": User's emotional state
+   - "positive" = engaged, interested, friendly
+   - "neutral" = just responding, unclear intent
+   - "negative" = frustrated, annoyed, objecting
+   - "confused" = unclear, asking for clarification
+
+3. "extracted_name": User's name if mentioned (e.g., "I'm Shiva" → "Shiva"), else null
+
+4. "extracted_email": User's email if provided, else null
+
+5. "booking_requested": true if user:
+   - Explicitly asks to book/schedule a FUTURE appointment
+   - Agrees to a call (says "yes", "sure", "ok", "call me" when Sarah offered a call)
+   - Wants a callback or to talk to someone
+
+6. "interest_level": Assess their buying intent
+   - "hot" = mentions timeline, asks about pricing, says they're ready, agrees to call NOW
+   - "warm" = asks questions, engages positively, describes a problem they have
+   - "cold" = short replies, seems uninterested, just browsing
+
+7. "product_interest": Which product they seem most interested in (or null):
+   - "ai_receptionist"
+   - "ai_sales_agent"
+   - "ai_chatbot"
+   - "custom_automation"
+   - null (if unclear)
+
+8. "call_recommended": true if Sarah should offer to call them NOW based on:
+   - They asked multiple questions
+   - They described a specific pain point
+   - Sentiment is positive and they're engaged
+   - They asked about pricing or timeline
+   - They agreed when Sarah offered a call
+
+9. "call_timing": When do they want the call? Only set if booking_requested is true:
+   - "now" = they want an immediate call ("call me", "yes", "sure" in response to call offer)
+   - "scheduled" = they specified a future time ("tomorrow at 2pm", "next week")
+   - "persistent" = they are INSISTING on an immediate call after being told it is after hours
+   - null = no call requested
+
+10. "scheduled_call_time": If call_timing is "scheduled", extract the requested date/time as a string (e.g., "tomorrow at 2pm", "Monday morning"). null otherwise.
+"""
+
+SINGLE_CALL_INSTRUCTIONS = f"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🧾 RESPONSE FORMAT
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+Besides replying, update the CRM records for this exchange. Respond with a single JSON object:
+- "reply": the SMS you send to the lead now (follow every rule above)
+- plus these CRM fields, judged on the whole exchange including your reply:
+
+{CRM_FIELDS_SPEC}
+Return raw JSON only (no markdown formatting).
+"""
+
+REPLY_PROMPT = PromptTemplate("reply", REPLY_STATIC, REPLY_DASHBOARD)
+REPLY_AND_STATE_PROMPT = PromptTemplate("reply_and_state", REPLY_STATIC + SINGLE_CALL_INSTRUCTIONS, REPLY_DASHBOARD)
+
+# ─── CRM state update (app.update_conversation_state) ───
+
+STATE_UPDATE_STATIC = f"""
+Analyze the conversation exchange you are given and update the CRM records.
+
+**Task:** Return a JSON object with these fields:
+
+{CRM_FIELDS_SPEC}
+Return raw JSON only (no markdown formatting).
+"""
+
+STATE_UPDATE_EXCHANGE = """
+**Context:**
+- Old Summary: "{old_summary}"
+- User Message: "{user_input}"
+- Sarah's Reply: "{ai_reply}"
+"""
+
+STATE_UPDATE_PROMPT = PromptTemplate("state_update", STATE_UPDATE_STATIC, STATE_UPDATE_EXCHANGE)
+
+# ─── Summary compaction (summaries.compact_summary) ───
+
+SUMMARY_COMPACT_STATIC = """
+You maintain the CRM summary of an SMS sales conversation with a lead.
+Rewrite the summary you are given so it fits the character limit you are given.
+
+Keep, in this order of priority: what the lead needs and which product they are interested in,
+their objections and open questions, commitments made by either side (calls, demos, prices quoted),
+and personal details they shared. Drop repetition, pleasantries and the play-by-play of who said what.
+
+Write plain prose in the third person. Return only the new summary text.
+"""
+
+SUMMARY_COMPACT_TAIL = """
+Character limit: {max_chars}
+
+Summary:
+"{summary}"
+"""
+
+SUMMARY_COMPACT_PROMPT = PromptTemplate("summary_compact", SUMMARY_COMPACT_STATIC, SUMMARY_COMPACT_TAIL)
+
+# ─── Cron follow-up (cron_worker.generate_smart_followup) ───
+# The prefix names the agent, so it is compiled by cron_worker once AGENT_NAME is known
+
+FOLLOWUP_STATIC = """
+You are {agent_name}, an AI assistant following up with a lead by SMS.
+You are given the lead's name, the conversation summary, the recent message history and the task for this follow-up.
+
+Draft a short, natural, friendly SMS text message (max 160 chars) to send them right now.
+Make sure it feels like a natural continuation of the history.
+Do NOT include quotes around the message. Just return the raw text.
+"""
+
+FOLLOWUP_LEAD = """
+Lead name: {customer_name}
+
+Current conversation summary:
+"{summary}"{product_context}
+
+Recent message history:
+{history}
+
+Task / Instruction for this follow-up:
+{instruction}
+"""
@@ -0,0 +1,187 @@
+"""
+Token-bucket rate limits for outbound calls, kept in Redis so every process
+draws from the same buckets. Limits come from RATE_LIMIT_<UPSTREAM>; Redis
+errors fail open.
+"""
+
+import asyncio
+import math
+import os
+import time
+
+from shared_redis import redis_conn
+from utils import log_event
+
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+# The webhook's wait: the reply still has to fit in Twilio's 15s webhook timeout
+RATE_LIMIT_WEBHOOK_WAIT = float(os.getenv("RATE_LIMIT_WEBHOOK_WAIT", "2"))
+
+# Default requests per minute per upstream (overridden by RATE_LIMIT_<UPSTREAM>)
+DEFAULT_LIMITS = {
+    "openai": "500",
+    "twilio": "60",      # 1 SMS/second per long-code number
+    "vapi": "60",
+    "make": "60",
+    "core_api": "6000/200",  # the Core API's documented 100 req/s, burst 200
+}
+
+# Refills a bucket and takes `requested` tokens if it can.
+# Returns "0" when taken, else the seconds until enough tokens will be there.
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def parse_limit(spec):
+    """'120' or '120/20' -> (tokens per second, burst), or None for unlimited."""
+    if not spec:
+        return None
+    per_minute, _, burst = str(spec).partition("/")
+    per_minute = float(per_minute)
+    if per_minute <= 0:
+        return None
+    # Default burst: one second's worth of requests, at least 1
+    burst = float(burst) if burst else max(1.0, math.ceil(per_minute / 60))
+    return per_minute / 60, burst
+
+
+def load_limits():
+    return {
+        upstream: parse_limit(os.getenv(f"RATE_LIMIT_{upstream.upper()}", default))
+        for upstream, default in DEFAULT_LIMITS.items()
+    }
+
+
+class RateLimitExceeded(Exception):
+    """Raised by RedisRateLimiter.require() when no token came within the wait."""
+
+
+class RedisRateLimiter:
+    """
+    Token buckets in Redis, one hash per (upstream, key). acquire() blocks
+    until a token is available (up to max_wait) and records throttled time;
+    stats live in a Redis hash so they cover every process.
+    """
+
+    def __init__(self, redis_client, limits=None, prefix="ratelimit", max_wait=RATE_LIMIT_MAX_WAIT):
+        self.redis = redis_client
+        self.limits = load_limits() if limits is None else limits
+        self.prefix = prefix
+        self.stats_key = f"{prefix}:stats"
+        self.max_wait = max_wait
+        self._take = redis_client.register_script(TAKE_SCRIPT)
+
+    def _try_take(self, upstream, key, tokens):
+        """Seconds to wait before retrying (0 = taken)."""
+        limit = self.limits.get(upstream)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        bucket = f"{self.prefix}:{upstream}:{key}" if key else f"{self.prefix}:{upstream}"
+        try:
+            return float(self._take(keys=[bucket], args=[rate, burst, time.time(), tokens]))
+        except Exception as e:
+            log_event(f"Rate limiter unavailable for {upstream}, not limiting: {e}")
+            return 0.0
+
+    def _record(self, upstream, waited, acquired):
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hincrby(self.stats_key, f"{upstream}:calls", 1)
+            if waited:
+                pipe.hincrby(self.stats_key, f"{upstream}:throttled", 1)
+                pipe.hincrbyfloat(self.stats_key, f"{upstream}:throttled_seconds", waited)
+            if not acquired:
+                pipe.hincrby(self.stats_key, f"{upstream}:overruns", 1)
+            pipe.execute()
+        except Exception as e:
+            log_event(f"Rate limiter stats failed: {e}")
+
+    def acquire(self, upstream, key=None, tokens=1, block=True, max_wait=None):
+        """
+        Take `tokens` from the (upstream, key) bucket. With block=True, sleeps
+        until they are available or max_wait runs out. Returns True if taken;
+        False means the caller is over the limit (it may still go ahead,
+        which is counted as an overrun).
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            wait = self._try_take(upstream, key, tokens)
+            if not wait:
+                self._record(upstream, waited, True)
+                return True
+            remaining = deadline - time.monotonic()
+            if not block or remaining <= 0:
+                self._record(upstream, waited, False)
+                return False
+            wait = min(wait, remaining)
+            time.sleep(wait)
+            waited += wait
+
+    def require(self, upstream, key=None, tokens=1, max_wait=None):
+        """acquire(), raising RateLimitExceeded instead of returning False."""
+        if not self.acquire(upstream, key, tokens, max_wait=max_wait):
+            raise RateLimitExceeded(f"{upstream} rate limit: no token within the wait")
+
+    async def acquire_async(self, upstream, key=None, tokens=1, max_wait=None):
+        """Async version of acquire()."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self._try_take, upstream, key, tokens)
+            if not wait:
+                await asyncio.to_thread(self._record, upstream, waited, True)
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                await asyncio.to_thread(self._record, upstream, waited, False)
+                return False
+            wait = min(wait, remaining)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def require_async(self, upstream, key=None, tokens=1, max_wait=None):
+        """Awaited require()."""
+        if not await self.acquire_async(upstream, key, tokens, max_wait=max_wait):
+            raise RateLimitExceeded(f"{upstream} rate limit: no token within the wait")
+
+    def get_stats(self):
+        """Per-upstream calls, throttled calls, throttled seconds and overruns."""
+        try:
+            raw = self.redis.hgetall(self.stats_key)
+        except Exception as e:
+            log_event(f"Rate limiter stats failed: {e}")
+            raw = {}
+        stats = {}
+        for field, value in raw.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            upstream, _, name = field.partition(":")
+            value = float(value)
+            stats.setdefault(upstream, {})[name] = round(value, 3) if name == "throttled_seconds" else int(value)
+        for upstream, limit in self.limits.items():
+            entry = stats.setdefault(upstream, {})
+            entry["per_minute"] = round(limit[0] * 60, 1) if limit else None
+            entry["burst"] = limit[1] if limit else None
+        return stats
+
+
+rate_limiter = RedisRateLimiter(redis_conn)
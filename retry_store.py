@@ -0,0 +1,54 @@
+"""
+SMS retry bookkeeping for the cron worker.
+
+Each context_id gets its own counter of failed follow-up sends. Counters
+expire after SMS_RETRY_TTL seconds without a new failure, so contexts that
+are never retried again (deleted leads, changed intents) clean themselves up.
+"""
+
+import os
+
+from utils import log_event
+
+SMS_RETRY_TTL = int(os.getenv("SMS_RETRY_TTL", str(7 * 24 * 3600)))
+
+
+class RedisRetryStore:
+    """
+    Retry counters shared by every cron worker through Redis: one INCR'd key
+    per context_id, so concurrent workers never overwrite each other's counts.
+    Redis errors are logged; a failed read counts as zero retries.
+    """
+
+    def __init__(self, redis_client, ttl=SMS_RETRY_TTL, prefix="sms_retry"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, context_id):
+        return f"{self.prefix}:{context_id}"
+
+    def get(self, context_id):
+        try:
+            count = self.redis.get(self._key(context_id))
+            return int(count) if count is not None else 0
+        except Exception as e:
+            log_event(f"Retry store read failed: {e}")
+            return 0
+
+    def increment(self, context_id):
+        """Count one more failed send and return the new total."""
+        try:
+            pipe = self.redis.pipeline()
+            pipe.incr(self._key(context_id))
+            pipe.expire(self._key(context_id), self.ttl)
+            return int(pipe.execute()[0])
+        except Exception as e:
+            log_event(f"Retry store write failed: {e}")
+            return 0
+
+    def clear(self, context_id):
+        try:
+            self.redis.delete(self._key(context_id))
+        except Exception as e:
+            log_event(f"Retry store write failed: {e}")
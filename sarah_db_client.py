@@ -1,15 +1,153 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import urllib.parse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional, Dict, Any
 
+# Connection pool / retry tuning (overridable per client)
+CORE_API_POOL_SIZE = int(os.getenv('CORE_API_POOL_SIZE', '10'))
+CORE_API_MAX_RETRIES = int(os.getenv('CORE_API_MAX_RETRIES', '3'))
+CORE_API_BACKOFF = float(os.getenv('CORE_API_BACKOFF', '0.3'))
+CORE_API_TIMEOUT = float(os.getenv('CORE_API_TIMEOUT', '10'))
+# Reads sit on the reply's critical path and are safe to retry, so they give up sooner.
+# Writes get longer: a write that times out is not replayed (it may have been applied)
+CORE_API_READ_TIMEOUT = float(os.getenv('CORE_API_READ_TIMEOUT', '5'))
+CORE_API_WRITE_TIMEOUT = float(os.getenv('CORE_API_WRITE_TIMEOUT', str(CORE_API_TIMEOUT)))
+
+# Per-endpoint timeouts in seconds (overridden by CORE_API_TIMEOUT_<ENDPOINT>);
+# anything missing uses CORE_API_TIMEOUT
+DEFAULT_TIMEOUTS = {
+    endpoint: float(os.getenv(f"CORE_API_TIMEOUT_{endpoint.upper()}", default))
+    for endpoint, default in {
+        "get_context": CORE_API_READ_TIMEOUT,
+        "list_customers": CORE_API_READ_TIMEOUT,
+        "create_customer": CORE_API_WRITE_TIMEOUT,
+        "log_message": CORE_API_WRITE_TIMEOUT,
+        "update_conversation": CORE_API_WRITE_TIMEOUT,
+        "update_customer": CORE_API_WRITE_TIMEOUT,
+    }.items()
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Threads for WriteBatch.log_message_now, shared by every batch in the process
+_background_writes = ThreadPoolExecutor(max_workers=CORE_API_POOL_SIZE, thread_name_prefix="core-api-write")
+# Statuses whose Retry-After header sets the retry delay (urllib3's Retry.RETRY_AFTER_STATUS_CODES)
+RETRY_AFTER_STATUSES = (413, 429, 503)
+
+
+VALID_LOOKUP_TYPES = ["id", "email", "phone", "phone_normalized"]
+
+
+# Request builders shared by SarahDBClient and AsyncSarahDBClient, so both
+# clients validate input and shape payloads identically.
+
+def build_customer_payload(email=None, phone=None, name=None, phone_normalized=None) -> Dict[str, Any]:
+    """Payload for POST /customers. At least one of email or phone is required."""
+    if not email and not phone:
+        raise ValueError("At least one of 'email' or 'phone' is required to create a customer")
+
+    payload = {}
+    if email: payload["email"] = email
+    if phone: payload["phone"] = phone
+    if name: payload["name"] = name
+    if phone_normalized: payload["phone_normalized"] = phone_normalized
+    return payload
+
+
+def build_context_path(identifier: str, lookup_by: str) -> str:
+    """Path for GET /context/{identifier}?by={lookup_by}."""
+    if lookup_by not in VALID_LOOKUP_TYPES:
+        raise ValueError(f"Invalid lookup_by '{lookup_by}'. Must be one of {VALID_LOOKUP_TYPES}")
+
+    # URL encode the identifier (critical for emails/phones with +)
+    encoded_id = urllib.parse.quote(identifier, safe='')
+    return f"/context/{encoded_id}?by={lookup_by}"
+
+
+def build_log_payload(customer_id, channel, identifier, direction, body,
+                      context_id=None, subject=None, metadata=None) -> Dict[str, Any]:
+    """Payload for POST /log."""
+    payload = {
+        "customer_id": customer_id,
+        "channel": channel,
+        "channel_identifier": identifier,
+        "direction": direction,
+        "message_body": body
+    }
+
+    if context_id:
+        payload["context_id"] = context_id
+    if subject:
+        payload["message_subject"] = subject
+    if metadata:
+        payload["metadata"] = metadata
+    return payload
+
+
+def build_conversation_payload(context_id, summary=None, intent=None, sentiment=None,
+                               last_agent_action=None, open_questions=None) -> Dict[str, Any]:
+    """Payload for POST /conversation/{context_id}/update. Empty fields are dropped."""
+    if not context_id:
+         raise ValueError("Context ID is required for update")
+
+    payload = {}
+    if summary: payload["summary"] = summary
+    if intent: payload["intent"] = intent
+    if sentiment: payload["sentiment"] = sentiment
+    if last_agent_action: payload["last_agent_action"] = last_agent_action
+    if open_questions: payload["open_questions"] = open_questions
+    return payload
+
+
+def build_customer_update_payload(customer_id, name=None, email=None, company=None) -> Dict[str, Any]:
+    """Payload for PUT /customers/{customer_id}. Empty fields are dropped."""
+    if not customer_id:
+        raise ValueError("Customer ID is required for update")
+
+    payload = {}
+    if name: payload["name"] = name
+    if email: payload["email"] = email
+    if company: payload["company"] = company
+    return payload
+
+
+class CoreAPIRetry(Retry):
+    """
+    Retry policy for the Core API.
+    GET/PUT are retried on 429 and 5xx. POST (log, create, update) is only
+    replayed on 429, where the gateway rejected it before it was processed,
+    so a retry can never double-log a message.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == "POST" and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
 class SarahDBClient:
     """
     Client for the Lead Conversation Management System API.
     Base URL configurable via CORE_API_URL environment variable.
+    All calls share one pooled keep-alive Session, so consecutive calls reuse
+    the same TCP+TLS connection to the API Gateway.
     """
     
-    def __init__(self, api_key: str, base_url: Optional[str] = None):
+    def __init__(self,
+                 api_key: str,
+                 base_url: Optional[str] = None,
+                 pool_size: Optional[int] = None,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 max_retries: Optional[int] = None,
+                 backoff_factor: Optional[float] = None,
+                 cache=None,
+                 rate_limiter=None,
+                 rate_limit_wait: Optional[float] = None,
+                 circuit_breaker=None):
         if not api_key:
             raise ValueError("API Key is required")
         self.api_key = api_key
@@ -19,9 +157,103 @@ class SarahDBClient:
         )
         self.headers = {
             "x-api-key": self.api_key,
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Connection": "keep-alive"
+        }
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        retry = CoreAPIRetry(
+            total=CORE_API_MAX_RETRIES if max_retries is None else max_retries,
+            read=0,  # Never replay a request the server may already be processing
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "PUT", "POST"]),
+            backoff_factor=CORE_API_BACKOFF if backoff_factor is None else backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        self.pool_size = pool_size or CORE_API_POOL_SIZE
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self._stats_lock = threading.Lock()
+        self._request_count = 0
+
+        # Optional read-through cache for get_context (see context_cache.py);
+        # every write below invalidates the affected customer's entry.
+        self.cache = cache
+        # Optional shared token bucket (see rate_limiter.py), taken before every request;
+        # a request that gets no token within rate_limit_wait seconds is not sent
+        self.rate_limiter = rate_limiter
+        self.rate_limit_wait = rate_limit_wait
+        # Optional breaker (see circuit_breaker.py): while open, requests fail fast
+        # with a ConnectionError instead of waiting out retries and timeouts
+        self.circuit_breaker = circuit_breaker
+
+    def _request(self, endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request on the pooled session with the endpoint's timeout."""
+        kwargs.setdefault("timeout", self.timeouts.get(endpoint, CORE_API_TIMEOUT))
+        if self.rate_limiter and not self.rate_limiter.acquire("core_api", max_wait=self.rate_limit_wait):
+            raise requests.exceptions.ConnectionError("Core API rate limit reached")
+        if self.circuit_breaker and not self.circuit_breaker.allow():
+            raise requests.exceptions.ConnectionError("Core API circuit open")
+        with self._stats_lock:
+            self._request_count += 1
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            if self.circuit_breaker:
+                self.circuit_breaker.record_failure(e)
+            raise
+        if self.circuit_breaker:
+            # Status seen after CoreAPIRetry gave up, so one failure per exhausted request
+            if resp.status_code >= 500 or resp.status_code == 429:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+        return resp
+
+    def get_connection_stats(self) -> Dict[str, int]:
+        """
+        Connection reuse counters for the pooled session.
+        connections_reused is how many requests skipped a TCP+TLS handshake.
+        """
+        opened = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        with self._stats_lock:
+            requests_sent = self._request_count
+        return {
+            "requests": requests_sent,
+            "connections_opened": opened,
+            "connections_reused": max(requests_sent - opened, 0),
+            "pool_size": self.pool_size
         }
 
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters of the context cache (empty if disabled)."""
+        if not self.cache:
+            return {}
+        stats = self.cache.get_stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
     def create_customer(self, 
                        email: Optional[str] = None, 
                        phone: Optional[str] = None, 
@@ -31,19 +263,11 @@ class SarahDBClient:
         Create a new customer.
         At least one of email or phone is required.
         """
-        if not email and not phone:
-            raise ValueError("At least one of 'email' or 'phone' is required to create a customer")
-            
-        payload = {}
-        if email: payload["email"] = email
-        if phone: payload["phone"] = phone
-        if name: payload["name"] = name
-        if phone_normalized: payload["phone_normalized"] = phone_normalized
-        
+        payload = build_customer_payload(email, phone, name, phone_normalized)
         url = f"{self.base_url}/customers"
         
         try:
-            resp = requests.post(url, json=payload, headers=self.headers, timeout=10)
+            resp = self._request("create_customer", "POST", url, json=payload)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.RequestException as e:
@@ -53,7 +277,7 @@ class SarahDBClient:
         """List all customers."""
         url = f"{self.base_url}/customers?limit={limit}&offset={offset}"
         try:
-            resp = requests.get(url, headers=self.headers, timeout=10)
+            resp = self._request("list_customers", "GET", url)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.RequestException as e:
@@ -65,19 +289,20 @@ class SarahDBClient:
         identifier: The value to look up (e.g., "john@example.com", "+1555...")
         lookup_by: "id", "email", "phone", or "phone_normalized" (default "id")
         """
-        valid_types = ["id", "email", "phone", "phone_normalized"]
-        if lookup_by not in valid_types:
-            raise ValueError(f"Invalid lookup_by '{lookup_by}'. Must be one of {valid_types}")
+        url = f"{self.base_url}{build_context_path(identifier, lookup_by)}"
+
+        if self.cache:
+            cached = self.cache.get(lookup_by, identifier)
+            if cached is not None:
+                return cached
 
-        # URL encode the identifier (critical for emails/phones with +)
-        encoded_id = urllib.parse.quote(identifier, safe='')
-        
-        url = f"{self.base_url}/context/{encoded_id}?by={lookup_by}"
-        
         try:
-            resp = requests.get(url, headers=self.headers, timeout=10)
+            resp = self._request("get_context", "GET", url)
             resp.raise_for_status()
-            return resp.json()
+            context = resp.json()
+            if self.cache:
+                self.cache.set(lookup_by, identifier, context)
+            return context
         except requests.exceptions.RequestException as e:
             # Handle 404 gracefully? Or let caller handle?
             # For now, re-raise with context
@@ -96,29 +321,19 @@ class SarahDBClient:
         Log an inbound or outbound message.
         Returns: Dict containing 'log_id' and 'context_id'
         """
-        payload = {
-            "customer_id": customer_id,
-            "channel": channel,
-            "channel_identifier": identifier,
-            "direction": direction,
-            "message_body": body
-        }
-        
-        if context_id:
-            payload["context_id"] = context_id
-        if subject:
-            payload["message_subject"] = subject
-        if metadata:
-            payload["metadata"] = metadata
-
+        payload = build_log_payload(customer_id, channel, identifier, direction, body,
+                                    context_id, subject, metadata)
         url = f"{self.base_url}/log"
         
         try:
-            resp = requests.post(url, json=payload, headers=self.headers, timeout=10)
+            resp = self._request("log_message", "POST", url, json=payload)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to log message: {str(e)}")
+        finally:
+            if self.cache:
+                self.cache.invalidate_customer(customer_id)
 
     def update_conversation(self, 
                             context_id: str, 
@@ -132,16 +347,8 @@ class SarahDBClient:
         Uses context_id (not customer_id) as per API spec.
         Only provide fields you want to update.
         """
-        if not context_id:
-             raise ValueError("Context ID is required for update")
-
-        payload = {}
-        if summary: payload["summary"] = summary
-        if intent: payload["intent"] = intent
-        if sentiment: payload["sentiment"] = sentiment
-        if last_agent_action: payload["last_agent_action"] = last_agent_action
-        if open_questions: payload["open_questions"] = open_questions
-
+        payload = build_conversation_payload(context_id, summary, intent, sentiment,
+                                             last_agent_action, open_questions)
         if not payload:
             return {"status": "no_changes"}
 
@@ -149,22 +356,18 @@ class SarahDBClient:
         url = f"{self.base_url}/conversation/{context_id}/update"
         
         try:
-            resp = requests.post(url, json=payload, headers=self.headers, timeout=10)
+            resp = self._request("update_conversation", "POST", url, json=payload)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to update conversation {context_id}: {str(e)}")
+        finally:
+            if self.cache:
+                self.cache.invalidate_context(context_id)
 
     def update_customer(self, customer_id: int, name: Optional[str] = None, email: Optional[str] = None, company: Optional[str] = None) -> Dict[str, Any]:
         """Update existing customer details by ID."""
-        if not customer_id:
-            raise ValueError("Customer ID is required for update")
-        
-        payload = {}
-        if name: payload["name"] = name
-        if email: payload["email"] = email
-        if company: payload["company"] = company
-        
+        payload = build_customer_update_payload(customer_id, name, email, company)
         if not payload:
             return {"status": "no_changes"}
             
@@ -172,11 +375,138 @@ class SarahDBClient:
         
         try:
             # Using PUT based on API Guide v2 (or POST if the API supports it interchangeably)
-            resp = requests.put(url, json=payload, headers=self.headers, timeout=10)
+            resp = self._request("update_customer", "PUT", url, json=payload)
             if resp.status_code in [404, 405]:
                 # Fallback to POST if PUT is rejected by API Gateway config
-                resp = requests.post(url, json=payload, headers=self.headers, timeout=10)
+                resp = self._request("update_customer", "POST", url, json=payload)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to update customer {customer_id}: {str(e)}")
+        finally:
+            if self.cache:
+                self.cache.invalidate_customer(customer_id)
+
+    def batch(self) -> "WriteBatch":
+        """Start a unit of work that coalesces this client's writes (see WriteBatch)."""
+        return WriteBatch(self)
+
+
+class WriteBatch:
+    """
+    Unit of work for one conversation turn.
+
+    Queues log_message / update_conversation / update_customer calls and sends
+    them together on flush(). update_conversation and update_customer calls for
+    the same id are merged field by field (last write wins), so a turn that
+    updates the conversation three times costs one POST.
+
+    On flush, messages are logged first and in order (history order follows
+    insertion order, and the conversation update marks logged messages as
+    processed), then the merged updates go out concurrently on the pooled
+    session. Use as a context manager to flush on exit.
+
+    log_message_now() is for a write other readers must see at once (the
+    lead's inbound message): it goes out right away on a background thread,
+    and flush() waits for it before sending anything queued.
+    """
+
+    def __init__(self, client: SarahDBClient):
+        self.client = client
+        self._logs = []
+        self._conversations: Dict[str, Dict[str, Any]] = {}
+        self._customers: Dict[Any, Dict[str, Any]] = {}
+        self._started = []
+        self.queued = 0
+        self.sent = 0
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def log_message(self, customer_id, channel, identifier, direction, body,
+                    context_id=None, subject=None, metadata=None):
+        """Queue a message log. Validated now so bad input fails at the call site."""
+        build_log_payload(customer_id, channel, identifier, direction, body, context_id, subject, metadata)
+        self._logs.append(dict(customer_id=customer_id, channel=channel, identifier=identifier,
+                               direction=direction, body=body, context_id=context_id,
+                               subject=subject, metadata=metadata))
+        self.queued += 1
+
+    def log_message_now(self, customer_id, channel, identifier, direction, body,
+                        context_id=None, subject=None, metadata=None):
+        """Start sending a message log now, ahead of everything queued."""
+        build_log_payload(customer_id, channel, identifier, direction, body, context_id, subject, metadata)
+        self._started.append(_background_writes.submit(
+            self._send, self.client.log_message, customer_id=customer_id, channel=channel,
+            identifier=identifier, direction=direction, body=body, context_id=context_id,
+            subject=subject, metadata=metadata))
+        self.queued += 1
+
+    def update_conversation(self, context_id, summary=None, intent=None, sentiment=None,
+                            last_agent_action=None, open_questions=None):
+        """Queue a conversation update, merged into any pending one for context_id."""
+        fields = build_conversation_payload(context_id, summary, intent, sentiment,
+                                            last_agent_action, open_questions)
+        if not fields:
+            return
+        self._conversations.setdefault(context_id, {}).update(fields)
+        self.queued += 1
+
+    def update_customer(self, customer_id, name=None, email=None, company=None):
+        """Queue a customer update, merged into any pending one for customer_id."""
+        fields = build_customer_update_payload(customer_id, name, email, company)
+        if not fields:
+            return
+        self._customers.setdefault(customer_id, {}).update(fields)
+        self.queued += 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._started) + len(self._logs) + len(self._conversations) + len(self._customers)
+
+    def flush(self) -> Dict[str, int]:
+        """Send all queued writes and return get_stats(). Failures are collected in self.errors, not raised."""
+        started, self._started = self._started, []
+        for future in started:
+            future.result()
+        self.sent += len(started)
+
+        logs, self._logs = self._logs, []
+        conversations, self._conversations = self._conversations, {}
+        customers, self._customers = self._customers, {}
+
+        for entry in logs:
+            self._send(self.client.log_message, **entry)
+        self.sent += len(logs)
+
+        updates = [(self.client.update_conversation, dict(context_id=cid, **fields))
+                   for cid, fields in conversations.items()]
+        updates += [(self.client.update_customer, dict(customer_id=cid, **fields))
+                    for cid, fields in customers.items()]
+        if len(updates) == 1:
+            self._send(updates[0][0], **updates[0][1])
+        elif updates:
+            with ThreadPoolExecutor(max_workers=len(updates)) as executor:
+                for future in [executor.submit(self._send, func, **kwargs) for func, kwargs in updates]:
+                    future.result()
+        self.sent += len(updates)
+
+        return self.get_stats()
+
+    def _send(self, func, **kwargs):
+        try:
+            func(**kwargs)
+        except Exception as e:
+            self.errors.append(str(e))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "coalesced": self.queued - self.sent - self.pending,
+            "errors": len(self.errors)
+        }
@@ -0,0 +1,14 @@
+"""
+The Redis connection shared by the limiter, breakers, leases and metrics.
+"""
+
+import os
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+redis_conn = redis.Redis.from_url(REDIS_URL)
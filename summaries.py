@@ -0,0 +1,181 @@
+"""
+Bounded conversation summaries.
+
+The Core API stores one free-text `summary` per conversation, and every
+prompt embeds it. It has two parts:
+
+    <narrative written by the CRM state update>
+
+    [events] call: scheduled for Tue 2pm | followups: 2 sent, last FOLLOWUP_1 on 2026-03-02
+
+System events (follow-ups sent, calls offered or scheduled, failed SMS) go
+in the events line, one slot per kind, replaced rather than appended, so
+they cannot grow the summary. Older summaries carry the same events as
+free-text tags ("[System Update] ...", "[CALL SCHEDULED] ..."); parse_summary()
+folds those into the events line the next time the summary is written.
+
+The narrative is only compacted when the whole summary goes over
+SUMMARY_MAX_CHARS. It is then rewritten to SUMMARY_TARGET_CHARS, so the
+next few turns fit without another rewrite. The rewrite is one LLM call,
+and falls back to keeping the most recent sentences if that call fails.
+"""
+
+import os
+import re
+from datetime import datetime, timezone
+
+import openai
+from dotenv import load_dotenv
+
+from circuit_breaker import breakers
+from metrics import span
+from prompts import SUMMARY_COMPACT_PROMPT
+from rate_limiter import rate_limiter
+
+load_dotenv()
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5.2")
+# Compact once a summary is longer than this; compact down to the target
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "1200"))
+SUMMARY_TARGET_CHARS = int(os.getenv("SUMMARY_TARGET_CHARS", "800"))
+
+EVENTS_MARKER = "[events]"
+
+# Free-text tags older code appended to the summary, and the event each one becomes
+LEGACY_TAGS = [
+    (re.compile(r"\[System Update\][^\[\n]*"), "followup"),
+    (re.compile(r"\[CALL PENDING\]\s*([^\[\n]*)"), "call_pending"),
+    (re.compile(r"\[CALL SCHEDULED\]\s*([^\[\n]*)"), "call_scheduled"),
+    (re.compile(r"\[SMS FAILED after (\d+) attempts\][^\[\n]*"), "sms_failed"),
+]
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def parse_summary(summary):
+    """(narrative, events) for a stored summary; events maps kind -> text, in order."""
+    summary = summary or ""
+    narrative, _, events_line = summary.partition(EVENTS_MARKER)
+    events = {}
+    for part in events_line.split("|"):
+        key, sep, value = part.partition(":")
+        if sep and key.strip():
+            events[key.strip()] = value.strip()
+
+    # Older summaries: fold appended tags into events
+    for pattern, kind in LEGACY_TAGS:
+        for match in pattern.finditer(narrative):
+            if kind == "followup":
+                events["followups"] = _count_followup(events.get("followups"))
+            elif kind == "call_pending":
+                events["call"] = f"offered, {match.group(1).strip().rstrip('.')}"
+            elif kind == "call_scheduled":
+                events["call"] = f"scheduled for {match.group(1).strip()}"
+            elif kind == "sms_failed":
+                events["sms"] = f"failed after {match.group(1)} attempts"
+        narrative = pattern.sub("", narrative)
+    return narrative.strip(), events
+
+
+def render_summary(narrative, events):
+    narrative = (narrative or "").strip()
+    if not events:
+        return narrative
+    line = f"{EVENTS_MARKER} " + " | ".join(f"{key}: {value}" for key, value in events.items())
+    return f"{narrative}\n\n{line}" if narrative else line
+
+
+def narrative_of(summary):
+    """The summary without its events line (what the state update LLM rewrites)."""
+    return parse_summary(summary)[0]
+
+
+def _count_followup(current, intent=None):
+    match = re.match(r"(\d+)", current or "")
+    sent = int(match.group(1)) + 1 if match else 1
+    last = f", last {intent} on {_today()}" if intent else ""
+    return f"{sent} sent{last}"
+
+
+def with_event(summary, kind, value):
+    """summary with the `kind` event slot set to value (replacing any earlier one)."""
+    narrative, events = parse_summary(summary)
+    events.pop(kind, None)
+    events[kind] = value
+    return render_summary(narrative, events)
+
+
+def with_followup_sent(summary, intent):
+    """summary with one more automatic follow-up counted."""
+    narrative, events = parse_summary(summary)
+    followups = _count_followup(events.pop("followups", None), intent)
+    events["followups"] = followups
+    return render_summary(narrative, events)
+
+
+def merge_summary(old_summary, new_narrative):
+    """A freshly written narrative with the events of the summary it replaces."""
+    _, events = parse_summary(old_summary)
+    narrative, new_events = parse_summary(new_narrative)
+    events.update(new_events)
+    return render_summary(narrative, events)
+
+
+def _keep_recent_sentences(narrative, max_chars):
+    """Offline fallback: the latest sentences that fit in max_chars."""
+    sentences = re.split(r"(?<=[.!?])\s+", narrative.strip())
+    kept = []
+    length = 0
+    for sentence in reversed(sentences):
+        if length + len(sentence) + 1 > max_chars:
+            break
+        kept.append(sentence)
+        length += len(sentence) + 1
+    if not kept:
+        return narrative[-max_chars:]
+    return " ".join(reversed(kept))
+
+
+def summarize_with_llm(narrative, max_chars):
+    """Rewrites narrative to at most max_chars with the LLM (None on failure)."""
+    messages = SUMMARY_COMPACT_PROMPT.messages({
+        "role": "user",
+        "content": SUMMARY_COMPACT_PROMPT.render(max_chars=max_chars, summary=narrative)
+    })
+    try:
+        rate_limiter.acquire("openai", OPENAI_MODEL)
+        with span("openai.summary_compact"):
+            completion = breakers["openai"].call(
+                openai.ChatCompletion.create,
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_completion_tokens=max_chars // 3,
+                temperature=0.2
+            )
+        text = (completion.choices[0].message.content or "").strip().strip('"')
+        return text or None
+    except Exception as e:
+        print(f"DEBUG: Summary compaction failed, keeping recent sentences: {e}")
+        return None
+
+
+def compact_summary(summary, max_chars=SUMMARY_MAX_CHARS, target_chars=SUMMARY_TARGET_CHARS,
+                    summarize=summarize_with_llm):
+    """
+    summary normalized to narrative + events, with the narrative rewritten
+    down to target_chars only if the whole is over max_chars.
+    `summarize(narrative, max_chars)` does the rewrite (LLM by default).
+    """
+    narrative, events = parse_summary(summary)
+    rendered = render_summary(narrative, events)
+    if len(rendered) <= max_chars:
+        return rendered
+
+    budget = max(100, target_chars - (len(rendered) - len(narrative)))
+    print(f"DEBUG: Compacting summary ({len(rendered)} chars > {max_chars})")
+    compacted = summarize(narrative, budget) if summarize else None
+    if not compacted or len(compacted) > budget:
+        compacted = _keep_recent_sentences(compacted or narrative, budget)
+    return render_summary(compacted, events)
@@ -2,10 +2,16 @@
 # Uses `rq` worker to send messages after a delay
 
 from rq import Queue
+from rq.job import Dependency, Job, JobStatus
 import os
+import uuid
 import redis
-from twilio.rest import Client
 from utils import log_event
+from rate_limiter import rate_limiter
+from circuit_breaker import breakers
+from conversation_locks import conversation_locks, ConversationBusy, CONVERSATION_LOCK_JOB_WAIT
+from metrics import span, turn
+from upstream_clients import upstream_clients
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -15,11 +21,60 @@ redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 redis_client = redis.Redis.from_url(redis_url)
 q = Queue(connection=redis_client)
 
-TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
-TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+# Shared pooled client (see upstream_clients.py); credentials come from the same env vars
+client = upstream_clients.twilio
+
+# How long a per-key job chain is remembered (longer than any job should take)
+JOB_CHAIN_TTL = 3600
+# Longest an enqueue waits for another enqueue on the same key (it only holds the lock for a few ms)
+JOB_CHAIN_LOCK_WAIT = 5
+
+def enqueue_in_order(key, func, *args):
+    """
+    Enqueues func(*args) so jobs sharing `key` run one after another, in the
+    order they were enqueued, even with several rq workers: each job depends
+    on the previous job for the key. A failed job does not block the chain.
+
+    Publishing a job id and saving the job happen under a per-key lock, so
+    the next enqueue never sees an id whose job is not in Redis yet.
+    """
+    job_id = str(uuid.uuid4())
+    chain_key = f"job_chain:{key}"
+    lock = redis_client.lock(f"{chain_key}:lock", timeout=JOB_CHAIN_LOCK_WAIT * 2,
+                             blocking_timeout=JOB_CHAIN_LOCK_WAIT)
+    try:
+        locked = lock.acquire()
+        if not locked:
+            log_event(f"Job chain lock for {key} still held after {JOB_CHAIN_LOCK_WAIT}s, enqueueing without it")
+    except Exception as e:
+        log_event(f"Job chain lock unavailable for {key}: {e}")
+        locked = False
+    try:
+        pipe = redis_client.pipeline()
+        pipe.getset(chain_key, job_id)
+        pipe.expire(chain_key, JOB_CHAIN_TTL)
+        previous_id = pipe.execute()[0]
+
+        depends_on = None
+        if previous_id:
+            previous_id = previous_id.decode() if isinstance(previous_id, bytes) else previous_id
+            try:
+                status = Job.fetch(previous_id, connection=redis_client).get_status()
+            except Exception:
+                status = None  # Expired: its job finished long ago
+            # rq only defers on unfinished dependencies; a failed one would park the job forever
+            if status not in (None, JobStatus.FINISHED, JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+                depends_on = Dependency(jobs=[previous_id], allow_failure=True)
+
+        return q.enqueue(func, *args, job_id=job_id, depends_on=depends_on)
+    finally:
+        if locked:
+            try:
+                lock.release()
+            except Exception as e:
+                log_event(f"Job chain lock release failed for {key}: {e}")
 
 def schedule_follow_up(phone_number, campaign_step):
     """
@@ -49,11 +104,14 @@ def schedule_follow_up(phone_number, campaign_step):
     if message_body:
         # Send SMS via Twilio
         try:
-            message = client.messages.create(
-                body=message_body.replace('{{AGENT_NAME}}', os.getenv('AGENT_NAME', 'Wonderbot')),
-                from_=TWILIO_PHONE_NUMBER,
-                to=phone_number
-            )
+            rate_limiter.acquire("twilio", TWILIO_PHONE_NUMBER)
+            with span("twilio_send"):
+                message = breakers["twilio"].call(
+                    client.messages.create,
+                    body=message_body.replace('{{AGENT_NAME}}', os.getenv('AGENT_NAME', 'Wonderbot')),
+                    from_=TWILIO_PHONE_NUMBER,
+                    to=phone_number
+                )
             log_event(f"Sent {campaign_step} to {phone_number}: {message.sid}")
             
             # Schedule next step if applicable
@@ -62,3 +120,56 @@ def schedule_follow_up(phone_number, campaign_step):
                 
         except Exception as e:
             log_event(f"Failed to send SMS to {phone_number}: {str(e)}")
+
+def reply_to_inbound_sms(sender, body, coalesce=False):
+    """
+    Runs an inbound SMS turn off the webhook (SMS_REPLY_MODE=async) and
+    sends the reply through the Twilio REST API instead of TwiML.
+    With coalesce, body leads a burst: wait for the rest and answer them all.
+    """
+    # Imported here: app imports this module to enqueue the job
+    from app import process_sms_turn, collect_burst
+
+    messages = 1
+    if coalesce:
+        body, messages = collect_burst(sender, body)
+
+    def send(chunk):
+        try:
+            rate_limiter.acquire("twilio", TWILIO_PHONE_NUMBER)
+            with span("twilio_send"):
+                message = breakers["twilio"].call(
+                    client.messages.create,
+                    body=chunk,
+                    from_=TWILIO_PHONE_NUMBER,
+                    to=sender
+                )
+            log_event(f"Sent reply to {sender}: {message.sid}")
+        except Exception as e:
+            log_event(f"Failed to send reply to {sender}: {str(e)}")
+
+    # Streamed bubbles go out through send() as they are generated; the rest after
+    with turn("sms_async", messages=messages):
+        try:
+            chunks = process_sms_turn(sender, body, on_chunk=send, lock_wait=CONVERSATION_LOCK_JOB_WAIT)
+        except ConversationBusy as e:
+            # The holder keeps renewing its lease (a long follow-up); try again behind it
+            log_event(f"{e}, re-queueing the turn for {sender}")
+            enqueue_in_order(f"sender:{sender}", reply_to_inbound_sms, sender, body)
+            return
+        for chunk in chunks:
+            send(chunk)
+
+def apply_conversation_state_job(context_data, customer_id, context_id, body, reply_text, state_updates=None):
+    """Deferred CRM state stage for one SMS exchange (chained per context_id)."""
+    from app import apply_conversation_state
+
+    # Waits for the turn that enqueued it (or a follow-up) to let go of the conversation
+    with turn("state_update"), conversation_locks.hold(context_id, wait=CONVERSATION_LOCK_JOB_WAIT) as lease:
+        if lease is None:
+            log_event(f"{context_id} still busy after {CONVERSATION_LOCK_JOB_WAIT}s, re-queueing its state update")
+            enqueue_in_order(f"context:{context_id}", apply_conversation_state_job,
+                             context_data, customer_id, context_id, body, reply_text, state_updates)
+            return
+        apply_conversation_state(context_data, customer_id, context_id, body, reply_text, state_updates,
+                                 refresh=True, lease=lease)
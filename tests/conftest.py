@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+import redis
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The Core API stub lives with the benchmarks (benchmarks/stubs.py)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# app.py needs these at import; tests point its clients at the stubs themselves
+for key, value in {"CORE_API_KEY": "test", "OPENAI_API_KEY": "test",
+                   "TWILIO_ACCOUNT_SID": "ACtest", "TWILIO_AUTH_TOKEN": "test"}.items():
+    os.environ.setdefault(key, value)
+
+# A database of its own, emptied around every test that uses it
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+@pytest.fixture
+def redis_client():
+    """A real Redis for the Lua scripts and expiries; the test is skipped when none is running."""
+    client = redis.Redis.from_url(TEST_REDIS_URL)
+    try:
+        client.flushdb()
+    except redis.exceptions.ConnectionError:
+        pytest.skip(f"no Redis at {TEST_REDIS_URL}")
+    yield client
+    client.flushdb()
@@ -0,0 +1,54 @@
+"""async_app's inbound turn against the upstream stubs."""
+
+import asyncio
+
+import openai
+import pytest
+
+import async_app
+from async_sarah_db_client import AsyncSarahDBClient
+from stubs import REPLY_TEXT, StubUpstreams
+
+NEW_LEAD = "+15550000009"
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    with StubUpstreams(latency={"core_api": 0, "openai": 0}, record=True) as stubs:
+        monkeypatch.setattr(async_app, "db_client",
+                            AsyncSarahDBClient(api_key="test", base_url=stubs.core_api_url, backoff_factor=0))
+        monkeypatch.setattr(openai, "api_base", stubs.openai_api_base)
+        yield stubs
+
+
+def run_turn(sender, body):
+    async def run():
+        try:
+            return await async_app.process_sms_turn(sender, body)
+        finally:
+            await async_app.close_clients(None)
+    return asyncio.run(run())
+
+
+def test_new_lead_is_created_and_answered(stubs, monkeypatch):
+    handed_off = []
+    monkeypatch.setattr(async_app, "defer_state_update", lambda *args: handed_off.append(args))
+
+    chunks = run_turn(NEW_LEAD, "Hi, what does this cost?")
+
+    assert " ".join(chunks) == REPLY_TEXT
+    assert [(method, path) for method, path, _, _ in stubs.core_requests] == [
+        ("GET", "/context/%2B15550000009"), ("POST", "/customers"), ("GET", "/context/%2B15550000009"),
+        ("POST", "/log"), ("POST", "/log"),
+    ]
+    context = stubs.store.lookup(NEW_LEAD, "phone_normalized")
+    assert [m["direction"] for m in context["history"]] == ["outbound", "inbound"]
+    # The CRM update gets the new customer's ids
+    assert handed_off[0][1:3] == (context["customer_id"], context["context_id"])
+
+
+def test_core_api_errors_other_than_404_create_nothing(stubs):
+    stubs.fail_core(500, 500, 500, 500)
+    assert run_turn(NEW_LEAD, "Hi") == []
+    assert all(method == "GET" for method, _, _, _ in stubs.core_requests)
+    assert stubs.store.lookup(NEW_LEAD, "phone_normalized") is None
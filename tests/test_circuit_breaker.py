@@ -0,0 +1,53 @@
+"""CircuitBreaker's window and half-open probe, against a real Redis."""
+
+import time
+
+from circuit_breaker import CircuitBreaker
+
+
+def make_breaker(redis_client, failure_window=60):
+    return CircuitBreaker(redis_client, "test", failure_threshold=3, failure_window=failure_window, reset_timeout=1)
+
+
+def test_intermittent_failures_trip_the_breaker(redis_client):
+    breaker = make_breaker(redis_client)
+    for _ in range(3):
+        breaker.record_failure()
+        breaker.record_success()
+    assert breaker.state() == "open"
+    assert not breaker.allow()
+
+
+def test_failures_outside_the_window_are_forgotten(redis_client):
+    breaker = make_breaker(redis_client, failure_window=1)
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(1.1)
+    breaker.record_failure()
+    assert breaker.state() == "closed"
+    assert breaker.get_stats()["failures"] == 1
+
+
+def test_half_open_lets_one_probe_through(redis_client):
+    breaker = make_breaker(redis_client)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(1.1)
+    assert breaker.state() == "half_open"
+    assert not breaker.is_open()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state() == "closed"
+    assert breaker.allow()
+
+
+def test_a_failed_probe_opens_the_breaker_again(redis_client):
+    breaker = make_breaker(redis_client)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(1.1)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state() == "open"
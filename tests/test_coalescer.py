@@ -0,0 +1,32 @@
+"""Joining a burst of texts, and RedisMessageCoalescer against a real Redis."""
+
+from app import STOP_KEYWORDS
+from coalescer import RedisMessageCoalescer, join_messages
+
+SENDER = "+15550000001"
+
+
+def test_burst_is_joined_in_order():
+    assert join_messages(["hi", "", "what does it cost?"], STOP_KEYWORDS) == "hi\nwhat does it cost?"
+
+
+def test_stop_in_a_burst_is_the_whole_turn():
+    assert join_messages(["hi", "STOP", "thanks"], STOP_KEYWORDS) == "STOP"
+    assert join_messages(["hi", "unsubscribe"], STOP_KEYWORDS) == "unsubscribe"
+    # Only a text that is a keyword on its own counts
+    assert join_messages(["don't stop texting me"], STOP_KEYWORDS) == "don't stop texting me"
+
+
+def test_texts_within_the_window_join_the_leaders_burst(redis_client):
+    coalescer = RedisMessageCoalescer(redis_client, window=0.2, max_wait=2)
+    assert coalescer.add(SENDER, "hi")
+    assert not coalescer.add(SENDER, "STOP")
+    assert coalescer.collect(SENDER, "hi") == ["hi", "STOP"]
+    # The burst is drained: the next text leads a new one
+    assert coalescer.add(SENDER, "hello?")
+
+
+def test_disabled_coalescer_never_waits():
+    coalescer = RedisMessageCoalescer(None, window=0)
+    assert coalescer.add(SENDER, "hi")
+    assert coalescer.collect(SENDER, "hi") == ["hi"]
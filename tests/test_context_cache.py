@@ -0,0 +1,56 @@
+"""RedisContextCache's aliases, invalidation and expiry, against a real Redis."""
+
+import time
+
+from context_cache import RedisContextCache
+
+PHONE = "+15550000001"
+CONTEXT = {"customer_id": 1, "context_id": "ctx-1", "intent": "interested", "summary": "Asked about pricing"}
+
+
+def make_cache(redis_client, **kwargs):
+    return RedisContextCache(redis_client, prefix="test_ctxcache", **kwargs)
+
+
+def test_a_context_cached_by_phone_is_found_by_phone_and_id(redis_client):
+    cache = make_cache(redis_client)
+    cache.set("phone_normalized", PHONE, CONTEXT)
+    assert cache.get("phone_normalized", PHONE) == CONTEXT
+    assert cache.get("id", "1") == CONTEXT
+    assert cache.get("phone_normalized", "+15559999999") is None
+
+
+def test_invalidating_the_customer_id_invalidates_the_phone_alias(redis_client):
+    cache = make_cache(redis_client)
+    cache.set("phone_normalized", PHONE, CONTEXT)
+    cache.invalidate_customer(1)
+    assert cache.get("phone_normalized", PHONE) is None
+    assert cache.get("id", "1") is None
+
+
+def test_invalidating_the_context_id_invalidates_every_lookup(redis_client):
+    cache = make_cache(redis_client)
+    cache.set("phone_normalized", PHONE, CONTEXT)
+    cache.invalidate_context("ctx-1")
+    assert cache.get("phone_normalized", PHONE) is None
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_entries_expire_after_the_ttl(redis_client):
+    cache = make_cache(redis_client, ttl=1)
+    cache.set("phone_normalized", PHONE, CONTEXT)
+    assert cache.get("phone_normalized", PHONE) == CONTEXT
+    time.sleep(1.1)
+    assert cache.get("phone_normalized", PHONE) is None
+    assert cache.get("id", "1") is None
+
+
+def test_least_recently_used_entries_are_evicted(redis_client):
+    cache = make_cache(redis_client, max_entries=2)
+    for customer_id in (1, 2):
+        cache.set("id", str(customer_id), dict(CONTEXT, customer_id=customer_id, context_id=f"ctx-{customer_id}"))
+    cache.get("id", "1")
+    cache.set("id", "3", dict(CONTEXT, customer_id=3, context_id="ctx-3"))
+    assert cache.get("id", "2") is None
+    assert cache.get("id", "1") is not None
+    assert cache.get_stats()["evictions"] == 1
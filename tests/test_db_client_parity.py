@@ -0,0 +1,189 @@
+"""
+SarahDBClient and AsyncSarahDBClient against the Core API stub: each call
+must give the same result (or fail the same way) and send the same requests,
+retries included.
+"""
+
+import asyncio
+import socket
+
+import pytest
+
+from async_sarah_db_client import AsyncSarahDBClient
+from sarah_db_client import SarahDBClient
+from stubs import StubUpstreams
+
+PHONE = "+15550000001"
+
+
+def make_stubs():
+    stubs = StubUpstreams(latency={"core_api": 0}, record=True)
+    stubs.start()
+    stubs.store.add("Ada", PHONE, intent="WAITING_FOR_ANSWER")
+    stubs.store.add("Grace", "+15550000002", intent="interested")
+    return stubs
+
+
+def run_sync(stubs, calls):
+    client = SarahDBClient(api_key="test", base_url=stubs.core_api_url, backoff_factor=0)
+    results = []
+    try:
+        for name, args, kwargs in calls:
+            try:
+                results.append(getattr(client, name)(*args, **kwargs))
+            except Exception as e:
+                results.append(e)
+        return results, client.get_connection_stats()["requests"]
+    finally:
+        client.close()
+
+
+def run_async(stubs, calls):
+    async def run():
+        results = []
+        async with AsyncSarahDBClient(api_key="test", base_url=stubs.core_api_url, backoff_factor=0) as client:
+            for name, args, kwargs in calls:
+                try:
+                    results.append(await getattr(client, name)(*args, **kwargs))
+                except Exception as e:
+                    results.append(e)
+            return results, client.get_connection_stats()["requests"]
+    return asyncio.run(run())
+
+
+def both(calls, faults=()):
+    """Runs calls on each client against its own fresh stub; returns a (results, requests, count) per client."""
+    outcomes = []
+    for runner in (run_sync, run_async):
+        stubs = make_stubs()
+        try:
+            stubs.fail_core(*faults)
+            results, count = runner(stubs, calls)
+            outcomes.append((results, list(stubs.core_requests), count))
+        finally:
+            stubs.stop()
+    return outcomes
+
+
+def comparable(result):
+    """Exceptions as (type, message prefix); generated ids dropped."""
+    if isinstance(result, Exception):
+        return type(result), str(result).split(":")[0]
+    if isinstance(result, dict):
+        return {k: v for k, v in result.items() if k not in ("log_id", "last_interaction_at", "history")}
+    return result
+
+
+def assert_same(calls, faults=()):
+    (sync_results, sync_requests, sync_count), (async_results, async_requests, async_count) = both(calls, faults)
+    assert [comparable(r) for r in sync_results] == [comparable(r) for r in async_results]
+    assert sync_requests == async_requests
+    assert sync_count == async_count
+    return sync_results, sync_requests
+
+
+def test_get_context_by_phone_and_id():
+    results, requests = assert_same([
+        ("get_context", (PHONE,), {"lookup_by": "phone_normalized"}),
+        ("get_context", ("2",), {}),
+    ])
+    assert results[0]["customer"]["phone_normalized"] == PHONE
+    assert results[1]["intent"] == "interested"
+    # The + in the phone number is sent encoded
+    assert requests[0][:3] == ("GET", "/context/%2B15550000001", {"by": ["phone_normalized"]})
+
+
+def test_get_context_not_found():
+    results, _ = assert_same([("get_context", ("+15559999999",), {"lookup_by": "phone"})])
+    assert str(results[0]).startswith("Failed to get context for +15559999999")
+
+
+def test_invalid_arguments_raise_before_any_request():
+    results, requests = assert_same([
+        ("get_context", (PHONE,), {"lookup_by": "name"}),
+        ("create_customer", (), {}),
+        ("update_conversation", ("",), {"summary": "x"}),
+    ])
+    assert all(isinstance(r, ValueError) for r in results)
+    assert requests == []
+
+
+def test_list_customers():
+    results, requests = assert_same([("list_customers", (), {"limit": 1, "offset": 1})])
+    assert [c["name"] for c in results[0]["customers"]] == ["Grace"]
+    assert requests[0][2] == {"limit": ["1"], "offset": ["1"]}
+
+
+def test_writes_send_the_same_payloads():
+    results, requests = assert_same([
+        ("create_customer", (), {"phone": "+15550000003", "phone_normalized": "+15550000003", "name": "Lin"}),
+        ("log_message", (1, "sms", PHONE, "inbound", "hi"), {"context_id": "ctx-1", "metadata": {"sid": "SM1"}}),
+        ("update_conversation", ("ctx-1",), {"summary": "Asked about pricing", "intent": "interested"}),
+        ("update_customer", (1,), {"name": "Ada L", "email": "ada@example.com"}),
+    ])
+    assert results[1]["context_id"] == "ctx-1"
+    assert [(method, path) for method, path, _, _ in requests] == [
+        ("POST", "/customers"), ("POST", "/log"), ("POST", "/conversation/ctx-1/update"), ("PUT", "/customers/1"),
+    ]
+    assert requests[1][3] == {"customer_id": 1, "channel": "sms", "channel_identifier": PHONE,
+                              "direction": "inbound", "message_body": "hi", "context_id": "ctx-1",
+                              "metadata": {"sid": "SM1"}}
+
+
+def test_empty_updates_send_nothing():
+    results, requests = assert_same([
+        ("update_conversation", ("ctx-1",), {}),
+        ("update_customer", (1,), {}),
+    ])
+    assert results == [{"status": "no_changes"}, {"status": "no_changes"}]
+    assert requests == []
+
+
+def test_update_customer_falls_back_to_post():
+    results, requests = assert_same([("update_customer", (99,), {"name": "Nobody"})])
+    assert str(results[0]).startswith("Failed to update customer 99")
+    assert [method for method, _, _, _ in requests] == ["PUT", "POST"]
+
+
+def test_reads_are_retried_on_5xx():
+    results, requests = assert_same([("get_context", ("1",), {})], faults=(503, 502))
+    assert results[0]["context_id"] == "ctx-1"
+    assert len(requests) == 3
+
+
+def test_reads_give_up_after_max_retries():
+    results, requests = assert_same([("get_context", ("1",), {})], faults=(503, 503, 503, 503))
+    assert str(results[0]).startswith("Failed to get context for 1")
+    assert len(requests) == 4
+
+
+def test_posts_are_not_replayed_on_5xx():
+    results, requests = assert_same([("log_message", (1, "sms", PHONE, "inbound", "hi"), {})], faults=(500,))
+    assert str(results[0]).startswith("Failed to log message")
+    assert len(requests) == 1
+
+
+def test_posts_are_replayed_on_429():
+    results, requests = assert_same([("log_message", (1, "sms", PHONE, "inbound", "hi"), {})], faults=(429,))
+    assert "context_id" in results[0]
+    assert len(requests) == 2
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_connection_refused():
+    url = f"http://127.0.0.1:{closed_port()}/core"
+    sync_client = SarahDBClient(api_key="test", base_url=url, backoff_factor=0)
+    with pytest.raises(Exception, match="Failed to list customers"):
+        sync_client.list_customers()
+
+    async def run():
+        async with AsyncSarahDBClient(api_key="test", base_url=url, backoff_factor=0) as client:
+            await client.list_customers()
+
+    with pytest.raises(Exception, match="Failed to list customers"):
+        asyncio.run(run())
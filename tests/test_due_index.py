@@ -0,0 +1,36 @@
+"""FollowupDueIndex's claims, against a real Redis."""
+
+import time
+
+from due_index import FollowupDueIndex
+
+STRATEGY = {"WAITING_FOR_ANSWER": {"wait_minutes": 60, "next_intent": "FOLLOWUP_1"}}
+
+
+def make_index(redis_client, claim_seconds=60):
+    return FollowupDueIndex(redis_client, STRATEGY, prefix="test_due", claim_seconds=claim_seconds)
+
+
+def test_popped_entries_are_claimed_not_handed_out_twice(redis_client):
+    index = make_index(redis_client)
+    index.schedule("ctx-1", 1, "WAITING_FOR_ANSWER", time.time() - 7200)
+    assert index.pop_due() == [("ctx-1", "1")]
+    assert index.pop_due() == []
+
+
+def test_an_unacked_claim_is_due_again_once_it_runs_out(redis_client):
+    index = make_index(redis_client, claim_seconds=1)
+    index.schedule("ctx-1", 1, "WAITING_FOR_ANSWER", time.time() - 7200)
+    assert index.pop_due() == [("ctx-1", "1")]
+    time.sleep(1.1)
+    assert index.pop_due() == [("ctx-1", "1")]
+
+
+def test_rescheduling_acks_the_claim(redis_client):
+    index = make_index(redis_client, claim_seconds=1)
+    index.schedule("ctx-1", 1, "WAITING_FOR_ANSWER", time.time() - 7200)
+    index.pop_due()
+    index.schedule("ctx-1", 1, "WAITING_FOR_ANSWER")
+    time.sleep(1.1)
+    assert index.pop_due() == []
+    assert index.size() == 1
@@ -0,0 +1,66 @@
+"""MessageSid claims and replays, in the store and through the webhook."""
+
+import pytest
+
+import app
+from idempotency import RedisIdempotencyStore
+
+SID = "SM0000000000000000000000000000001"
+TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response><Message>Hi!</Message></Response>'
+
+
+@pytest.fixture
+def store(redis_client):
+    return RedisIdempotencyStore(redis_client, wait=0.3)
+
+
+def test_duplicate_gets_the_stored_response(store):
+    assert store.claim(SID)
+    assert not store.claim(SID)
+    # Still in flight: the duplicate gives up after its wait
+    assert store.response_for(SID) is None
+    store.complete(SID, TWIML)
+    assert store.response_for(SID) == TWIML
+    assert store.get_stats() == {"duplicates": 1, "in_flight_timeouts": 1, "replayed": 1}
+
+
+def test_released_claim_can_be_taken_again(store):
+    assert store.claim(SID)
+    store.release(SID)
+    assert store.response_for(SID) is None
+    assert store.claim(SID)
+
+
+@pytest.fixture
+def webhook(store, monkeypatch):
+    turns = []
+
+    def respond_to_sms(sender, body):
+        turns.append(body)
+        if body == "fail":
+            raise RuntimeError("Core API down")
+        return TWIML
+
+    monkeypatch.setattr(app, "inbound_dedupe", store)
+    monkeypatch.setattr(app, "respond_to_sms", respond_to_sms)
+    client = app.app.test_client()
+
+    def deliver(body):
+        return client.post("/sms/inbound", data={"From": "+15550000001", "Body": body, "MessageSid": SID})
+    deliver.turns = turns
+    return deliver
+
+
+def test_twilio_retry_replays_the_twiml_without_a_second_turn(webhook):
+    first = webhook("Hi")
+    retry = webhook("Hi")
+    assert first.get_data(as_text=True) == TWIML
+    assert retry.get_data(as_text=True) == TWIML
+    assert webhook.turns == ["Hi"]
+
+
+def test_failed_turn_releases_its_claim(webhook):
+    assert webhook("fail").status_code == 500
+    # The retry runs the turn again instead of waiting on a claim nobody will complete
+    assert webhook("Hi").get_data(as_text=True) == TWIML
+    assert webhook.turns == ["fail", "Hi"]
@@ -0,0 +1,74 @@
+"""Pipeline backpressure and shutdown."""
+
+import threading
+import time
+
+from pipeline import Pipeline, Stage
+
+
+def test_full_queues_block_submit():
+    release = threading.Event()
+    done = []
+
+    def deliver(item):
+        release.wait(5)
+        done.append(item)
+
+    submitted = []
+
+    def submit_all(pipeline):
+        for item in range(6):
+            pipeline.submit(item)
+            submitted.append(item)
+
+    with Pipeline([Stage("draft", lambda item: item), Stage("send", deliver)], queue_size=1) as pipeline:
+        submitter = threading.Thread(target=submit_all, args=(pipeline,))
+        submitter.start()
+        time.sleep(0.3)
+        # One item in each worker, one in each queue; the fifth submit waits for room
+        assert submitted == [0, 1, 2, 3]
+        release.set()
+        submitter.join(5)
+    assert submitted == list(range(6))
+    assert done == list(range(6))
+
+
+def test_close_drains_every_submitted_item():
+    done = []
+
+    def deliver(item):
+        time.sleep(0.01)
+        done.append(item)
+
+    pipeline = Pipeline([Stage("draft", lambda item: item * 2, workers=3), Stage("send", deliver)])
+    pipeline.start()
+    for item in range(10):
+        pipeline.submit(item)
+    pipeline.close()
+    assert sorted(done) == [item * 2 for item in range(10)]
+    assert pipeline.get_stats()["send"]["processed"] == 10
+
+
+def test_join_waits_without_stopping_the_stages():
+    done = []
+    with Pipeline([Stage("send", done.append)]) as pipeline:
+        pipeline.submit("first")
+        pipeline.join()
+        assert done == ["first"]
+        pipeline.submit("second")
+    assert done == ["first", "second"]
+
+
+def test_a_failing_item_is_dropped_and_counted():
+    done = []
+
+    def draft(item):
+        if item == "bad":
+            raise ValueError("no context")
+        return item
+
+    with Pipeline([Stage("draft", draft), Stage("send", done.append)]) as pipeline:
+        for item in ("a", "bad", "b"):
+            pipeline.submit(item)
+    assert done == ["a", "b"]
+    assert pipeline.get_stats()["draft"]["errors"] == 1
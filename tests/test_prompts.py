@@ -0,0 +1,46 @@
+"""Windowing the Core API history into chat turns."""
+
+from prompts import MESSAGE_OVERHEAD_TOKENS, count_tokens, window_history
+
+
+def message(direction, body):
+    return {"direction": direction, "message_body": body, "created_at": "2026-01-01T00:00:00Z"}
+
+
+def test_newest_first_history_comes_back_in_chronological_order():
+    history = [message("outbound", "Sure, Tuesday works."), message("inbound", "Can we talk Tuesday?"),
+               message("outbound", "Hi! How can I help?")]
+    assert window_history(history) == [
+        {"role": "assistant", "content": "Hi! How can I help?"},
+        {"role": "user", "content": "Can we talk Tuesday?"},
+        {"role": "assistant", "content": "Sure, Tuesday works."},
+    ]
+
+
+def test_stops_at_the_token_budget():
+    bodies = [f"message number {n} " * 5 for n in range(10)]
+    per_message = max(count_tokens(body.strip()) for body in bodies) + MESSAGE_OVERHEAD_TOKENS
+    turns = window_history([message("inbound", body) for body in bodies], budget=per_message * 3, max_messages=50)
+    # The newest messages that fit, oldest of them first
+    assert [turn["content"] for turn in turns] == [body.strip() for body in reversed(bodies[:3])]
+
+
+def test_stops_at_max_messages_and_skips_empty_bodies():
+    history = [message("inbound", str(n)) for n in range(5)]
+    history.insert(1, message("outbound", "  "))
+    assert [turn["content"] for turn in window_history(history, max_messages=3)] == ["2", "1", "0"]
+
+
+def test_oversized_newest_message_is_cut_to_the_budget():
+    long_body = "word " * 500
+    turns = window_history([message("inbound", long_body), message("outbound", "Hi!")], budget=50)
+    # Only the newest message, cut down; nothing older fits beside it
+    assert len(turns) == 1
+    assert turns[0]["role"] == "user"
+    assert long_body.startswith(turns[0]["content"])
+    assert len(turns[0]["content"]) < len(long_body.strip())
+
+
+def test_no_history():
+    assert window_history(None) == []
+    assert window_history([]) == []
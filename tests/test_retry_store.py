@@ -0,0 +1,32 @@
+"""RedisRetryStore's counters, against a real Redis."""
+
+import time
+
+from retry_store import RedisRetryStore
+
+
+def test_failures_are_counted_per_context(redis_client):
+    store = RedisRetryStore(redis_client, prefix="test_retry")
+    assert store.get("ctx-1") == 0
+    assert [store.increment("ctx-1") for _ in range(3)] == [1, 2, 3]
+    assert store.increment("ctx-2") == 1
+    assert store.get("ctx-1") == 3
+
+
+def test_clear_resets_the_count(redis_client):
+    store = RedisRetryStore(redis_client, prefix="test_retry")
+    store.increment("ctx-1")
+    store.clear("ctx-1")
+    assert store.get("ctx-1") == 0
+
+
+def test_counts_expire_after_the_ttl_without_a_new_failure(redis_client):
+    store = RedisRetryStore(redis_client, ttl=1, prefix="test_retry")
+    store.increment("ctx-1")
+    time.sleep(0.6)
+    # A new failure restarts the TTL
+    assert store.increment("ctx-1") == 2
+    time.sleep(0.6)
+    assert store.get("ctx-1") == 2
+    time.sleep(0.6)
+    assert store.get("ctx-1") == 0
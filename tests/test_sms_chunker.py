@@ -0,0 +1,45 @@
+"""SmsChunker must give the same bubbles as split_sms() however the text is streamed."""
+
+import random
+
+import pytest
+
+from stubs import REPLY_TEXT
+from utils import SMS_CHUNK_WIDTH, SmsChunker, split_sms
+
+WORDS = ["hi", "there,", "we", "can", "book", "you", "tomorrow", "at", "2pm.", "\n", "ok!",
+         "x" * (SMS_CHUNK_WIDTH + 20)]  # longer than a bubble: split_sms never breaks words
+
+
+def stream(text, sizes):
+    """Feeds text to a chunker in pieces of the given sizes (cycled); returns every bubble it gave."""
+    chunker = SmsChunker()
+    bubbles = []
+    start = 0
+    for size in sizes:
+        if start >= len(text):
+            break
+        bubbles += chunker.feed(text[start:start + size])
+        start += size
+    bubbles += chunker.feed(text[start:])
+    return bubbles + chunker.close()
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 50, 1000])
+def test_fixed_size_pieces_match_split_sms(size):
+    text = " ".join([REPLY_TEXT] * 8)
+    assert stream(text, [size] * len(text)) == split_sms(text)
+
+
+def test_random_pieces_of_random_replies_match_split_sms():
+    rng = random.Random(7)
+    for _ in range(50):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 80))).strip()
+        sizes = [rng.randint(1, 40) for _ in range(len(text))]
+        assert stream(text, sizes) == split_sms(text)
+
+
+def test_only_final_bubbles_are_given_before_close():
+    chunker = SmsChunker()
+    assert chunker.feed("short reply") == []
+    assert chunker.close() == ["short reply"]
@@ -0,0 +1,63 @@
+"""Summary events: legacy tags, slot replacement, merging and compaction."""
+
+from summaries import compact_summary, merge_summary, parse_summary, with_event, with_followup_sent
+
+NARRATIVE = "Owns a dental clinic, wants to automate appointment reminders."
+
+
+def test_legacy_tags_fold_into_the_events_line():
+    legacy = (f"{NARRATIVE} [System Update] Automatic follow-up sent."
+              " [System Update] Automatic follow-up sent."
+              " [CALL PENDING] Call offered, awaiting confirmation."
+              " [CALL SCHEDULED] Tue 2pm"
+              " [SMS FAILED after 3 attempts] Will retry later.")
+    narrative, events = parse_summary(legacy)
+    assert narrative == NARRATIVE
+    assert events == {"followups": "2 sent", "call": "scheduled for Tue 2pm", "sms": "failed after 3 attempts"}
+    assert compact_summary(legacy) == (
+        f"{NARRATIVE}\n\n[events] followups: 2 sent | call: scheduled for Tue 2pm | sms: failed after 3 attempts"
+    )
+
+
+def test_events_replace_their_slot_instead_of_growing():
+    summary = with_event(NARRATIVE, "call", "offered, awaiting confirmation")
+    summary = with_event(summary, "sms", "failed after 3 attempts")
+    summary = with_event(summary, "call", "scheduled for Tue 2pm")
+    assert summary == f"{NARRATIVE}\n\n[events] sms: failed after 3 attempts | call: scheduled for Tue 2pm"
+    assert parse_summary(summary) == (NARRATIVE, {"sms": "failed after 3 attempts", "call": "scheduled for Tue 2pm"})
+
+
+def test_followups_are_counted():
+    summary = with_followup_sent(with_followup_sent(NARRATIVE, "FOLLOWUP_1"), "FOLLOWUP_2")
+    assert parse_summary(summary)[1]["followups"].startswith("2 sent, last FOLLOWUP_2 on ")
+
+
+def test_merge_keeps_the_old_events_with_the_new_narrative():
+    old = with_event(with_followup_sent("Asked about pricing.", "FOLLOWUP_1"), "call", "offered, tomorrow")
+    merged = merge_summary(old, f"{NARRATIVE} [CALL SCHEDULED] Wed 10am")
+    narrative, events = parse_summary(merged)
+    assert narrative == NARRATIVE
+    assert events["call"] == "scheduled for Wed 10am"
+    assert events["followups"].startswith("1 sent")
+
+
+def test_compaction_rewrites_only_the_narrative():
+    long_summary = with_event("The lead asked about pricing. " * 40, "call", "scheduled for Tue 2pm")
+    calls = []
+
+    def summarize(narrative, max_chars):
+        calls.append(max_chars)
+        return "Asked about pricing repeatedly."
+
+    compacted = compact_summary(long_summary, max_chars=300, target_chars=200, summarize=summarize)
+    assert compacted == "Asked about pricing repeatedly.\n\n[events] call: scheduled for Tue 2pm"
+    # A summary under the limit is left alone
+    assert compact_summary(compacted, max_chars=300, summarize=summarize) == compacted
+    assert len(calls) == 1
+
+
+def test_compaction_falls_back_to_recent_sentences():
+    narrative = " ".join(f"Sentence {n}." for n in range(100))
+    compacted = compact_summary(narrative, max_chars=300, target_chars=200, summarize=lambda *args: None)
+    assert len(compacted) <= 200
+    assert compacted.endswith("Sentence 99.")
@@ -0,0 +1,56 @@
+"""UpstreamClients against the upstream stubs: pooling, reuse counters and timeouts."""
+
+import openai
+import openai.api_requestor
+import pytest
+import requests
+
+from stubs import StubUpstreams
+from upstream_clients import UpstreamClients
+
+
+@pytest.fixture
+def stubs():
+    with StubUpstreams(latency={"openai": 0, "make": 0}) as stubs:
+        yield stubs
+
+
+def test_calls_reuse_one_connection(stubs):
+    clients = UpstreamClients()
+    for _ in range(5):
+        assert clients.session("make").post(stubs.make_url, json={}).status_code == 200
+    stats = clients.get_stats()["make"]
+    assert (stats["requests"], stats["connections_opened"], stats["connections_reused"]) == (5, 1, 4)
+
+
+def test_reuse_counters_survive_closed_pools(stubs):
+    clients = UpstreamClients()
+    session = clients.session("make")
+    session.post(stubs.make_url, json={})
+    session.close()  # Clears the pools; the next call has to open a new connection
+    session.post(stubs.make_url, json={})
+    stats = clients.get_stats()["make"]
+    assert (stats["requests"], stats["connections_opened"], stats["connections_reused"]) == (2, 2, 0)
+
+
+def test_upstream_timeout_caps_longer_caller_timeouts(stubs):
+    stubs.latency["make"] = 0.5
+    clients = UpstreamClients(timeouts={"make": 0.1})
+    with pytest.raises(requests.exceptions.Timeout):
+        clients.session("make").post(stubs.make_url, json={}, timeout=30)
+
+
+def test_openai_sdk_cannot_close_the_shared_pool(stubs, monkeypatch):
+    clients = UpstreamClients()
+    monkeypatch.setattr(openai, "api_base", stubs.openai_api_base)
+    monkeypatch.setattr(openai, "api_key", "test")
+    monkeypatch.setattr(openai, "requestssession", clients.sdk_session("openai"))
+    # Every call is past the SDK's session lifetime, so it closes its session and makes a new one
+    monkeypatch.setattr(openai.api_requestor, "MAX_SESSION_LIFETIME_SECS", 0)
+
+    for _ in range(3):
+        completion = openai.ChatCompletion.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+        assert completion.choices[0].message.content
+
+    stats = clients.get_stats()["openai"]
+    assert (stats["requests"], stats["connections_opened"], stats["connections_reused"]) == (3, 1, 2)
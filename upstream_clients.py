@@ -0,0 +1,156 @@
+"""
+Keep-alive HTTP sessions for openai, make, vapi and twilio (the Core API has
+its own in sarah_db_client.py), with per-upstream timeouts from
+HTTP_TIMEOUT_<UPSTREAM>.
+"""
+
+import os
+import threading
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+load_dotenv()
+
+# Connections kept open per upstream host; at least the number of threads calling it
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+# Default seconds per upstream (overridden by HTTP_TIMEOUT_<UPSTREAM>)
+DEFAULT_TIMEOUTS = {
+    "openai": "60",    # a long completion; the SDK's own default is 600s
+    "make": "10",
+    "vapi": "15",
+    "twilio": "10",
+}
+
+
+def _counting_pool(pool_class, adapter):
+    """pool_class, counting each new connection on adapter."""
+
+    class CountingPool(pool_class):
+        def _new_conn(self):
+            with adapter._stats_lock:
+                adapter.connections_opened += 1
+            return super()._new_conn()
+
+    return CountingPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that caps each request at the upstream's timeout and counts
+    requests sent and connections opened. The counts are kept on the adapter,
+    so they survive the pools being cleared by close().
+    """
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.connections_opened = 0
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _counting_pool(pool_class, self)
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None or (isinstance(timeout, (int, float)) and timeout > self.timeout):
+            timeout = self.timeout
+        with self._stats_lock:
+            self.requests_sent += 1
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class SharedSession:
+    """
+    A shared Session handed to code that closes the session it is given.
+    The OpenAI SDK closes its per-thread session every few minutes, which
+    on the shared one would drop every thread's pooled connections.
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class UpstreamClients:
+    """One pooled Session per upstream, plus the Twilio Client built on the twilio one."""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeouts=None):
+        self.pool_size = pool_size
+        self.timeouts = {
+            name: float(os.getenv(f"HTTP_TIMEOUT_{name.upper()}", default))
+            for name, default in DEFAULT_TIMEOUTS.items()
+        }
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self._lock = threading.Lock()
+        self._adapters = {}
+        self._sessions = {}
+        self._twilio = None
+
+    def _mount(self, name, session):
+        adapter = PooledHTTPAdapter(self.timeouts[name], pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._adapters[name] = adapter
+
+    def session(self, name):
+        """The shared Session for upstream `name`, created on first use."""
+        with self._lock:
+            if name not in self._sessions:
+                session = requests.Session()
+                session.headers["Connection"] = "keep-alive"
+                self._mount(name, session)
+                self._sessions[name] = session
+            return self._sessions[name]
+
+    def sdk_session(self, name):
+        """A factory for openai.requestssession: every SDK thread gets the shared Session, unclosable."""
+        return lambda: SharedSession(self.session(name))
+
+    @property
+    def twilio(self):
+        """The shared Twilio REST Client (credentials from TWILIO_ACCOUNT_SID/TWILIO_AUTH_TOKEN)."""
+        with self._lock:
+            if self._twilio is None:
+                http_client = TwilioHttpClient(pool_connections=True, timeout=self.timeouts["twilio"])
+                self._mount("twilio", http_client.session)
+                self._twilio = Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"),
+                                      http_client=http_client)
+            return self._twilio
+
+    def get_stats(self):
+        """
+        Per upstream used so far: requests, connections opened, connections
+        reused (requests that skipped a TCP+TLS handshake), pool size and timeout.
+        """
+        stats = {}
+        for name, adapter in list(self._adapters.items()):
+            with adapter._stats_lock:
+                requests_sent = adapter.requests_sent
+                opened = adapter.connections_opened
+            stats[name] = {
+                "requests": requests_sent,
+                "connections_opened": opened,
+                "connections_reused": max(requests_sent - opened, 0),
+                "pool_size": self.pool_size,
+                "timeout": adapter.timeout
+            }
+        return stats
+
+
+# One connection pool per upstream
+upstream_clients = UpstreamClients()
@@ -1,5 +1,8 @@
 import logging
 import os
+import textwrap
+
+SMS_CHUNK_WIDTH = 300
 
 def log_event(message):
     """
@@ -31,3 +34,43 @@ def is_human_handoff_needed(message_body):
             return True
             
     return False
+
+def split_sms(text):
+    """
+    Splits a reply into SMS bubbles.
+    Split message if > 160 chars to avoid carrier truncation issues
+    Ideally keep under 1600 total (Twilio limit), but split into chunks for delivery order
+    Using 300 to allow slightly longer cohesive thoughts per bubble if carrier supports concatenation
+    """
+    # NOTE: textwrap.wrap returns a list of strings
+    return textwrap.wrap(text, width=SMS_CHUNK_WIDTH, break_long_words=False, replace_whitespace=False)
+
+class SmsChunker:
+    """
+    Incremental split_sms() for streamed replies.
+    feed() returns the bubbles that can no longer change as text arrives;
+    close() returns the rest. The concatenated output always equals
+    split_sms() on the full text, so streamed and TwiML replies match.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._emitted = 0
+
+    @property
+    def text(self):
+        return self._text
+
+    def feed(self, text):
+        self._text += text
+        lines = split_sms(self._text)
+        # Every bubble but the last is final: the next word already overflowed it
+        ready = lines[self._emitted:-1]
+        self._emitted += len(ready)
+        return ready
+
+    def close(self):
+        lines = split_sms(self._text)
+        rest = lines[self._emitted:]
+        self._emitted = len(lines)
+        return rest
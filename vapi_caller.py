@@ -4,7 +4,10 @@ Handles business hours checks, call scheduling, and VAPI API integration.
 """
 
 import os
-import requests
+from rate_limiter import rate_limiter
+from circuit_breaker import breakers
+from metrics import span
+from upstream_clients import upstream_clients
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
@@ -12,6 +15,7 @@ from zoneinfo import ZoneInfo
 VAPI_API_KEY = os.getenv("VAPI_API_KEY")
 VAPI_ASSISTANT_ID = os.getenv("VAPI_ASSISTANT_ID")
 VAPI_PHONE_NUMBER_ID = os.getenv("VAPI_PHONE_NUMBER_ID")
+VAPI_API_URL = os.getenv("VAPI_API_URL", "https://api.vapi.ai/call/phone")
 
 # Business hours config
 BUSINESS_TZ = ZoneInfo(os.getenv("BUSINESS_TIMEZONE", "America/Toronto"))
@@ -106,16 +110,25 @@ def trigger_vapi_call(phone, customer_name, summary, product_interest=None, inte
         }
     }
 
+    if not breakers["vapi"].allow():
+        print(f"⚡ VAPI circuit open, not calling {phone}")
+        return {"success": False, "error": "VAPI circuit open"}
+
     try:
-        resp = requests.post(
-            "https://api.vapi.ai/call/phone",
-            headers={
-                "Authorization": f"Bearer {VAPI_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json=payload,
-            timeout=15
-        )
+        rate_limiter.acquire("vapi")
+        with span("vapi_call"):
+            resp = upstream_clients.session("vapi").post(
+                VAPI_API_URL,
+                headers={
+                    "Authorization": f"Bearer {VAPI_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json=payload
+            )
+        if resp.status_code >= 500 or resp.status_code == 429:
+            breakers["vapi"].record_failure()
+        else:
+            breakers["vapi"].record_success()
 
         data = resp.json()
 
@@ -129,5 +142,7 @@ def trigger_vapi_call(phone, customer_name, summary, product_interest=None, inte
             return {"success": False, "error": error_msg}
 
     except Exception as e:
+        if not isinstance(e, ValueError):  # a bad JSON body was already counted above
+            breakers["vapi"].record_failure(e)
         print(f"❌ VAPI call exception: {e}")
         return {"success": False, "error": str(e)}